@@ -0,0 +1,103 @@
+"""Micro-benchmark of the Alsterfood menu parser on a saved menu page.
+
+Compares the previous parser (full page with ``html.parser``, rescanning all cards
+per candidate date and all rows per dish) with the current one for every
+available parser backend.
+
+Usage:
+
+    python benchmarks/benchmark_alsterfood_parsing.py [--fixture PATH] [--repeat N]
+"""
+
+import argparse
+import logging
+import os
+import re
+import timeit
+from datetime import datetime, timedelta
+
+from bs4 import BeautifulSoup
+
+from lunchbot.alsterfood_scraping import parse_lunch_menu
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "alsterfood.html")
+# the fixture contains the week from Monday 12.10.2026 to Friday 16.10.2026,
+# parsing for the Sunday before also exercises the "next date" search
+FIXTURE_DATE = datetime(2026, 10, 11)
+
+
+def legacy_parse_lunch_menu(page_source: str, date: datetime):
+    """The parser before the rewrite, without logging and hashing."""
+    soup = BeautifulSoup(page_source, "html.parser")
+    card_divs = soup.find_all("div", class_="card-content black-text")
+
+    todays_card = None
+    for i in range(8):
+        next_date = (date + timedelta(days=i)).strftime("%d.%m.%Y")
+        for card_div in card_divs:
+            title_div = card_div.find("div", class_="card-title primary-text")
+            if title_div and next_date in title_div.text:
+                todays_card = card_div
+                break
+        if todays_card is not None:
+            break
+
+    dishes_list = []
+    regex = re.compile("entry entry-item *")
+    for entries_list in todays_card.find_all("table", {"class": regex}):
+        if "soup" in entries_list.text.lower():
+            continue
+        n_entries = len(entries_list.find_all("tr")) - 1
+        for i in range(1, n_entries, 2):
+            dish_name = entries_list.find_all("tr")[i].text
+            dish_info = entries_list.find_all("tr")[i + 1].text
+            dish_price = entries_list.find_all("tr")[i + 1].find(
+                "div", class_="price-text"
+            )
+            dishes_list.append((dish_name, dish_info, dish_price))
+    return dishes_list
+
+
+def available_parsers():
+    parsers = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        parsers.append("lxml")
+    return parsers
+
+
+def main(fixture: str, repeat: int):
+    with open(fixture, encoding="utf-8") as f:
+        page_source = f.read()
+
+    n_dishes = len(parse_lunch_menu(page_source, FIXTURE_DATE, parser="html.parser"))
+    print(f"Fixture: {fixture} ({len(page_source)} bytes, {n_dishes} dishes)")
+
+    candidates = {
+        "legacy (html.parser)": lambda: legacy_parse_lunch_menu(
+            page_source, FIXTURE_DATE
+        )
+    }
+    for parser in available_parsers():
+        candidates[f"current ({parser})"] = lambda parser=parser: parse_lunch_menu(
+            page_source, FIXTURE_DATE, parser=parser
+        )
+
+    baseline = None
+    for name, fn in candidates.items():
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        baseline = baseline or best
+        print(f"{name:<25} {best * 1000:8.2f} ms  ({baseline / best:5.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixture", type=str, default=FIXTURE)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    # the parser logs every dish, which would dominate the timings
+    logging.disable(logging.WARNING)
+    main(args.fixture, args.repeat)
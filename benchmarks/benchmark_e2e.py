@@ -0,0 +1,264 @@
+"""Offline end-to-end benchmark of a lunchbot run.
+
+Runs the complete lunchbot (scraping -> translation -> image generation -> upload ->
+posting) against the local stand-in services of ``stub_services.py``, which serve the
+recorded fixtures and answer like the real APIs, with configurable latency and
+failure rates. Every scenario runs in a fresh interpreter with its own cache
+directory; the time of each stage of ``run_lunchbot`` is measured.
+
+The results can be written as JSON and compared with a previous result file; the
+benchmark exits with status 1 if a scenario got slower than the threshold allows.
+
+Usage:
+
+    python benchmarks/benchmark_e2e.py [--scenarios cold warm] [--repeat 3]
+        [--output results.json] [--baseline baseline.json] [--threshold 0.25]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from functools import wraps
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stages of run_lunchbot, in order
+STAGES = ["scrape", "images", "post"]
+
+SCENARIOS = {
+    # empty caches and image cloud: everything is translated and generated
+    "cold": {},
+    # second run of the day: pages, translations and images are cached
+    "warm": {"warmup_runs": 1},
+    # the menu was prefetched at night, only the CFEL menu is added at lunchtime
+    "prefetched": {"prefetch": True},
+    # realistic latencies of the external services
+    "slow": {
+        "latency": {
+            "alsterfood": 0.2,
+            "cfel": 0.2,
+            "chat": 0.8,
+            "images": 2.0,
+            "cloud": 0.05,
+            "webhook": 0.1,
+        },
+    },
+    # slow and unreliable services (retries, fallbacks)
+    "flaky": {
+        "latency": {"chat": 0.3, "images": 0.5, "cloud": 0.02, "webhook": 0.05},
+        "failure_rate": {"images": 0.2, "cloud": 0.1, "webhook": 0.2},
+    },
+}
+
+# absolute slack in seconds before a slower stage counts as a regression (timer
+# noise of the fast stages)
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def _timed(timings: dict, stage: str, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+    return wrapper
+
+
+def run_scenario(name: str, cache_dir: str):
+    """Run one scenario in this interpreter.
+
+    Returns
+    -------
+    dict
+        Time per stage and in total (in seconds), the number of requests and
+        failures per service and the span statistics of ``lunchbot.metrics``.
+    """
+    from stub_services import StubServices
+
+    spec = SCENARIOS[name]
+    stubs = StubServices(
+        latency=spec.get("latency"), failure_rate=spec.get("failure_rate")
+    ).start()
+    os.environ.update(stubs.env())
+    os.environ["LUNCHBOT_CACHE_DIR"] = cache_dir
+
+    import lunchbot.runner as runner
+    from lunchbot.config import LunchbotConfig
+    from lunchbot.image_pipeline import ImagePipeline
+    from lunchbot.metrics import get_metrics
+    from lunchbot.prefetch import prefetch_week
+
+    config = LunchbotConfig.from_env()
+    for _ in range(spec.get("warmup_runs", 0)):
+        runner.run_lunchbot(config)
+        # the caches stay warm, but the menu has to be posted again
+        shutil.rmtree(os.path.join(cache_dir, "journal"), ignore_errors=True)
+    if spec.get("prefetch"):
+        prefetch_week(config)
+    stubs.requests.clear()
+    stubs.failures.clear()
+    stubs.posts.clear()
+
+    # time the stages by wrapping the functions run_lunchbot calls
+    timings = {}
+    runner.collect_dishes = _timed(timings, "scrape", runner.collect_dishes)
+    ImagePipeline.run = _timed(timings, "images", ImagePipeline.run)
+    runner.post_menu = _timed(timings, "post", runner.post_menu)
+
+    start = time.perf_counter()
+    error = None
+    try:
+        runner.run_lunchbot(config)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    timings["total"] = time.perf_counter() - start
+    stubs.stop()
+
+    return {
+        "timings": {stage: timings.get(stage, 0.0) for stage in [*STAGES, "total"]},
+        "requests": dict(stubs.requests),
+        "failures": dict(stubs.failures),
+        "posts": len([p for p in stubs.posts if "/alert" not in p[0]]),
+        "spans": get_metrics().span_stats(),
+        "error": error,
+    }
+
+
+def run_isolated(name: str):
+    """Run a scenario in a fresh interpreter with an empty cache directory."""
+    with tempfile.TemporaryDirectory(prefix="lunchbot-benchmark-") as tmp_dir:
+        result_file = os.path.join(tmp_dir, "result.json")
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(
+                [REPO_DIR, os.path.dirname(os.path.abspath(__file__))]
+            ),
+        }
+        subprocess.run(  # nosec
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--run-scenario",
+                name,
+                "--cache-dir",
+                os.path.join(tmp_dir, "cache"),
+                "--result-file",
+                result_file,
+            ],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        with open(result_file, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def summarize(runs: list):
+    """Median time per stage of several runs of a scenario."""
+    return {
+        "timings": {
+            stage: statistics.median(r["timings"][stage] for r in runs)
+            for stage in runs[0]["timings"]
+        },
+        "requests": runs[-1]["requests"],
+        "failures": runs[-1]["failures"],
+        "posts": runs[-1]["posts"],
+        "spans": runs[-1]["spans"],
+        "errors": [r["error"] for r in runs if r["error"]],
+        "runs": len(runs),
+    }
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float):
+    """Compare the timings with a baseline.
+
+    Returns
+    -------
+    list
+        Descriptions of the stages that are slower than ``(1 + threshold)`` times
+        the baseline (plus ``MIN_REGRESSION_SECONDS``).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for stage, seconds in result["timings"].items():
+            reference = baseline[name]["timings"].get(stage)
+            if reference is None:
+                continue
+            if seconds > reference * (1 + threshold) + MIN_REGRESSION_SECONDS:
+                regressions.append(
+                    f"{name}/{stage}: {seconds:.3f}s (baseline {reference:.3f}s, "
+                    f"+{(seconds / max(reference, 1e-9) - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main(args):
+    results = {}
+    header = f"{'scenario':<12}" + "".join(f"{s:>10}" for s in [*STAGES, "total"])
+    print(header + "  requests")
+    for name in args.scenarios:
+        results[name] = summarize([run_isolated(name) for _ in range(args.repeat)])
+        result = results[name]
+        print(
+            f"{name:<12}"
+            + "".join(f"{result['timings'][s]:9.3f}s" for s in [*STAGES, "total"])
+            + f"  {sum(result['requests'].values())}"
+            + (f"  ({len(result['errors'])} failed runs)" if result["errors"] else "")
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"created_at": time.time(), "python": sys.version, "results": results},
+                f,
+                indent=2,
+            )
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            print(f"FAILED: slower than the baseline (threshold {args.threshold:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"OK: no regressions (threshold {args.threshold:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=str, help="write the results as JSON")
+    parser.add_argument("--baseline", type=str, help="results JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    # used internally to run a single scenario in a fresh interpreter
+    parser.add_argument("--run-scenario", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        logging.disable(logging.CRITICAL)
+        result = run_scenario(args.run_scenario, args.cache_dir)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        sys.exit(0)
+    sys.exit(main(args))
@@ -0,0 +1,95 @@
+"""Micro-benchmark of the message rendering for menus with many dishes.
+
+Compares the previous renderer (string concatenation plus global ``.replace`` of the
+canteen names over the whole table) with the current one, with and without splitting
+the table at the size limit, on synthetic menus of different sizes.
+
+Usage:
+
+    python benchmarks/benchmark_rendering.py [--sizes 10 100 1000] [--repeat N]
+"""
+
+import argparse
+import logging
+import timeit
+
+from lunchbot.message import MAX_MESSAGE_LENGTH, render_table, split_table
+
+CANTEEN_URLS = {
+    "DESY Canteen": "https://desy.myalsterfood.de/",
+    "Cafe CFEL": "https://www.cfel.de/cafe",
+}
+
+
+def make_dishes(n: int):
+    """Synthetic dishes, two thirds from the canteen and one third from the cafe."""
+    return [
+        {
+            "name": f"Dish {i} with potatoes, vegetables and a creamy sauce",
+            "price": f"{4 + i % 5},{i % 10}0 €",
+            "info": ("vegan", "vegetarian", "meat")[i % 3],
+            "canteen": "DESY Canteen" if i % 3 else "Cafe CFEL",
+            "image_url": f"https://cloud.example.org/images/{i:020x}.png",
+            "thumbnail_url": f"https://cloud.example.org/images/{i:020x}_w200.webp",
+            "generation_info_tag": "Already generated",
+        }
+        for i in range(n)
+    ]
+
+
+def legacy_render_table(list_of_dishes: list, alsterfood_url: str, cfel_url: str):
+    """The renderer before the rewrite."""
+    # fmt: off
+    table_dish_columns_merged = (
+        "\n| " + " | ".join([dish["name"].replace("|", "-") for dish in list_of_dishes]) + " |\n"
+        + "|" + " --- |" * len([dish["name"] for dish in list_of_dishes]) + "\n"
+        + "|" + " | ".join([dish["price"] for dish in list_of_dishes]) + " |\n"
+        + "|" + " | ".join([dish["info"] for dish in list_of_dishes]) + " |\n"
+        + "|" + " | ".join([dish["canteen"] for dish in list_of_dishes]) + " |\n"
+        + "|" + " | ".join([f" [![preview {dish['generation_info_tag']}]({dish.get('thumbnail_url', dish['image_url'])} =200)]({dish['image_url']})"
+                            for dish in list_of_dishes]) + " |\n"
+    )
+    # fmt: on
+    table_dish_columns_merged = table_dish_columns_merged.replace(
+        "DESY Canteen", f"**[DESY Canteen]({alsterfood_url})** :alsterfood:"
+    )
+    table_dish_columns_merged = table_dish_columns_merged.replace(
+        "Cafe CFEL", f"**[Cafe CFEL]({cfel_url})** :cfel:"
+    )
+    return table_dish_columns_merged
+
+
+def main(sizes: list, repeat: int, max_length: int):
+    print(
+        f"{'dishes':>7} {'renderer':<10} {'time':>10} {'chars':>9} {'posts':>6}"
+        f"  (limit: {max_length} characters)"
+    )
+    for n in sizes:
+        dishes = make_dishes(n)
+        candidates = {
+            "legacy": lambda: [
+                legacy_render_table(
+                    dishes, CANTEEN_URLS["DESY Canteen"], CANTEEN_URLS["Cafe CFEL"]
+                )
+            ],
+            "current": lambda: [render_table(dishes, CANTEEN_URLS)],
+            "split": lambda: split_table(dishes, max_length, CANTEEN_URLS),
+        }
+        for name, fn in candidates.items():
+            tables = fn()
+            best = min(timeit.repeat(fn, number=1, repeat=repeat))
+            chars = max(len(t) for t in tables)
+            print(
+                f"{n:>7} {name:<10} {best * 1000:7.2f} ms {chars:>9} {len(tables):>6}"
+                + ("  (too long)" if chars > max_length else "")
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-length", type=int, default=MAX_MESSAGE_LENGTH)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    main(args.sizes, args.repeat, args.max_length)
@@ -0,0 +1,109 @@
+"""Measure the import time of the modules a lunchbot run starts with.
+
+Runs a fresh interpreter with ``python -X importtime``, reports the total import
+time of the lunchbot modules and the slowest imports, and checks that heavy
+dependencies (which are only needed on some code paths) are not imported.
+Exits with status 1 if the budget is exceeded.
+
+Usage:
+
+    python benchmarks/benchmark_startup.py [--budget-ms 250] [--repeat 5]
+"""
+
+import argparse
+import os
+import subprocess  # nosec
+import sys
+
+# modules imported by scripts/run_lunchbot.py before the first request is made
+STARTUP_MODULES = [
+    "dotenv",
+    "lunchbot.utils",
+    "lunchbot.config",
+    "lunchbot.runner",
+    "lunchbot.message",
+    "lunchbot.prefetch",
+    "lunchbot.alsterfood_scraping",
+    "lunchbot.cfel_scraping",
+    "lunchbot.image_pipeline",
+    "lunchbot.mattermost_posting",
+    "lunchbot.scraping",
+]
+
+# dependencies that must only be imported when they are actually used
+LAZY_MODULES = ["openai", "PIL", "bs4", "lxml", "yaml", "numpy"]
+
+MARKER = "--- lunchbot imports ---"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_once():
+    """Import the startup modules in a fresh interpreter.
+
+    Returns
+    -------
+    tuple
+        Total import time in ms, list of ``(cumulative ms, self ms, module)`` and
+        the list of lazy modules that were imported anyway.
+    """
+    code = (
+        "import sys\n"
+        f"sys.stderr.write({MARKER!r} + '\\n')\n"
+        f"import {', '.join(STARTUP_MODULES)}\n"
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+    )
+    env = {**os.environ, "PYTHONPATH": REPO_DIR}
+    result = subprocess.run(  # nosec
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+
+    lines = result.stderr.splitlines()
+    lines = lines[lines.index(MARKER) + 1 :]
+    total_us = 0
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative_us) / 1000, int(self_us) / 1000, name.strip()))
+        # only top-level imports count towards the total, the others are included
+        # in the cumulative time of their parent
+        if not name.startswith("  "):
+            total_us += int(cumulative_us)
+    imported_lazy = [m for m in result.stdout.strip().split(",") if m]
+    return total_us / 1000, imports, imported_lazy
+
+
+def main(budget_ms: float, repeat: int, top: int):
+    runs = [measure_once() for _ in range(repeat)]
+    total_ms, imports, imported_lazy = min(runs, key=lambda run: run[0])
+
+    print(f"Import time of the startup modules: {total_ms:.1f} ms (best of {repeat})")
+    print("Slowest imports (cumulative / self):")
+    for cumulative_ms, self_ms, name in sorted(imports, reverse=True)[:top]:
+        print(f"  {cumulative_ms:8.1f} ms {self_ms:8.1f} ms  {name}")
+
+    ok = True
+    if imported_lazy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(imported_lazy)}")
+        ok = False
+    if total_ms > budget_ms:
+        print(f"FAIL: import time exceeds the budget of {budget_ms:.0f} ms")
+        ok = False
+    if ok:
+        print(f"OK: within the budget of {budget_ms:.0f} ms")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=250)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    sys.exit(0 if main(args.budget_ms, args.repeat, args.top) else 1)
@@ -0,0 +1,256 @@
+"""Local stand-ins for all external services of a lunchbot run.
+
+A single threaded HTTP server plays the menu websites (serving the recorded
+fixtures), the OpenAI API (chat completions and image generation), the Hugging Face
+inference API, the WebDAV image cloud and the Mattermost webhooks. Every service can
+be given a latency and a failure rate, failed requests are answered with ``503``.
+
+Usage:
+
+    stubs = StubServices(latency={"images": 0.5}, failure_rate={"webhook": 0.1})
+    stubs.start()
+    os.environ.update(stubs.env())
+    ...
+    stubs.stop()
+"""
+
+import base64
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# the services that can be given a latency and a failure rate
+SERVICES = ("alsterfood", "cfel", "chat", "images", "huggingface", "cloud", "webhook")
+
+# first day of the week in the Alsterfood fixture
+ALSTERFOOD_FIXTURE_MONDAY = date(2026, 10, 12)
+DATE_REGEX = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})")
+
+
+def make_png(size: int = 256):
+    """A PNG image, similar in size to the generated ones."""
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.effect_noise((size, size), 64).convert("RGB").save(out, "PNG")
+    return out.getvalue()
+
+
+def shift_fixture_dates(page_source: str, today: date = None):
+    """Move the week of the Alsterfood fixture to the current (or next) week.
+
+    On weekends, the following week is used, so the menu of "today" is always
+    found by the scraper.
+    """
+    today = today or date.today()
+    if today.weekday() >= 5:
+        today += timedelta(days=7 - today.weekday())
+    offset = (today - timedelta(days=today.weekday())) - ALSTERFOOD_FIXTURE_MONDAY
+
+    def shift(match):
+        day, month, year = map(int, match.groups())
+        return (date(year, month, day) + offset).strftime("%d.%m.%Y")
+
+    return DATE_REGEX.sub(shift, page_source)
+
+
+class StubServices:
+    """Serve all external services of the lunchbot on a local port.
+
+    Parameters
+    ----------
+    latency : dict, optional
+        Latency in seconds per service (see ``SERVICES``).
+    failure_rate : dict, optional
+        Fraction of the requests per service that fail with ``503``.
+    seed : int, optional
+        Seed of the random failures, by default 0.
+    """
+
+    def __init__(self, latency: dict = None, failure_rate: dict = None, seed: int = 0):
+        self.latency = latency or {}
+        self.failure_rate = failure_rate or {}
+        self.requests = Counter()
+        self.failures = Counter()
+        self.images = {}
+        self.posts = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+        with open(os.path.join(FIXTURES_DIR, "alsterfood.html"), encoding="utf-8") as f:
+            self.alsterfood_page = shift_fixture_dates(f.read()).encode()
+        with open(os.path.join(FIXTURES_DIR, "cfel.html"), encoding="utf-8") as f:
+            self.cfel_page = f.read().encode()
+        self.png = make_png()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def env(self):
+        """Environment variables that point the lunchbot to the stubs."""
+        return {
+            "API_TO_USE": "openai",
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "HUGGINGFACE_API_URL": f"{self.url}/huggingface",
+            "HUGGINGFACE_API_TOKEN": "benchmark",
+            "ALSTERFOOD_WEBSITE_URL": f"{self.url}/alsterfood",
+            "CFEL_WEBSITE_URL": f"{self.url}/cfel",
+            "IMAGE_CLOUD_UPLOAD_URL": f"{self.url}/dav/",
+            "IMAGE_CLOUD_UPLOAD_TOKEN": "user:password",
+            "IMAGE_CLOUD_DOWNLOAD_URL": f"{self.url}/download/",
+            "MATTERMOST_WEBHOOK_URL": f"{self.url}/webhook/main",
+            "MATTERMOST_WEBHOOK_URL_ALERT": f"{self.url}/webhook/alert",
+            "SYSTEM_CONTENT": "You are a benchmark.",
+        }
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"stubs": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _enter(self, service: str):
+        """Count the request, wait and decide whether it fails."""
+        with self._lock:
+            self.requests[service] += 1
+            failed = self._random.random() < self.failure_rate.get(service, 0)
+            if failed:
+                self.failures[service] += 1
+        time.sleep(self.latency.get(service, 0))
+        return not failed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stubs = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, content):
+        self._send(200, json.dumps(content).encode(), "application/json")
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _service(self):
+        path = self.path
+        if path.startswith("/alsterfood"):
+            return "alsterfood"
+        if path.startswith("/cfel"):
+            return "cfel"
+        if path.startswith("/v1/chat"):
+            return "chat"
+        if path.startswith("/v1/images"):
+            return "images"
+        if path.startswith("/huggingface"):
+            return "huggingface"
+        if path.startswith(("/dav/", "/download/")):
+            return "cloud"
+        if path.startswith("/webhook"):
+            return "webhook"
+        return None
+
+    def _handle(self):
+        service = self._service()
+        body = self._body() if self.command in ("POST", "PUT", "PROPFIND") else b""
+        if service is None:
+            return self._send(404)
+        if not self.stubs._enter(service):
+            return self._send(503, b"service unavailable")
+        getattr(self, f"_{service}")(body)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PROPFIND = _handle
+
+    # ------------------------------------------------------------------------
+    # services
+
+    def _alsterfood(self, body):
+        self._send(200, self.stubs.alsterfood_page, "text/html; charset=utf-8")
+
+    def _cfel(self, body):
+        self._send(200, self.stubs.cfel_page, "text/html; charset=utf-8")
+
+    def _chat(self, body):
+        request = json.loads(body)
+        prompt = request["messages"][-1]["content"]
+        if request.get("response_format", {}).get("type") == "json_object":
+            # batch translation: the descriptions are the JSON list at the end
+            meal_names = json.loads(prompt[prompt.index("\n[") + 1 :])
+            content = json.dumps({"translations": [f"{m} (en)" for m in meal_names]})
+        else:
+            content = f"{prompt.splitlines()[-1]} (en)"
+        self._send_json(
+            {
+                "id": "chatcmpl-benchmark",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        )
+
+    def _images(self, body):
+        self._send_json(
+            {
+                "created": int(time.time()),
+                "data": [{"b64_json": base64.b64encode(self.stubs.png).decode()}],
+            }
+        )
+
+    def _huggingface(self, body):
+        self._send(200, self.stubs.png, "image/png")
+
+    def _cloud(self, body):
+        name = self.path.rsplit("/", 1)[-1]
+        images = self.stubs.images
+        if self.command == "PROPFIND":
+            listing = "".join(
+                f"<d:response><d:href>/dav/{n}</d:href></d:response>" for n in images
+            )
+            return self._send(
+                207,
+                f'<d:multistatus xmlns:d="DAV:">{listing}</d:multistatus>'.encode(),
+                "application/xml",
+            )
+        if self.command == "PUT":
+            images[name] = body
+            return self._send(201)
+        if name in images:
+            return self._send(200, images[name], "image/png")
+        self._send(404)
+
+    def _webhook(self, body):
+        self.stubs.posts.append((self.path, json.loads(body)))
+        self._send(200, b"ok")
@@ -1,116 +1,142 @@
 import logging
+import os
 import re
 from datetime import datetime, timedelta
 
-import requests
-import yaml
-from bs4 import BeautifulSoup
-
+from lunchbot.fingerprint import dish_fingerprint
+from lunchbot.page_cache import fetch_menu_page
 from lunchbot.utils import generate_hash
 
 logger = logging.getLogger(__name__)
 
+CARD_CLASS = "card-content black-text"
+CARD_TITLE_CLASS = "card-title primary-text"
+ENTRY_TABLE_REGEX = re.compile("entry entry-item *")
+DATE_REGEX = re.compile(r"\d{2}\.\d{2}\.\d{4}")
 
-def fetch_todays_lunch_menu(url: str):
-    """Fetch the lunch menu from the Alsterfood website.
+
+def get_html_parser():
+    """Get the name of the HTML parser backend for BeautifulSoup.
+
+    Uses ``lxml`` if it is installed (which is much faster than the pure-Python
+    ``html.parser``). The backend can be set explicitly with the environment
+    variable ``LUNCHBOT_HTML_PARSER``.
+    """
+    parser = os.getenv("LUNCHBOT_HTML_PARSER")
+    if parser:
+        return parser
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        return "html.parser"
+    return "lxml"
+
+
+def parse_cards(page_source: str, parser: str = None):
+    """Parse the day cards of the menu page into a ``date -> card`` index.
+
+    Only the card subtrees are turned into a tree, the rest of the page is
+    skipped by the parser.
 
     Parameters
     ----------
-    url : str
-        URL of the Alsterfood website.
+    page_source : str
+        HTML source of the menu page.
+    parser : str, optional
+        BeautifulSoup parser backend, by default the one of ``get_html_parser``.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping the dates (format "%d.%m.%Y") to the card divs.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    soup = BeautifulSoup(
+        page_source,
+        parser or get_html_parser(),
+        parse_only=SoupStrainer("div", class_=CARD_CLASS),
+    )
+
+    cards_by_date = {}
+    for card_div in soup.find_all("div", class_=CARD_CLASS):
+        title_div = card_div.find("div", class_=CARD_TITLE_CLASS)
+        if title_div is None:
+            continue
+        for date in DATE_REGEX.findall(title_div.text):
+            cards_by_date[date] = card_div
+    return cards_by_date
+
+
+def find_card(cards_by_date: dict, date: datetime):
+    """Find the card of ``date`` or of the next date within a week.
+
+    Returns
+    -------
+    tuple
+        The date string of the found card and the card (or ``(None, None)``).
+    """
+    date_str = date.strftime("%d.%m.%Y")
+    if date_str in cards_by_date:
+        return date_str, cards_by_date[date_str]
+
+    logger.warning(f"Could not find today's card for date {date_str}")
+    logger.warning("Trying to find the next possible date...")
+
+    # iterate through the upcoming next 7 days - for the first match, take the card
+    for i in range(1, 8):
+        next_date = (date + timedelta(days=i)).strftime("%d.%m.%Y")
+        logger.info(f"Looking for date {next_date}")
+        if next_date in cards_by_date:
+            logger.info(f"Found date {next_date}")
+            return next_date, cards_by_date[next_date]
+    return None, None
+
+
+def parse_card(card_div, date_str: str = None):
+    """Get the list of dishes from a day card.
+
+    Parameters
+    ----------
+    card_div : bs4.element.Tag
+        The card div of one day.
+    date_str : str, optional
+        Date of the card, only used for logging.
 
     Returns
     -------
     list
         List of dictionaries with the dishes, prices and info.
-        Example: [{"name": "Dish 1", "price": "€4.50", "info": "vegan"}, ...]
     """
-
     dishes_list = []
-    # Get the page source
-    page_source = requests.get(url + "/en", timeout=20).text
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(page_source, "html.parser")
-
-    # find all the different cards (corresponding to different days)
-    card_divs = soup.find_all("div", class_="card-content black-text")
-
-    # ----------- Find today's card -----------
-    # Get today's date and select the corresponding card from the menu
-    today_date_datetime = datetime.now()
-    # today_date_datetime = datetime(2023, 12, 12)  # set a specific date for debugging
-    today_date = today_date_datetime.strftime("%d.%m.%Y")
-
-    todays_card = None
-    # Iterate through each card div
-    for card_div in card_divs:
-        # Check if today's date is in the card-title primary-text
-        title_div = card_div.find("div", class_="card-title primary-text")
-        if title_div and today_date in title_div.text:
-            # Print the original card div
-            todays_card = card_div
-
-    # if no card was found, try to find the next possible date
-    if todays_card is None:
-        logger.warning(f"Could not find today's card for date {today_date}")
-        logger.warning("Trying to find the next possible date...")
-
-        # iterate through the upcoming next 7 days - for the first match, take the card
-        for i in range(1, 8):
-            next_date = (today_date_datetime + timedelta(days=i)).strftime("%d.%m.%Y")
-            logger.info(f"Looking for date {next_date}")
-            for card_div in card_divs:
-                # Check if today's date is in the card-title primary-text
-                title_div = card_div.find("div", class_="card-title primary-text")
-                if title_div and next_date in title_div.text:
-                    # Print the original card div
-                    todays_card = card_div
-                    logger.info(f"Found date {next_date}")
-                    break
-            if todays_card is not None:
-                break
-
-    regex = re.compile("entry entry-item *")
-    menu_entries_table = todays_card.find_all("table", {"class": regex})
 
     # check which of the charts has the actual means (and not the soups)
-    for i, entry_list in enumerate(menu_entries_table):
-        print(entry_list.text)
-        if "soup" in entry_list.text.lower():
-            print("Skipping soup entries")
+    for entries_list in card_div.find_all("table", {"class": ENTRY_TABLE_REGEX}):
+        logger.debug(entries_list.text)
+        if "soup" in entries_list.text.lower():
+            logger.debug("Skipping soup entries")
             continue
-        entries_list = entry_list
 
-        # debugging (if website structure is changed once again)
-        # for j, entry in enumerate(entries_list.find_all("tr")):
-        #     logger.info(80 * "-")
-        #     logger.info(f"Entry: {j}")
-        #     logger.info(entry.text)
-        #     logger.info(80 * "-")
-
-        n_entries = len(entries_list.find_all("tr")) - 1
-        logger.info(f"Found {n_entries} entries in the menu for date {today_date}")
+        rows = entries_list.find_all("tr")
+        n_entries = len(rows) - 1
+        logger.info(f"Found {n_entries} entries in the menu for date {date_str}")
 
         # ----------- Find different dishes -----------
         # entries are alternating: dish name, dish info + price etc
         for i in range(1, n_entries, 2):
             logger.info(80 * "-")
             logger.info(f"--- Entry {i} ---")
-            dish_name = entries_list.find_all("tr")[i].text
+            dish_name = rows[i].text
             logger.info(f"Dish name: '{dish_name}'")
-            dish_info = entries_list.find_all("tr")[i + 1].text
+            dish_info = rows[i + 1].text
             logger.info(f"Dish info: '{dish_info}'")
             # find the div with class "price-text" inside dish_info
-            dish_price = entries_list.find_all("tr")[i + 1].find(
-                "div", class_="price-text"
-            )
+            dish_price = rows[i + 1].find("div", class_="price-text")
             if dish_price:
                 dish_price = dish_price.text.split(" ")[-1].strip() + " €"
             else:
                 dish_price = "N/A"
 
-            dish_veg_label = None
-
             if "vegan" in dish_info.lower():
                 dish_veg_label = "vegan"
             elif "vegetarisch" in dish_info.lower():
@@ -127,9 +153,105 @@ def fetch_todays_lunch_menu(url: str):
                     "price": dish_price,
                     "canteen": "DESY Canteen",
                     "hash": generate_hash(dish_name),
+                    "fingerprint": dish_fingerprint(dish_name),
                 }
             )
 
+    return dishes_list
+
+
+def parse_lunch_menu(page_source: str, date: datetime = None, parser: str = None):
+    """Get the dishes of ``date`` (or the next date on the menu) from the page.
+
+    Parameters
+    ----------
+    page_source : str
+        HTML source of the menu page.
+    date : datetime, optional
+        The date to get the menu for, by default today.
+    parser : str, optional
+        BeautifulSoup parser backend, by default the one of ``get_html_parser``.
+
+    Returns
+    -------
+    list
+        List of dictionaries with the dishes, prices and info.
+    """
+    if date is None:
+        date = datetime.now()
+        # date = datetime(2023, 12, 12)  # set a specific date for debugging
+
+    cards_by_date = parse_cards(page_source, parser=parser)
+    date_str, todays_card = find_card(cards_by_date, date)
+    if todays_card is None:
+        raise ValueError(
+            f"Could not find a menu for {date.strftime('%d.%m.%Y')} "
+            "or any of the following 7 days"
+        )
+    return parse_card(todays_card, date_str)
+
+
+def parse_week_menu(page_source: str, parser: str = None):
+    """Get the dishes of all days on the menu page.
+
+    Parameters
+    ----------
+    page_source : str
+        HTML source of the menu page.
+    parser : str, optional
+        BeautifulSoup parser backend, by default the one of ``get_html_parser``.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping the dates (format "%d.%m.%Y") to the lists of dishes.
+    """
+    return {
+        date_str: parse_card(card_div, date_str)
+        for date_str, card_div in parse_cards(page_source, parser=parser).items()
+    }
+
+
+def fetch_week_lunch_menus(url: str):
+    """Fetch the lunch menus of all days on the Alsterfood website.
+
+    Parameters
+    ----------
+    url : str
+        URL of the Alsterfood website.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping the dates (format "%d.%m.%Y") to the lists of dishes.
+    """
+    return fetch_menu_page(url + "/en", parse_week_menu, key="week")
+
+
+def fetch_todays_lunch_menu(url: str):
+    """Fetch the lunch menu from the Alsterfood website.
+
+    Parameters
+    ----------
+    url : str
+        URL of the Alsterfood website.
+
+    Returns
+    -------
+    list
+        List of dictionaries with the dishes, prices and info.
+        Example: [{"name": "Dish 1", "price": "€4.50", "info": "vegan"}, ...]
+    """
+    # Get the page source (re-validated against the on-disk copy) and parse it,
+    # the parsed menu is reused as long as page and date don't change
+    dishes_list = fetch_menu_page(
+        url + "/en",
+        parse_lunch_menu,
+        key=datetime.now().strftime("%d.%m.%Y"),
+    )
+
+    import yaml
+
     print()
     print(yaml.dump(dishes_list, allow_unicode=True))
     print()
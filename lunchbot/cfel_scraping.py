@@ -1,32 +1,31 @@
 import logging
 
-import requests
-import yaml
-from bs4 import BeautifulSoup
-
-from lunchbot.utils import generate_hash, translate_german_food_description_to_english
+from lunchbot.fingerprint import dish_fingerprint
+from lunchbot.page_cache import fetch_menu_page
+from lunchbot.utils import generate_hash, translate_german_food_descriptions_to_english
 
 logger = logging.getLogger(__name__)
 
 
-def fetch_todays_lunch_menu(url: str):
-    """Fetch the lunch menu from the CFEL menu website.
+def parse_lunch_menu(page_source: str, translate: bool = True):
+    """Get the (translated) dishes from the CFEL menu page.
 
     Parameters
     ----------
-    url : str
-        URL of the cfel menu website.
+    page_source : str
+        HTML source of the menu page.
+    translate : bool, optional
+        Whether to translate the dish names to English, by default True.
 
     Returns
     -------
     list
         List of dictionaries with the dishes, prices and info.
-        Example: [{"name": "Dish 1", "price": "€4.50", "info": "vegan"}, ...]
     """
+    from bs4 import BeautifulSoup
+
     dishes_list = []
 
-    # Get the page source
-    page_source = requests.get(url, timeout=20).text
     # Parse the HTML content using BeautifulSoup
     soup = BeautifulSoup(page_source, "html.parser")
 
@@ -70,21 +69,66 @@ def fetch_todays_lunch_menu(url: str):
         else:
             dish_info = ""
 
-        # Translate the dish description to English
-        dish_name_translated = translate_german_food_description_to_english(dish_name)
-
         dishes_list.append(
             {
-                "name": dish_name_translated,
+                "name": dish_name,
                 "info": dish_info,
                 "price": dish_price,
                 "canteen": "Cafe CFEL",
                 "hash": generate_hash(dish_name),
+                # from the German text, which is stable (unlike its translation)
+                "fingerprint": dish_fingerprint(dish_name),
             }
         )
 
     logger.info(80 * "-")
 
+    if translate:
+        translate_dishes(dishes_list)
+    return dishes_list
+
+
+def translate_dishes(dishes_list: list):
+    """Translate the names of the dishes to English (with a single request)."""
+    translations = translate_german_food_descriptions_to_english(
+        [dish["name"] for dish in dishes_list]
+    )
+    for dish, dish_name_translated in zip(dishes_list, translations):
+        dish["name"] = dish_name_translated
+    return dishes_list
+
+
+def fetch_todays_lunch_menu(url: str):
+    """Fetch the lunch menu from the CFEL menu website.
+
+    Parameters
+    ----------
+    url : str
+        URL of the cfel menu website.
+
+    Returns
+    -------
+    list
+        List of dictionaries with the dishes, prices and info.
+        Example: [{"name": "Dish 1", "price": "€4.50", "info": "vegan"}, ...]
+    """
+    # Get the page source (re-validated against the on-disk copy) and parse it,
+    # the parsed menu is reused as long as the page doesn't change
+    # the page only shows the menu of the day, an old copy must not be posted
+    # as today's menu
+    dishes_list = fetch_menu_page(
+        url,
+        lambda page_source: parse_lunch_menu(page_source, translate=False),
+        key="dishes",
+        same_day_only=True,
+    )
+    # the translation is not part of the cached parse result: names that were
+    # kept in German (while the chat API was down) are translated again by the
+    # next fetch, the translations themselves are cached
+    translate_dishes(dishes_list)
+
+    import yaml
+
     print()
     print(yaml.dump(dishes_list, allow_unicode=True))
     print()
@@ -93,6 +137,9 @@ def fetch_todays_lunch_menu(url: str):
 
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()  # the translation needs OPENAI_API_KEY
     logging.basicConfig(level=logging.INFO)
     url = "https://www.imensa.de/hamburg/cafe-cfel/index.html"
     todays_menu = fetch_todays_lunch_menu(url)
@@ -0,0 +1,272 @@
+"""Circuit breakers for the external services.
+
+A breaker counts the consecutive failures of a service. After
+``failure_threshold`` failures it opens: calls fail right away with
+``CircuitOpenError`` (so the caller goes straight to its fallback) instead of
+waiting for the next timeout. After ``reset_timeout`` seconds the breaker is
+half-open and lets a single probe request through; if it succeeds the breaker
+closes again, otherwise it stays open for another ``reset_timeout``.
+
+The states are stored in the cache directory, so a service that was down in the
+last run is not tried again by every dish of the next one.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from lunchbot.metrics import incr
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """The circuit breaker of the service is open."""
+
+
+class CircuitBreakerStore:
+    """The states of all circuit breakers, persisted as JSON.
+
+    Parameters
+    ----------
+    path : str, optional
+        File of the states, by default ``circuit_breakers.json`` in the lunchbot
+        cache directory.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(get_cache_dir(), "circuit_breakers.json")
+        self._lock = threading.Lock()
+
+    def load(self, name: str = None):
+        """Get the stored state of ``name`` (or the states of all breakers)."""
+        with self._lock:
+            states = self._read()
+        return states if name is None else states.get(name, {})
+
+    def save(self, name: str, state: dict):
+        """Store the state of ``name`` (the other breakers are kept)."""
+        with self._lock:
+            states = self._read()
+            states[name] = state
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(states, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not save the circuit breaker states: {e}")
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+class CircuitBreaker:
+    """Stop calling a service that keeps failing.
+
+    Parameters
+    ----------
+    name : str
+        Name of the service.
+    failure_threshold : int, optional
+        Number of consecutive failures that open the breaker, by default 3.
+    reset_timeout : float, optional
+        Seconds after which an open breaker lets a probe through, by default
+        600.
+    store : CircuitBreakerStore, optional
+        Where the state is persisted, by default not at all.
+    enabled : bool, optional
+        If False, all calls go through and nothing is recorded, by default True.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        reset_timeout: float = 600,
+        store: CircuitBreakerStore = None,
+        enabled: bool = True,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.store = store
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._probing = False
+        stored = store.load(name) if store is not None else {}
+        self._state = stored.get("state", CLOSED)
+        self._failures = stored.get("failures", 0)
+        self._opened_at = stored.get("opened_at", 0.0)
+        self._last_error = stored.get("last_error")
+
+    @property
+    def state(self):
+        """The current state, half-open if the breaker is open but due for a probe."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def check(self):
+        """Raise ``CircuitOpenError`` if a call would be rejected right now.
+
+        Unlike ``call``, this doesn't take the probe of a half-open breaker, so
+        it can be used before queueing a request.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._probing):
+                self._reject()
+
+    def call(self, fn, failed=None, ignore=None):
+        """Call ``fn()`` if the breaker allows it.
+
+        Parameters
+        ----------
+        fn : callable
+            The request.
+        failed : callable, optional
+            Function that tells whether a result counts as a failure (e.g. a
+            response with status code 5xx), by default only exceptions do.
+        ignore : callable, optional
+            Function that tells whether an error doesn't count as a failure
+            (e.g. a ``429``, which is handled by pausing the requests), by
+            default all errors count.
+
+        Returns
+        -------
+        object
+            The result of ``fn``. Its errors are raised, ``CircuitOpenError`` if
+            the breaker is open.
+        """
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._probing):
+                self._reject()
+            probe = state == HALF_OPEN
+            if probe:
+                self._probing = True
+                logger.info(f"Circuit breaker '{self.name}' is half-open, probing")
+                incr("circuit_breaker_events", breaker=self.name, event="probe")
+        try:
+            result = fn()
+        except Exception as e:
+            if ignore is not None and ignore(e):
+                self._record_ignored(probe)
+            else:
+                self._record_failure(str(e) or repr(e), probe)
+            raise
+        if failed is not None and failed(result):
+            self._record_failure(f"failed result: {result!r}", probe)
+        else:
+            self._record_success(probe)
+        return result
+
+    def _reject(self):
+        incr("circuit_breaker_events", breaker=self.name, event="rejected")
+        raise CircuitOpenError(
+            f"Circuit breaker '{self.name}' is open (last error: {self._last_error})"
+        )
+
+    def _record_success(self, probe: bool):
+        with self._lock:
+            if probe:
+                self._probing = False
+            if self._state == CLOSED and self._failures == 0:
+                return
+            if self._state == OPEN:
+                logger.info(f"Circuit breaker '{self.name}' closed again")
+                incr("circuit_breaker_events", breaker=self.name, event="closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._save()
+
+    def _record_ignored(self, probe: bool):
+        # the state is kept, a half-open breaker lets the next probe through
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def _record_failure(self, error: str, probe: bool):
+        with self._lock:
+            if probe:
+                self._probing = False
+            self._failures += 1
+            self._last_error = error
+            if probe or (
+                self._state == CLOSED and self._failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    f"Circuit breaker '{self.name}' opened after {self._failures} "
+                    f"failure(s), calls are skipped for {self.reset_timeout:.0f}s "
+                    f"(last error: {error})"
+                )
+                incr("circuit_breaker_events", breaker=self.name, event="opened")
+                self._state = OPEN
+                self._opened_at = time.time()
+            self._save()
+
+    def _save(self):
+        if self.store is not None:
+            self.store.save(
+                self.name,
+                {
+                    "state": self._state,
+                    "failures": self._failures,
+                    "opened_at": self._opened_at,
+                    "last_error": self._last_error,
+                },
+            )
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_store = None
+
+
+def get_circuit_breaker(name: str):
+    """Get the shared circuit breaker of a service (created on first use).
+
+    The breakers are configured with ``CIRCUIT_BREAKER_THRESHOLD`` (failures,
+    default 3) and ``CIRCUIT_BREAKER_RESET_TIMEOUT`` (seconds, default 600), and
+    can be disabled with ``CIRCUIT_BREAKERS=false``.
+    """
+    global _store
+    with _breakers_lock:
+        if name not in _breakers:
+            if _store is None:
+                _store = CircuitBreakerStore()
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "3")),
+                reset_timeout=float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "600")),
+                store=_store,
+                enabled=os.getenv("CIRCUIT_BREAKERS", "true").lower() != "false",
+            )
+        return _breakers[name]
+
+
+def get_circuit_breaker_states():
+    """Get the state of every circuit breaker used in this process."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in breakers}
@@ -0,0 +1,209 @@
+"""Settings of a lunchbot run, read from the environment."""
+
+import logging
+import os
+from dataclasses import dataclass
+
+from lunchbot.message import MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_CONTENT = (
+    "You are a 5-star restaurant critic. "
+    "You are writing a review of the following dish:"
+)
+
+
+@dataclass
+class LunchbotConfig:
+    """Settings of a lunchbot run.
+
+    Attributes
+    ----------
+    alsterfood_website_url : str
+        URL of the Alsterfood (DESY canteen) website.
+    mattermost_webhook_url : str
+        Webhook the message is posted to.
+    image_cloud_upload_url : str
+        URL prefix the images are uploaded to.
+    image_cloud_upload_token : str
+        Credentials for the upload (``user:password``).
+    image_cloud_download_url : str
+        URL prefix the uploaded images can be downloaded from.
+    api_to_use : str, optional
+        Image generation API, either "openai" (default) or "huggingface".
+    cfel_website_url : str, optional
+        URL of the CFEL cafe website, the cafe is skipped if not set.
+    huggingface_api_url : str, optional
+        URL of the Hugging Face inference API.
+    huggingface_api_token : str, optional
+        Token for the Hugging Face inference API.
+    mattermost_username : str, optional
+        Username displayed for the bot, by default "Lunchbot".
+    message_prefix : str, optional
+        Text in front of the menu table.
+    system_content : str, optional
+        Description of the system that describes the food.
+    description_suffix : str, optional
+        Suffix to put after "Description" in the table header.
+    scraping_deadline : float, optional
+        Time in seconds after which unfinished scrapers are given up, by
+        default 30.
+    hostname : str, optional
+        Name of the host the bot runs on (for the logs).
+    webhook_targets_file : str, optional
+        YAML file with the channels to post to (see ``lunchbot.fanout``), by
+        default only ``mattermost_webhook_url`` is posted to.
+    fanout_max_workers : int, optional
+        Maximum number of channels posted to at the same time, by default 8.
+    max_message_length : int, optional
+        Maximum number of characters of a post, longer menus are split into
+        several posts. By default ``MAX_MESSAGE_LENGTH``.
+    metrics_json_file : str, optional
+        File the JSON summary of the run (timings and counters) is written to.
+    metrics_textfile : str, optional
+        File the metrics of the run are written to in the Prometheus text
+        format (e.g. in the directory of the node exporter textfile collector).
+    alert_timing_summary : bool, optional
+        Whether to add a short timing summary of the run to failure alerts, by
+        default False.
+    run_journal : bool, optional
+        Whether to record the steps of a run, so a rerun on the same day resumes
+        it and doesn't post twice (see ``lunchbot.run_journal``), by default
+        True.
+    """
+
+    alsterfood_website_url: str
+    mattermost_webhook_url: str
+    image_cloud_upload_url: str
+    image_cloud_upload_token: str
+    image_cloud_download_url: str
+    api_to_use: str = "openai"
+    cfel_website_url: str = None
+    huggingface_api_url: str = None
+    huggingface_api_token: str = None
+    mattermost_username: str = "Lunchbot"
+    message_prefix: str = ""
+    system_content: str = DEFAULT_SYSTEM_CONTENT
+    description_suffix: str = ""
+    scraping_deadline: float = 30
+    hostname: str = "unknown_host"
+    webhook_targets_file: str = None
+    fanout_max_workers: int = 8
+    max_message_length: int = MAX_MESSAGE_LENGTH
+    metrics_json_file: str = None
+    metrics_textfile: str = None
+    alert_timing_summary: bool = False
+    run_journal: bool = True
+
+    @classmethod
+    def from_env(cls):
+        """Read and validate the settings from the environment variables."""
+        api_to_use = (os.getenv("API_TO_USE") or "").lower()
+        if api_to_use != "huggingface" and api_to_use != "openai":
+            raise ValueError("API_TO_USE must be either 'huggingface' or 'openai'")
+
+        alsterfood_website_url = os.getenv("ALSTERFOOD_WEBSITE_URL")
+        mattermost_webhook_url = os.getenv("MATTERMOST_WEBHOOK_URL")
+        image_cloud_upload_url = os.getenv("IMAGE_CLOUD_UPLOAD_URL")
+        image_cloud_upload_token = os.getenv("IMAGE_CLOUD_UPLOAD_TOKEN")
+        image_cloud_download_url = os.getenv("IMAGE_CLOUD_DOWNLOAD_URL")
+
+        if alsterfood_website_url is None:
+            raise ValueError("ALSTERFOOD_WEBSITE_URL is not set")
+        webhook_targets_file = os.getenv("WEBHOOK_TARGETS_FILE")
+        if mattermost_webhook_url is None and webhook_targets_file is None:
+            raise ValueError(
+                "Neither MATTERMOST_WEBHOOK_URL nor WEBHOOK_TARGETS_FILE is set"
+            )
+        if os.getenv("USE_OPENAI_IMAGE_URL", "").lower() == "true":
+            logger.warning("Using OpenAI image URL (will expire after 1 hour)")
+            logger.info("IMAGE_CLOUD_UPLOAD_URL will be ignored")
+            logger.info("IMAGE_CLOUD_UPLOAD_TOKEN will be ignored")
+            logger.info("IMAGE_CLOUD_DOWNLOAD_URL will be ignored")
+        else:
+            if image_cloud_upload_url is None:
+                raise ValueError("IMAGE_CLOUD_UPLOAD_URL is not set")
+            if image_cloud_upload_token is None:
+                raise ValueError("IMAGE_CLOUD_UPLOAD_TOKEN is not set")
+            if image_cloud_download_url is None:
+                raise ValueError("IMAGE_CLOUD_DOWNLOAD_URL is not set")
+
+        system_content = os.getenv("SYSTEM_CONTENT")
+        if system_content is None:
+            system_content = DEFAULT_SYSTEM_CONTENT
+            logger.warning(
+                f"SYSTEM_CONTENT is not set, using default value: {system_content}"
+            )
+
+        return cls(
+            alsterfood_website_url=alsterfood_website_url,
+            mattermost_webhook_url=mattermost_webhook_url,
+            image_cloud_upload_url=image_cloud_upload_url,
+            image_cloud_upload_token=image_cloud_upload_token,
+            image_cloud_download_url=image_cloud_download_url,
+            api_to_use=api_to_use,
+            cfel_website_url=os.getenv("CFEL_WEBSITE_URL"),
+            huggingface_api_url=os.getenv("HUGGINGFACE_API_URL"),
+            huggingface_api_token=os.getenv("HUGGINGFACE_API_TOKEN"),
+            mattermost_username=os.getenv("MATTERMOST_USERNAME") or "Lunchbot",
+            message_prefix=os.getenv("MESSAGE_PREFIX") or "",
+            system_content=system_content,
+            description_suffix=os.getenv("DESCRIPTION_SUFFIX") or "",
+            scraping_deadline=float(os.getenv("SCRAPING_DEADLINE", "30")),
+            hostname=os.getenv("HOSTNAME", "unknown_host"),
+            webhook_targets_file=webhook_targets_file,
+            fanout_max_workers=int(os.getenv("FANOUT_MAX_WORKERS", "8")),
+            max_message_length=int(
+                os.getenv("MESSAGE_MAX_LENGTH", MAX_MESSAGE_LENGTH)
+            ),
+            metrics_json_file=os.getenv("METRICS_JSON_FILE"),
+            metrics_textfile=os.getenv("METRICS_TEXTFILE"),
+            alert_timing_summary=(
+                os.getenv("ALERT_TIMING_SUMMARY", "false").lower() == "true"
+            ),
+            run_journal=os.getenv("RUN_JOURNAL", "true").lower() != "false",
+        )
+
+    @property
+    def canteen_urls(self):
+        """URLs of the official menus per canteen name."""
+        return {
+            "DESY Canteen": self.alsterfood_website_url,
+            "Cafe CFEL": self.cfel_website_url,
+        }
+
+    def webhook_targets(self):
+        """Get the channels to post to.
+
+        Returns
+        -------
+        list
+            The targets of ``webhook_targets_file`` or a single target for
+            ``mattermost_webhook_url``.
+        """
+        from lunchbot.fanout import WebhookTarget, load_targets
+
+        if self.webhook_targets_file is not None:
+            return load_targets(self.webhook_targets_file)
+        return [
+            WebhookTarget(
+                name="default",
+                webhook_url=self.mattermost_webhook_url,
+                username=self.mattermost_username,
+                attempts=10,
+            )
+        ]
+
+    def image_pipeline_config(self):
+        """Get the config of the image pipeline (other settings from the env)."""
+        from lunchbot.image_pipeline import ImagePipelineConfig
+
+        return ImagePipelineConfig.from_env(
+            api_to_use=self.api_to_use,
+            image_cloud_upload_url=self.image_cloud_upload_url,
+            image_cloud_upload_token=self.image_cloud_upload_token,
+            image_cloud_download_url=self.image_cloud_download_url,
+            huggingface_api_url=self.huggingface_api_url,
+            huggingface_api_token=self.huggingface_api_token,
+        )
@@ -0,0 +1,415 @@
+"""Long-running lunchbot with an in-process scheduler.
+
+Instead of one cold process per post, the daemon keeps the image pipeline (with the
+image, alias and similarity indexes), the HTTP connection pool and the translation
+cache warm between the runs. It posts at configurable times per weekday, prefetches
+the upcoming menus at night and refreshes the caches in between.
+"""
+
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lunchbot.circuit_breaker import get_circuit_breaker_states
+from lunchbot.message import WEEKDAYS
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POST_TIME = "11:00"
+DEFAULT_PREFETCH_TIME = "03:00"
+DEFAULT_POST_RETRIES = 3
+DEFAULT_POST_RETRY_DELAY = 10
+# the weekdays the bot posts on if no time is set for a day explicitly
+DEFAULT_POST_DAYS = ("MON", "TUE", "WED", "THU", "FRI")
+
+
+def parse_time(value: str):
+    """Parse a time of the day ("HH:MM") into ``(hour, minute)``."""
+    hour, minute = value.strip().split(":")
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time of the day: {value}")
+    return hour, minute
+
+
+def get_post_times():
+    """Get the posting times per weekday from the environment.
+
+    ``POST_TIME`` (default "11:00") is used for Monday to Friday, the time of a day
+    can be set (or the day disabled with "off") with ``POST_TIME_<DAY>``, e.g.
+    ``POST_TIME_FRI=11:30`` or ``POST_TIME_SAT=12:00``.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping the weekdays ("MON", ...) to ``(hour, minute)``.
+    """
+    default = os.getenv("POST_TIME", DEFAULT_POST_TIME)
+    post_times = {}
+    for day in WEEKDAYS:
+        value = os.getenv(f"POST_TIME_{day}")
+        if value is None:
+            value = default if day in DEFAULT_POST_DAYS else "off"
+        if value.lower() not in ("", "off", "none", "false"):
+            post_times[day] = parse_time(value)
+    return post_times
+
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    lunchbot_daemon = None
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/health"):
+            self.send_error(404)
+            return
+        status = self.lunchbot_daemon.health()
+        body = json.dumps(status).encode()
+        self.send_response(200 if status["healthy"] else 503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class LunchbotDaemon:
+    """Run the lunchbot jobs on a schedule in a single long-running process.
+
+    The jobs run one at a time, as they share the image pipeline and the metrics
+    of the current run. A failed post is retried (it resumes from the run
+    journal, see ``lunchbot.run_journal``).
+
+    Parameters
+    ----------
+    config : LunchbotConfig
+        Settings of the lunchbot.
+    post_times : dict, optional
+        Posting times per weekday (see ``get_post_times``), by default from the
+        environment.
+    prefetch_time : str, optional
+        Time of the day ("HH:MM") of the week-ahead prefetch, None disables it.
+    prefetch_days : int, optional
+        Number of days prepared by the prefetch, by default 7.
+    refresh_interval : float, optional
+        Interval in minutes of the cache refresh, by default 60. None disables it.
+    post_retries : int, optional
+        Number of retries of a failed post, by default 3.
+    post_retry_delay : float, optional
+        Minutes between the retries of a failed post, by default 10.
+    heartbeat_path : str, optional
+        File the status is written to regularly, by default ``heartbeat.json``
+        in the lunchbot cache directory.
+    heartbeat_interval : float, optional
+        Interval in seconds of the heartbeat, by default 60.
+    health_port : int, optional
+        If set, the status is served at ``http://<host>:<port>/health``.
+    timezone : str, optional
+        Timezone of the schedule, by default the local one.
+    """
+
+    def __init__(
+        self,
+        config,
+        post_times: dict = None,
+        prefetch_time: str = DEFAULT_PREFETCH_TIME,
+        prefetch_days: int = 7,
+        refresh_interval: float = 60,
+        post_retries: int = DEFAULT_POST_RETRIES,
+        post_retry_delay: float = DEFAULT_POST_RETRY_DELAY,
+        heartbeat_path: str = None,
+        heartbeat_interval: float = 60,
+        health_port: int = None,
+        timezone: str = None,
+    ):
+        from lunchbot.image_pipeline import ImagePipeline
+        from lunchbot.prefetch import PrefetchStore
+
+        self.config = config
+        self.post_times = post_times if post_times is not None else get_post_times()
+        self.prefetch_time = prefetch_time
+        self.prefetch_days = prefetch_days
+        self.refresh_interval = refresh_interval
+        self.post_retries = post_retries
+        self.post_retry_delay = post_retry_delay
+        self.heartbeat_path = heartbeat_path or os.path.join(
+            get_cache_dir(), "heartbeat.json"
+        )
+        self.heartbeat_interval = heartbeat_interval
+        self.health_port = health_port
+        self.timezone = timezone
+
+        # warm state, shared by all runs
+        self.pipeline = ImagePipeline(config.image_pipeline_config())
+        self.store = PrefetchStore()
+
+        self._scheduler = None
+        self._health_server = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # held by the running job
+        self._job_lock = threading.Lock()
+        self._started_at = time.time()
+        self._jobs = {}
+
+    @classmethod
+    def from_env(cls, config):
+        """Create the daemon with the settings from the environment variables."""
+        prefetch_time = os.getenv("PREFETCH_TIME", DEFAULT_PREFETCH_TIME)
+        refresh_interval = os.getenv("CACHE_REFRESH_INTERVAL", "60")
+        health_port = os.getenv("HEALTH_PORT")
+        return cls(
+            config,
+            prefetch_time=(
+                None if prefetch_time.lower() in ("", "off") else prefetch_time
+            ),
+            prefetch_days=int(os.getenv("PREFETCH_DAYS", "7")),
+            refresh_interval=(
+                None
+                if refresh_interval.lower() in ("", "off")
+                else float(refresh_interval)
+            ),
+            post_retries=int(os.getenv("POST_RETRIES", str(DEFAULT_POST_RETRIES))),
+            post_retry_delay=float(
+                os.getenv("POST_RETRY_DELAY", str(DEFAULT_POST_RETRY_DELAY))
+            ),
+            heartbeat_path=os.getenv("HEARTBEAT_FILE"),
+            heartbeat_interval=float(os.getenv("HEARTBEAT_INTERVAL", "60")),
+            health_port=int(health_port) if health_port else None,
+            timezone=os.getenv("LUNCHBOT_TIMEZONE"),
+        )
+
+    # ------------------------------------------------------------------------
+    # jobs
+
+    def post(self):
+        """Post the message of today."""
+        from lunchbot.runner import run_lunchbot
+
+        run_lunchbot(self.config, store=self.store, pipeline=self.pipeline)
+
+    def prefetch(self):
+        """Prepare the images and messages of the upcoming days."""
+        from lunchbot.prefetch import prefetch_week
+
+        prefetch_week(
+            self.config,
+            days=self.prefetch_days,
+            store=self.store,
+            pipeline=self.pipeline,
+        )
+
+    def refresh_caches(self):
+        """Re-read the image cloud listing and re-validate the menu page."""
+        from lunchbot.alsterfood_scraping import fetch_week_lunch_menus
+
+        self.pipeline.image_index.refresh()
+        fetch_week_lunch_menus(self.config.alsterfood_website_url)
+
+    def _run_job(self, name: str, job, attempt: int = 0):
+        # a refresh is skipped while another job runs, the other jobs wait
+        if not self._job_lock.acquire(blocking=name != "refresh"):
+            logger.info(f"Skipping job '{name}', another job is running")
+            return
+        try:
+            self._run_job_locked(name, job, attempt)
+        finally:
+            self._job_lock.release()
+            self.write_heartbeat()
+
+    def _run_job_locked(self, name: str, job, attempt: int):
+        with self._lock:
+            state = self._jobs.setdefault(name, {})
+            state["last_run"] = time.time()
+        if attempt:
+            logger.info(f"Running job '{name}' (retry {attempt})")
+        else:
+            logger.info(f"Running job '{name}'")
+        try:
+            job()
+        except Exception as e:
+            logger.exception(f"Job '{name}' failed")
+            with self._lock:
+                state["last_error"] = f"{type(e).__name__}: {e}"
+                state["last_error_at"] = time.time()
+            retry = name == "post" and self._schedule_retry(name, job, attempt + 1)
+            if name != "refresh":
+                from lunchbot.runner import send_alert
+
+                send_alert(
+                    f"An error occurred in job '{name}': {e}"
+                    + (
+                        f" (retry {attempt + 1} of {self.post_retries} in "
+                        f"{self.post_retry_delay:g} min)"
+                        if retry
+                        else ""
+                    ),
+                    timing_summary=self.config.alert_timing_summary,
+                )
+        else:
+            with self._lock:
+                state["last_success"] = time.time()
+            logger.info(f"Job '{name}' done")
+
+    def _schedule_retry(self, name: str, job, attempt: int):
+        """Run a failed job again later (at most ``post_retries`` times).
+
+        Returns
+        -------
+        bool
+            Whether the retry was scheduled.
+        """
+        if (
+            attempt > self.post_retries
+            or self._scheduler is None
+            or not self._scheduler.running
+        ):
+            return False
+        from apscheduler.triggers.date import DateTrigger
+
+        run_date = datetime.now(timezone.utc) + timedelta(minutes=self.post_retry_delay)
+        self._scheduler.add_job(
+            self._run_job,
+            DateTrigger(run_date=run_date),
+            args=(name, job, attempt),
+            id=f"{name}_retry",
+            replace_existing=True,
+            misfire_grace_time=3600,
+        )
+        logger.info(f"Retrying job '{name}' at {run_date.astimezone():%H:%M}")
+        return True
+
+    # ------------------------------------------------------------------------
+    # status
+
+    def health(self):
+        """Get the status of the daemon.
+
+        The daemon is healthy if the scheduler is running and the last post (if
+        any) succeeded. The states of the circuit breakers are included for
+        information (an open breaker has a fallback, it doesn't make the daemon
+        unhealthy).
+        """
+        with self._lock:
+            jobs = {name: dict(state) for name, state in self._jobs.items()}
+        running = self._scheduler is not None and self._scheduler.running
+        post = jobs.get("post", {})
+        healthy = running and post.get("last_error_at", 0) <= post.get(
+            "last_success", 0
+        )
+        next_runs = {}
+        if running:
+            for job in self._scheduler.get_jobs():
+                if job.next_run_time is not None:
+                    next_runs[job.id] = job.next_run_time.isoformat()
+        return {
+            "healthy": healthy,
+            "time": time.time(),
+            "started_at": self._started_at,
+            "jobs": jobs,
+            "next_runs": next_runs,
+            "circuit_breakers": get_circuit_breaker_states(),
+        }
+
+    def write_heartbeat(self):
+        """Write the status to the heartbeat file."""
+        tmp_path = f"{self.heartbeat_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.health(), f, indent=2)
+            os.replace(tmp_path, self.heartbeat_path)
+        except OSError as e:
+            logger.warning(f"Could not write the heartbeat file: {e}")
+
+    # ------------------------------------------------------------------------
+    # lifecycle
+
+    def start(self):
+        """Start the scheduler and block until SIGINT/SIGTERM is received."""
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from apscheduler.triggers.cron import CronTrigger
+        from apscheduler.triggers.interval import IntervalTrigger
+
+        self._scheduler = BackgroundScheduler(
+            timezone=self.timezone,
+            # a run that was missed (e.g. during a restart) is done once, late
+            job_defaults={"coalesce": True, "max_instances": 1},
+        )
+        for day, (hour, minute) in self.post_times.items():
+            self._scheduler.add_job(
+                self._run_job,
+                CronTrigger(day_of_week=day.lower(), hour=hour, minute=minute),
+                args=("post", self.post),
+                id=f"post_{day.lower()}",
+                misfire_grace_time=3600,
+            )
+        if self.prefetch_time is not None:
+            hour, minute = parse_time(self.prefetch_time)
+            self._scheduler.add_job(
+                self._run_job,
+                CronTrigger(hour=hour, minute=minute),
+                args=("prefetch", self.prefetch),
+                id="prefetch",
+                misfire_grace_time=6 * 3600,
+            )
+        if self.refresh_interval is not None:
+            self._scheduler.add_job(
+                self._run_job,
+                IntervalTrigger(minutes=self.refresh_interval),
+                args=("refresh", self.refresh_caches),
+                id="refresh",
+            )
+        self._scheduler.add_job(
+            self.write_heartbeat,
+            IntervalTrigger(seconds=self.heartbeat_interval),
+            id="heartbeat",
+        )
+
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        self._scheduler.start()
+        if self.health_port is not None:
+            self._start_health_server()
+        self.write_heartbeat()
+        for job in self._scheduler.get_jobs():
+            logger.info(f"Scheduled job '{job.id}', next run at {job.next_run_time}")
+
+        # the main thread only waits, the jobs run on the scheduler's threads
+        while not self._stop.wait(1):
+            pass
+        self.shutdown()
+
+    def _handle_signal(self, signum, frame):
+        logger.info(f"Received signal {signal.Signals(signum).name}, shutting down")
+        self._stop.set()
+
+    def _start_health_server(self):
+        handler = type("HealthHandler", (_HealthHandler,), {"lunchbot_daemon": self})
+        self._health_server = ThreadingHTTPServer(("", self.health_port), handler)
+        threading.Thread(
+            target=self._health_server.serve_forever,
+            name="health",
+            daemon=True,
+        ).start()
+        logger.info(f"Serving the health status on port {self.health_port}")
+
+    def shutdown(self):
+        """Stop the scheduler, waiting for running jobs to finish."""
+        self._stop.set()
+        if self._scheduler is not None and self._scheduler.running:
+            logger.info("Waiting for running jobs to finish...")
+            self._scheduler.shutdown(wait=True)
+        if self._health_server is not None:
+            self._health_server.shutdown()
+            self._health_server.server_close()
+            self._health_server = None
+        self.write_heartbeat()
+        logger.info(f"Daemon stopped at {datetime.now():%Y-%m-%d %H:%M:%S}")
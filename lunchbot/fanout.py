@@ -0,0 +1,266 @@
+"""Post the menu to several Mattermost channels at the same time."""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date as date_type
+
+from lunchbot.circuit_breaker import get_circuit_breaker
+from lunchbot.http_session import retry_call
+from lunchbot.mattermost_posting import send_message_via_webhook
+from lunchbot.message import (
+    WEEKDAYS,
+    compose_messages,
+    get_message_suffix,
+    message_overhead,
+)
+from lunchbot.metrics import incr
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WebhookTarget:
+    """A channel the menu is posted to.
+
+    Attributes
+    ----------
+    name : str
+        Name of the target (for the logs and the report).
+    webhook_url : str
+        The incoming webhook of the channel.
+    username : str, optional
+        Username displayed for the bot, by default "Lunchbot".
+    prefix : str, optional
+        Text in front of the table, by default ``MESSAGE_PREFIX``.
+    suffix : str or dict, optional
+        Text after the table, either one for all days or a dictionary with one
+        per weekday ("MON", ...). By default the ``MESSAGE_SUFFIX_<DAY>`` of the
+        day.
+    attempts : int, optional
+        Maximum number of attempts of the post, by default 5.
+    """
+
+    name: str
+    webhook_url: str
+    username: str = "Lunchbot"
+    prefix: str = None
+    suffix: object = None
+    attempts: int = 5
+
+    def prefix_and_suffix(self, default_prefix: str = "", date: date_type = None):
+        """Get the prefix and the suffix of the message of a day."""
+        date = date or date_type.today()
+        suffix = self.suffix
+        if isinstance(suffix, dict):
+            suffix = suffix.get(WEEKDAYS[date.weekday()])
+        if suffix is None:
+            suffix = get_message_suffix(date)
+        prefix = default_prefix if self.prefix is None else self.prefix
+        return prefix, suffix
+
+    def overhead(self, default_prefix: str = "", date: date_type = None):
+        """Number of characters the prefix and the suffix add to the tables."""
+        return message_overhead(*self.prefix_and_suffix(default_prefix, date))
+
+    def render(self, tables: list, default_prefix: str = "", date: date_type = None):
+        """Put the messages of this target together (one per table)."""
+        return compose_messages(tables, *self.prefix_and_suffix(default_prefix, date))
+
+
+@dataclass
+class PostResult:
+    """Result of the post to one target.
+
+    Attributes
+    ----------
+    target : str
+        Name of the target.
+    ok : bool
+        Whether all messages were posted.
+    posts : int
+        Number of messages that were posted.
+    attempts : int
+        Number of attempts that were made (for all messages).
+    duration : float
+        Time in seconds from the first attempt until the post succeeded or
+        failed for good.
+    error : str
+        Error of the last attempt (None if the post succeeded).
+    skipped : int
+        Number of messages that were already posted by an earlier run (see
+        ``lunchbot.run_journal``).
+    """
+
+    target: str
+    ok: bool
+    posts: int
+    attempts: int
+    duration: float
+    error: str = None
+    skipped: int = 0
+
+
+def load_targets(path: str):
+    """Read the webhook targets from a YAML file.
+
+    The file has a list ``targets`` with the fields of ``WebhookTarget`` and an
+    optional mapping ``defaults`` with values for all targets. Instead of
+    ``webhook_url``, ``webhook_url_env`` can name the environment variable with
+    the URL, so the file doesn't have to contain secrets::
+
+        defaults:
+          username: Lunchbot
+        targets:
+          - name: team-a
+            webhook_url_env: TEAM_A_WEBHOOK_URL
+            prefix: "Lunch time!"
+            suffix:
+              FRI: "Have a nice weekend!"
+
+    Returns
+    -------
+    list
+        List of ``WebhookTarget``.
+    """
+    import yaml
+
+    with open(path, encoding="utf-8") as f:
+        content = yaml.safe_load(f) or {}
+
+    defaults = content.get("defaults") or {}
+    targets = []
+    for i, entry in enumerate(content.get("targets") or []):
+        entry = {**defaults, **entry}
+        url_env = entry.pop("webhook_url_env", None)
+        if url_env is not None:
+            entry["webhook_url"] = os.getenv(url_env)
+        entry.setdefault("name", f"target-{i + 1}")
+        if not entry.get("webhook_url"):
+            raise ValueError(f"No webhook URL for target '{entry['name']}' in {path}")
+        # the name identifies the channel in the run journal
+        if any(t.name == entry["name"] for t in targets):
+            raise ValueError(f"Duplicate target name '{entry['name']}' in {path}")
+        targets.append(WebhookTarget(**entry))
+    return targets
+
+
+def _post(target: WebhookTarget, messages: list, journal=None):
+    attempts = 0
+    posts = 0
+    # the messages an earlier run posted already
+    skipped = journal.posted(target.name) if journal is not None else 0
+    # a channel whose webhook keeps failing is skipped (and not retried) until
+    # its breaker lets a probe through; a post counts as one failure once all
+    # its attempts failed
+    breaker = get_circuit_breaker(f"webhook:{target.name}")
+
+    def send(message):
+        nonlocal attempts
+        attempts += 1
+        return send_message_via_webhook(
+            webhook_url=target.webhook_url,
+            message=message,
+            username=target.username,
+        )
+
+    start = time.monotonic()
+    # the messages of a split table are posted in order, a failed one stops
+    # the rest
+    for index, message in enumerate(messages[skipped:], start=skipped):
+        try:
+            breaker.call(
+                lambda: retry_call(
+                    lambda: send(message),
+                    attempts=target.attempts,
+                    description=f"posting to '{target.name}'",
+                )
+            )
+        except Exception as e:
+            return PostResult(
+                target.name,
+                False,
+                posts,
+                attempts,
+                time.monotonic() - start,
+                str(e) or repr(e),
+                skipped,
+            )
+        posts += 1
+        if journal is not None:
+            journal.mark_posted(target.name, index + 1)
+    return PostResult(
+        target.name, True, posts, attempts, time.monotonic() - start, None, skipped
+    )
+
+
+def post_to_targets(
+    targets: list,
+    tables: list,
+    default_prefix: str = "",
+    date: date_type = None,
+    max_workers: int = 8,
+    journal=None,
+):
+    """Post the menu tables to all targets concurrently.
+
+    Every target is posted (and retried) on its own worker thread, so a slow or
+    failing channel doesn't delay the others. With a ``journal``, the messages
+    that were rendered by an earlier run are posted instead of the new ones and
+    the messages that were already posted are skipped.
+
+    Parameters
+    ----------
+    targets : list
+        List of ``WebhookTarget``.
+    tables : list
+        The rendered menu table(s), each is posted as its own message.
+    default_prefix : str, optional
+        Prefix of the targets without their own one.
+    date : datetime.date, optional
+        The day of the message (for the suffixes), by default today.
+    max_workers : int, optional
+        Maximum number of posts in flight, by default 8.
+    journal : RunJournal, optional
+        Journal of the run of the day, by default posts are not recorded.
+
+    Returns
+    -------
+    list
+        List of ``PostResult``, in the order of ``targets``.
+    """
+    if not targets:
+        return []
+    if isinstance(tables, str):
+        tables = [tables]
+    messages = [target.render(tables, default_prefix, date) for target in targets]
+    if journal is not None:
+        rendered = journal.checkpoint_messages(
+            {target.name: m for target, m in zip(targets, messages)}
+        )
+        messages = [rendered[target.name] for target in targets]
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(targets))),
+        thread_name_prefix="post",
+    ) as executor:
+        results = list(executor.map(_post, targets, messages, [journal] * len(targets)))
+
+    for result in results:
+        if result.ok and not result.posts:
+            incr("channel_posts", result="already_posted")
+            logger.info(f"The menu was already posted to '{result.target}'")
+            continue
+        incr("channel_posts", result="ok" if result.ok else "failed")
+        if result.ok:
+            logger.info(
+                f"Posted {result.posts} message(s) to '{result.target}' in "
+                f"{result.duration:.2f}s ({result.attempts} attempt(s))"
+            )
+        else:
+            logger.error(
+                f"Posting to '{result.target}' failed after {result.attempts} "
+                f"attempt(s): {result.error}"
+            )
+    return results
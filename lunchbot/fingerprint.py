@@ -0,0 +1,94 @@
+"""Canonical fingerprints of dish names, so trivial variations share an image."""
+
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+from lunchbot.utils import generate_hash, get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# allergen/additive codes in parentheses: numbers and single letters (optionally
+# with a digit, like "A1") separated by commas, e.g. "(1, 2, A, G)" or "(a,c1,g)";
+# other labels like "(XL)" or "(2 Stk)" are part of the name
+ALLERGEN_CODE = r"(?:\d{1,2}|[a-z]\d?)"
+ALLERGEN_PARENTHESES_REGEX = re.compile(
+    rf"\(\s*{ALLERGEN_CODE}(?:\s*,\s*{ALLERGEN_CODE})*\s*\)", re.IGNORECASE
+)
+# trailing lists of allergen codes, e.g. "... with rice A, C, G"
+ALLERGEN_SUFFIX_REGEX = re.compile(
+    r"(?:\s+[0-9a-z]{1,2}(?:\s*,\s*[0-9a-z]{1,2})+)\s*$", re.IGNORECASE
+)
+# prices, e.g. "4,50 €", "€ 4.50", "4.50 EUR"
+PRICE_REGEX = re.compile(
+    r"(?:€\s*)?\d+[.,]\d{2}\s*(?:€|eur\b|euro\b)?", re.IGNORECASE
+)
+NON_WORD_REGEX = re.compile(r"[\W_]+")
+
+
+def canonicalize_dish_name(name: str):
+    """Normalise a dish name for comparisons.
+
+    Normalises Unicode (NFKC) and case, removes allergen codes and prices and
+    replaces punctuation and whitespace runs with a single space.
+
+    Example: ``" Chicken-Curry (A, G)  with Rice 4,50 € "`` -> ``"chicken curry
+    with rice"``
+    """
+    name = unicodedata.normalize("NFKC", name or "")
+    name = ALLERGEN_PARENTHESES_REGEX.sub(" ", name)
+    name = PRICE_REGEX.sub(" ", name)
+    name = ALLERGEN_SUFFIX_REGEX.sub(" ", name)
+    name = name.casefold()
+    name = NON_WORD_REGEX.sub(" ", name)
+    return name.strip()
+
+
+def dish_fingerprint(name: str):
+    """Get the content-addressed key of a dish (hash of the canonical name)."""
+    return generate_hash(canonicalize_dish_name(name))
+
+
+class AliasTable:
+    """Persistent mapping of dish fingerprints to the keys of existing images.
+
+    Images that were stored under another key (e.g. the hash of the raw dish name
+    before fingerprints were introduced) stay reachable through their alias.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the JSON file, by default ``image_aliases.json`` in the lunchbot
+        cache directory.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(get_cache_dir(), "image_aliases.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._aliases = json.load(f)
+        except (OSError, ValueError):
+            self._aliases = {}
+
+    def get(self, fingerprint: str):
+        """Get the image key of a fingerprint (None if unknown)."""
+        with self._lock:
+            return self._aliases.get(fingerprint)
+
+    def add(self, fingerprint: str, key: str):
+        """Record that the image of ``fingerprint`` is stored under ``key``."""
+        with self._lock:
+            if self._aliases.get(fingerprint) == key:
+                return
+            self._aliases[fingerprint] = key
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._aliases, f, indent=0, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self._aliases)
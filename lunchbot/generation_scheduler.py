@@ -0,0 +1,392 @@
+"""Rate limits, priorities and a daily cost budget for the generation APIs.
+
+All requests to the image generation and translation APIs go through the shared
+``GenerationScheduler``. Every provider/model has a token bucket: requests above
+its rate are queued (highest priority first) instead of running into ``429``
+errors, and a ``429`` that still happens pauses the bucket and re-queues the
+request. The estimated cost of the requests is charged to a daily budget; prefetch
+requests only get a share of it, so there is always money left for today's post.
+
+Usage::
+
+    image = get_generation_scheduler().call(
+        "openai", "dall-e-2", lambda: generate_image_openai(prompt), priority=...
+    )
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date as date_type
+
+from lunchbot.metrics import incr, observe
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# priorities of the requests (lower numbers go first)
+PRIORITY_TODAY = 0
+PRIORITY_PREFETCH = 10
+
+# requests per minute and burst size per (provider, model)
+DEFAULT_RATE_LIMITS = {
+    ("openai", "dall-e-2"): (100, 10),
+    ("openai", "dall-e-3"): (15, 3),
+    ("openai", "gpt-3.5-turbo"): (500, 50),
+    ("huggingface", "default"): (60, 5),
+}
+
+# estimated cost in USD per request
+DEFAULT_COSTS = {
+    ("openai", "dall-e-2"): 0.016,
+    ("openai", "dall-e-3"): 0.04,
+    ("openai", "gpt-3.5-turbo"): 0.002,
+    ("huggingface", "default"): 0.0,
+}
+
+# pause of a bucket after a 429 answer without a Retry-After header (in seconds)
+DEFAULT_RATE_LIMIT_PAUSE = 20
+
+
+class BudgetExceededError(RuntimeError):
+    """The request would exceed the daily cost budget."""
+
+
+class QueueTimeoutError(RuntimeError):
+    """The request waited too long for the rate limit."""
+
+
+def _env_key(provider: str, model: str):
+    return re.sub(r"[^A-Z0-9]+", "_", f"{provider}_{model}".upper())
+
+
+def parse_rate_limit(value: str):
+    """Parse a rate limit like "100/10" (per minute / burst) or "100".
+
+    Returns None for "off".
+    """
+    value = value.strip().lower()
+    if value in ("", "off", "none", "false"):
+        return None
+    rate, _, burst = value.partition("/")
+    rate = float(rate)
+    return rate, int(burst) if burst else max(1, int(rate // 10))
+
+
+class TokenBucket:
+    """Allow ``rate`` requests per minute with bursts of up to ``burst``.
+
+    Not thread-safe on its own, the scheduler guards it with its lock.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate / 60
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float):
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for ``seconds`` (e.g. after a ``429``)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # no burst once the pause is over
+        self.tokens = min(self.tokens, 1.0)
+
+
+class CostBudget:
+    """Daily budget of the estimated costs, persisted in the cache directory.
+
+    Parameters
+    ----------
+    limit : float, optional
+        Budget per day in USD, None for no limit (the costs are still tracked).
+    prefetch_share : float, optional
+        Share of the budget prefetch requests may use, by default 0.8.
+    path : str, optional
+        File of the spendings of the day, by default ``generation_budget.json``
+        in the lunchbot cache directory.
+    """
+
+    def __init__(self, limit: float = None, prefetch_share: float = 0.8, path=None):
+        self.limit = limit
+        self.prefetch_share = prefetch_share
+        self.path = path or os.path.join(get_cache_dir(), "generation_budget.json")
+        self._lock = threading.Lock()
+
+    def spent(self, day: date_type = None):
+        """Estimated costs of ``day`` (by default today) in USD."""
+        with self._lock:
+            return self._load(day or date_type.today())
+
+    def charge(self, cost: float, priority: int = PRIORITY_TODAY):
+        """Charge ``cost`` to the budget of today.
+
+        Raises ``BudgetExceededError`` (without charging) if the budget (or, for
+        prefetch requests, their share of it) would be exceeded.
+        """
+        if cost <= 0:
+            return
+        today = date_type.today()
+        with self._lock:
+            spent = self._load(today)
+            if self.limit is not None:
+                limit = self.limit
+                if priority > PRIORITY_TODAY:
+                    limit *= self.prefetch_share
+                if spent + cost > limit:
+                    raise BudgetExceededError(
+                        f"Daily budget exceeded: {spent:.3f} of {limit:.2f} USD "
+                        "spent"
+                    )
+            self._save(today, spent + cost)
+
+    def refund(self, cost: float):
+        """Give back the cost of a request that failed."""
+        if cost <= 0:
+            return
+        today = date_type.today()
+        with self._lock:
+            self._save(today, max(0.0, self._load(today) - cost))
+
+    def _load(self, day: date_type):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return 0.0
+        return content.get("spent", 0.0) if content.get("date") == str(day) else 0.0
+
+    def _save(self, day: date_type, spent: float):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"date": str(day), "spent": spent}, f)
+        os.replace(tmp_path, self.path)
+
+
+class GenerationScheduler:
+    """Queue the requests to the generation APIs by rate limit and priority.
+
+    Parameters
+    ----------
+    rate_limits : dict, optional
+        ``{(provider, model): (requests per minute, burst)}``, by default
+        ``DEFAULT_RATE_LIMITS``. Keys that are not listed are not limited.
+    costs : dict, optional
+        ``{(provider, model): USD per request}``, by default ``DEFAULT_COSTS``.
+    budget : CostBudget, optional
+        Daily budget, by default one without limit.
+    max_wait : float, optional
+        Maximum time in seconds a request waits in the queue, by default 600.
+    rate_limit_retries : int, optional
+        Number of times a request that got a ``429`` is re-queued, by default 3.
+    """
+
+    def __init__(
+        self,
+        rate_limits: dict = None,
+        costs: dict = None,
+        budget: CostBudget = None,
+        max_wait: float = 600,
+        rate_limit_retries: int = 3,
+    ):
+        rate_limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        self.costs = DEFAULT_COSTS if costs is None else costs
+        self.budget = budget if budget is not None else CostBudget()
+        self.max_wait = max_wait
+        self.rate_limit_retries = rate_limit_retries
+        self._buckets = {
+            key: TokenBucket(*limit)
+            for key, limit in rate_limits.items()
+            if limit is not None
+        }
+        self._queues = {key: [] for key in self._buckets}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        """Create the scheduler from the environment variables.
+
+        ``RATE_LIMIT_<PROVIDER>_<MODEL>`` (e.g. ``RATE_LIMIT_OPENAI_DALL_E_2``)
+        sets a rate limit ("requests per minute/burst" or "off"),
+        ``GENERATION_COST_<PROVIDER>_<MODEL>`` the cost of a request.
+        """
+        rate_limits = dict(DEFAULT_RATE_LIMITS)
+        costs = dict(DEFAULT_COSTS)
+        for provider, model in set(rate_limits) | set(costs):
+            key = _env_key(provider, model)
+            if os.getenv(f"RATE_LIMIT_{key}") is not None:
+                rate_limits[provider, model] = parse_rate_limit(
+                    os.getenv(f"RATE_LIMIT_{key}")
+                )
+            if os.getenv(f"GENERATION_COST_{key}") is not None:
+                costs[provider, model] = float(os.getenv(f"GENERATION_COST_{key}"))
+        limit = os.getenv("DAILY_COST_BUDGET")
+        budget = CostBudget(
+            limit=float(limit) if limit else None,
+            prefetch_share=float(os.getenv("PREFETCH_BUDGET_SHARE", "0.8")),
+        )
+        return cls(
+            rate_limits=rate_limits,
+            costs=costs,
+            budget=budget,
+            max_wait=float(os.getenv("GENERATION_MAX_WAIT", "600")),
+        )
+
+    def call(self, provider: str, model: str, fn, priority: int = PRIORITY_TODAY):
+        """Run ``fn()`` once the rate limit and the budget allow it.
+
+        Parameters
+        ----------
+        provider : str
+            Name of the provider ("openai" or "huggingface").
+        model : str
+            Name of the model ("default" for the model behind an URL).
+        fn : callable
+            The request.
+        priority : int, optional
+            Priority of the request, by default ``PRIORITY_TODAY``.
+
+        Returns
+        -------
+        object
+            The result of ``fn``. Errors of ``fn`` are raised, as well as
+            ``BudgetExceededError`` and ``QueueTimeoutError``.
+        """
+        key = (provider, model)
+        cost = self.costs.get(key, 0.0)
+        for attempt in range(self.rate_limit_retries + 1):
+            try:
+                self.budget.charge(cost, priority)
+            except BudgetExceededError:
+                self._record(key, "rejected_budget")
+                raise
+            try:
+                self._acquire(key, priority)
+            except QueueTimeoutError:
+                self.budget.refund(cost)
+                raise
+            try:
+                result = fn()
+            except Exception as e:
+                self.budget.refund(cost)
+                pause = _rate_limit_pause(e)
+                if pause is None or attempt == self.rate_limit_retries:
+                    raise
+                logger.warning(
+                    f"Rate limit of {provider}/{model} reached, pausing it for "
+                    f"{pause:.1f}s and queueing the request again"
+                )
+                self._record(key, "rate_limited")
+                self._pause(key, pause)
+                continue
+            if cost:
+                incr("generation_cost_usd", cost, provider=provider, model=model)
+            return result
+
+    def _acquire(self, key: tuple, priority: int):
+        """Wait until the request is the first in its queue and has a token."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._record(key, "immediate")
+            return
+
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        queue = self._queues[key]
+        entry = (priority, next(self._counter))
+        with self._condition:
+            heapq.heappush(queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = bucket.wait_time(now)
+                    if queue[0] == entry and wait == 0:
+                        heapq.heappop(queue)
+                        bucket.take()
+                        break
+                    if now >= deadline:
+                        queue.remove(entry)
+                        heapq.heapify(queue)
+                        self._record(key, "timed_out")
+                        raise QueueTimeoutError(
+                            f"No free slot for {key[0]}/{key[1]} within "
+                            f"{self.max_wait:.0f}s"
+                        )
+                    # the first request waits for the next token, the others
+                    # until they are woken up
+                    timeout = wait if queue[0] == entry else deadline - now
+                    self._condition.wait(min(max(timeout, 0.001), deadline - now))
+            finally:
+                self._condition.notify_all()
+
+        waited = time.monotonic() - start
+        self._record(key, "queued" if waited > 0.001 else "immediate")
+        observe(f"queue.{key[0]}", waited)
+
+    def _pause(self, key: tuple, seconds: float):
+        with self._condition:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # keys without a limit get one once they hit the rate limit
+                bucket = self._buckets[key] = TokenBucket(60, 1)
+                self._queues[key] = []
+            bucket.pause(seconds)
+            self._condition.notify_all()
+
+    @staticmethod
+    def _record(key: tuple, decision: str):
+        incr("generation_requests", provider=key[0], model=key[1], decision=decision)
+
+
+def is_rate_limit_error(error: Exception):
+    """Whether ``error`` is a ``429`` answer of the provider."""
+    return _rate_limit_pause(error) is not None
+
+
+def _rate_limit_pause(error: Exception):
+    """Seconds to pause after ``error`` if it is a ``429``, else None."""
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    if status_code != 429:
+        return None
+    retry_after = (getattr(response, "headers", None) or {}).get("Retry-After")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return DEFAULT_RATE_LIMIT_PAUSE
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_generation_scheduler():
+    """Get the shared scheduler (created from the environment on first use)."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = GenerationScheduler.from_env()
+        return _default_scheduler
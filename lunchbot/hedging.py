@@ -0,0 +1,240 @@
+"""Hedged requests: start a backup if the primary provider is slow.
+
+The latencies of every image generation provider are kept in a small histogram
+(persisted in the cache directory at the end of a run, so they survive single
+runs). Failed requests are kept in separate histograms, so neither fast errors
+nor timeouts change the hedge delay. When hedging is
+enabled, the backup provider is started as soon as the primary one has taken
+longer than its usual latency (by default its p95), or right away if the primary
+fails. The first valid result wins, the other request is ignored.
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from lunchbot.metrics import incr
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in seconds (0.1s ... ~2min)
+BUCKET_BOUNDS = tuple(round(0.1 * 1.25**i, 3) for i in range(33))
+
+# weight of the old observations after each new one, so the histogram follows
+# changes of the latency (about the last 50 requests count)
+DECAY = 0.98
+
+# hedge delay while there are not enough observations, and its limits
+DEFAULT_HEDGE_DELAY = 10.0
+MIN_HEDGE_DELAY = 1.0
+MAX_HEDGE_DELAY = 60.0
+MIN_OBSERVATIONS = 10
+
+
+class LatencyHistogram:
+    """Histogram of the latencies of a provider with exponentially decaying counts.
+
+    Parameters
+    ----------
+    counts : list, optional
+        Counts of ``BUCKET_BOUNDS`` (plus one for slower requests).
+    observations : int, optional
+        Number of latencies observed so far.
+    """
+
+    def __init__(self, counts: list = None, observations: int = 0):
+        self.counts = list(counts or [0.0] * (len(BUCKET_BOUNDS) + 1))
+        self.observations = observations
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def observe(self, seconds: float):
+        """Add a latency."""
+        self.counts = [c * DECAY for c in self.counts]
+        index = next(
+            (i for i, bound in enumerate(BUCKET_BOUNDS) if seconds <= bound),
+            len(BUCKET_BOUNDS),
+        )
+        self.counts[index] += 1
+        self.observations += 1
+
+    def quantile(self, q: float):
+        """Estimate the ``q`` quantile (interpolated within the bucket).
+
+        Returns None if there are no observations.
+        """
+        total = self.total
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0.0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else lower * 2
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKET_BOUNDS[-1]
+
+
+class LatencyTracker:
+    """The latency histograms of all providers, persisted as JSON.
+
+    Parameters
+    ----------
+    path : str, optional
+        File of the histograms, by default ``latencies.json`` in the lunchbot
+        cache directory.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(get_cache_dir(), "latencies.json")
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._dirty = False
+        self._load()
+
+    def observe(self, provider: str, seconds: float, outcome: str = "ok"):
+        """Add a latency of ``provider``.
+
+        The latencies of failed requests (``outcome`` e.g. "error" or
+        "rate_limited") are kept in the histogram ``<provider>:<outcome>``.
+        """
+        key = provider if outcome == "ok" else f"{provider}:{outcome}"
+        with self._lock:
+            self._histograms.setdefault(key, LatencyHistogram()).observe(seconds)
+            self._dirty = True
+
+    def save(self):
+        """Write the histograms (if there are new latencies)."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+                self._dirty = False
+
+    def quantile(self, provider: str, q: float):
+        """Latency quantile of ``provider``, None if it is not known yet."""
+        with self._lock:
+            histogram = self._histograms.get(provider)
+            if histogram is None or histogram.observations < MIN_OBSERVATIONS:
+                return None
+            return histogram.quantile(q)
+
+    def hedge_delay(self, provider: str, q: float = 0.95):
+        """Time after which a backup for ``provider`` is started."""
+        latency = self.quantile(provider, q)
+        if latency is None:
+            return DEFAULT_HEDGE_DELAY
+        return min(max(latency, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return
+        if content.get("bounds") != list(BUCKET_BOUNDS):
+            # other buckets, start over
+            return
+        self._histograms = {
+            provider: LatencyHistogram(h["counts"], h["observations"])
+            for provider, h in content.get("histograms", {}).items()
+        }
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "bounds": list(BUCKET_BOUNDS),
+                        "histograms": {
+                            p: {
+                                "counts": [round(c, 4) for c in h.counts],
+                                "observations": h.observations,
+                            }
+                            for p, h in self._histograms.items()
+                        },
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save the latency histograms: {e}")
+
+
+_default_tracker = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker():
+    """Get the shared latency tracker."""
+    global _default_tracker
+    with _default_tracker_lock:
+        if _default_tracker is None:
+            _default_tracker = LatencyTracker()
+        return _default_tracker
+
+
+def hedged(primary, backup, delay: float, name: str = "request"):
+    """Run ``primary()`` and start ``backup()`` if it is slow or fails.
+
+    Parameters
+    ----------
+    primary, backup : callable
+        The two ways to get the result, a result of None counts as a failure.
+    delay : float
+        Seconds after which the backup is started if the primary has not
+        answered yet.
+    name : str, optional
+        Name of the request (for the logs).
+
+    Returns
+    -------
+    object
+        The first valid result. If both fail, the error of the primary is raised.
+    """
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-hedge")
+    roles = {}
+    try:
+        roles[executor.submit(primary)] = "primary"
+        done, _ = wait(roles, timeout=delay)
+        if not done:
+            logger.info(f"No answer for {name} after {delay:.1f}s, starting the backup")
+            incr("hedged_requests", decision="hedged")
+            roles[executor.submit(backup)] = "backup"
+
+        errors = {}
+        pending = set(roles)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                role = roles[future]
+                try:
+                    result = future.result()
+                    if result is None:
+                        raise ValueError(f"no result from the {role}")
+                except Exception as e:
+                    errors[role] = e
+                    logger.warning(f"The {role} of {name} failed: {e}")
+                    if "backup" not in roles.values():
+                        # the primary failed before the hedge delay
+                        incr("hedged_requests", decision="fallback")
+                        backup_future = executor.submit(backup)
+                        roles[backup_future] = "backup"
+                        pending.add(backup_future)
+                    continue
+                incr("hedge_winners", winner=role)
+                return result
+        incr("hedge_winners", winner="none")
+        raise errors.get("primary") or errors["backup"]
+    finally:
+        # the loser can't be interrupted, its result is ignored
+        for future in roles:
+            future.cancel()
+        executor.shutdown(wait=False)
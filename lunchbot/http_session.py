@@ -0,0 +1,147 @@
+"""Shared HTTP session with connection pooling, timeouts and retries."""
+
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from lunchbot.circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# status codes that are worth retrying (rate limits and temporary server errors)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# methods that are retried automatically by the session (POST is not idempotent
+# and has to be retried explicitly with `retry_call`)
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PROPFIND"])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+    """Session that applies a default timeout to every request."""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(
+    timeout: float = None,
+    retries: int = None,
+    backoff_factor: float = None,
+    backoff_jitter: float = None,
+    pool_maxsize: int = None,
+):
+    """Create a session with keep-alive connection pools and automatic retries.
+
+    Unset arguments are read from the environment variables ``HTTP_TIMEOUT``
+    (default 20 s), ``HTTP_RETRIES`` (3), ``HTTP_BACKOFF_FACTOR`` (0.5 s),
+    ``HTTP_BACKOFF_JITTER`` (0.5 s, needs urllib3 2) and ``HTTP_POOL_MAXSIZE``
+    (10 connections per host).
+    """
+    if timeout is None:
+        timeout = float(os.getenv("HTTP_TIMEOUT", "20"))
+    if retries is None:
+        retries = int(os.getenv("HTTP_RETRIES", "3"))
+    if backoff_factor is None:
+        backoff_factor = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+    if backoff_jitter is None:
+        backoff_jitter = float(os.getenv("HTTP_BACKOFF_JITTER", "0.5"))
+    if pool_maxsize is None:
+        pool_maxsize = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+
+    retry_kwargs = {}
+    # urllib3 1.26 (still allowed by requests) has no jitter
+    if "backoff_jitter" in inspect.signature(Retry).parameters:
+        retry_kwargs["backoff_jitter"] = backoff_jitter
+    retry = Retry(
+        total=retries,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=RETRY_METHODS,
+        backoff_factor=backoff_factor,
+        # return the last response instead of raising, callers check the status
+        raise_on_status=False,
+        **retry_kwargs,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+    session = TimeoutSession(timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def split_credentials(token: str):
+    """Split a ``user:password`` token (as used by ``curl -u``) into a tuple."""
+    user, _, password = (token or "").partition(":")
+    return user, password
+
+
+def get_session():
+    """Get the session shared by all modules (created on first use)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def retry_call(
+    fn,
+    attempts: int = 5,
+    base_delay: float = 1,
+    max_delay: float = 30,
+    description: str = "request",
+):
+    """Call ``fn`` until it succeeds, with exponential backoff and full jitter.
+
+    Parameters
+    ----------
+    fn : callable
+        Function without arguments to call.
+    attempts : int, optional
+        Maximum number of attempts, by default 5.
+    base_delay : float, optional
+        Maximum delay in seconds before the second attempt, doubled for every
+        further attempt, by default 1.
+    max_delay : float, optional
+        Upper limit of the delay in seconds, by default 30.
+    description : str, optional
+        Description of the call for the log messages, by default "request".
+
+    Returns
+    -------
+    object
+        The return value of ``fn``. The exception of the last attempt is raised
+        if all attempts fail. ``CircuitOpenError`` is raised right away, the
+        breaker already knows that the service is down.
+    """
+    for n in range(attempts):
+        try:
+            return fn()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"An error occurred during {description}: {e}")
+            if n == attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**n))  # nosec
+            logger.info(
+                f"Retrying in {delay:.1f}s... (attempt {n + 2}/{attempts})"
+            )
+            time.sleep(delay)
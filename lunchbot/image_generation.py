@@ -1,15 +1,80 @@
-"""Image generation stuff."""
+"""Image generation stuff.
 
-import io
+All providers return a ``GeneratedImage`` with the raw image bytes, so the image is
+kept in memory exactly once and handed to the uploader as it is (no temporary URL,
+no decoding and re-encoding). The provider libraries are imported inside the
+functions, so importing this module doesn't pay for ``openai``.
+"""
+
+import base64
 import logging
+from dataclasses import dataclass
 
-import requests
-from openai import OpenAI
-from PIL import Image
+from lunchbot.http_session import get_session
+from lunchbot.metrics import span
+from lunchbot.utils import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# image that is shown if no image could be generated
+TECHNICAL_DIFFICULTIES_IMAGE_URL = "https://syncandshare.desy.de/index.php/s/QRHbNjEPB39FF55/download?path=lunchbot_assets&files=technical_difficulties.JPG"
+
+# magic bytes at the start of the supported image formats
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+
+
+@dataclass
+class GeneratedImage:
+    """A generated image.
+
+    Attributes
+    ----------
+    data : bytes
+        The encoded image, as returned by the provider.
+    format : str
+        Format of the image ("png", "jpeg", "webp" or "gif").
+    provider : str
+        Name of the provider that generated the image.
+    """
+
+    data: bytes
+    format: str
+    provider: str
+
+    @property
+    def content_type(self):
+        """MIME type of the image."""
+        return f"image/{self.format}"
+
+
+def detect_image_format(data: bytes):
+    """Get the format of an encoded image from its magic bytes (None if unknown).
+
+    Only the first few bytes are looked at, the image is not decoded.
+    """
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return image_format
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
 
+
+def _to_generated_image(data: bytes, provider: str):
+    image_format = detect_image_format(data)
+    if image_format is None:
+        # e.g. a JSON error payload
+        raise ValueError(f"{provider} did not return an image: {data[:200]!r}")
+    logger.info(f"Image generated successfully ({image_format}, {len(data)} bytes)")
+    return GeneratedImage(data=data, format=image_format, provider=provider)
+
+
+@span("openai.images")
 def generate_image_openai(
     prompt,
     model="dall-e-2",
@@ -28,33 +93,29 @@ def generate_image_openai(
 
     Returns
     -------
-    str
-        The URL of the generated image. If an error occurs, a default image URL is returned.
+    GeneratedImage
+        The generated image. Errors of the API are raised.
     """
-    client = OpenAI()
+    client = get_openai_client()
 
     logger.info(f"Generating image (with OpenAI-API) with prompt: {prompt}")
 
-    try:
-        response = client.images.generate(
-            model=model,
-            prompt=prompt,
-            size=size,
-            n=1,
-        )
-        image_url = response.data[0].url
-    except Exception as e:
-        print(f"Exception raised during image generation: {e}")
-        image_url = "https://syncandshare.desy.de/index.php/s/QRHbNjEPB39FF55/download?path=lunchbot_assets&files=technical_difficulties.JPG"
-
-    return image_url
+    # get the image data directly instead of a temporary URL
+    response = client.images.generate(
+        model=model,
+        prompt=prompt,
+        size=size,
+        n=1,
+        response_format="b64_json",
+    )
+    return _to_generated_image(base64.b64decode(response.data[0].b64_json), "OpenAI")
 
 
+@span("huggingface.images")
 def generate_image_huggingface(
     prompt,
     api_token,
     api_url,
-    save_path="image.jpg",
 ):
     """Generate an image using the huggingface api.
 
@@ -66,20 +127,36 @@ def generate_image_huggingface(
         The API token to use for the request.
     api_url : str
         The URL of the API to use for the request.
-    save_path : str
-        The path to save the generated image to. Defaults to "image.jpg".
+
+    Returns
+    -------
+    GeneratedImage
+        The generated image. Errors of the API (or answers that are not an
+        image) are raised.
     """
     headers = {"Authorization": f"Bearer {api_token}"}
 
     logger.info(f"Generating image (with huggingface-api) with prompt: {prompt}")
 
-    def query(payload):
-        response = requests.post(api_url, headers=headers, json=payload, timeout=60)
-        return response.content
-
     add_prompt = "Generate a realistic looking image based on the following prompt: "
 
-    image_bytes = query({"inputs": add_prompt + prompt})
-    image = Image.open(io.BytesIO(image_bytes))
-    logger.info(f"Image generated successfully. Saving to {save_path}.")
-    image.save(save_path)
+    response = get_session().post(
+        api_url,
+        headers=headers,
+        json={"inputs": add_prompt + prompt},
+        timeout=60,
+    )
+    response.raise_for_status()
+    return _to_generated_image(response.content, "Huggingface")
+
+
+def generate_image(prompt, provider, **kwargs):
+    """Generate an image with the given provider ("openai" or "huggingface").
+
+    Keyword arguments are passed on to the provider function.
+    """
+    if provider == "openai":
+        return generate_image_openai(prompt, **kwargs)
+    if provider == "huggingface":
+        return generate_image_huggingface(prompt, **kwargs)
+    raise ValueError(f"Unknown image generation provider: {provider}")
@@ -0,0 +1,216 @@
+"""Index of the images that are already stored in the image cloud."""
+
+import json
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET  # nosec
+from urllib.parse import unquote, urlparse
+
+import requests
+
+from lunchbot.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from lunchbot.http_session import get_session, split_credentials
+from lunchbot.metrics import span
+from lunchbot.utils import generate_hash, get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+PROPFIND_BODY = (
+    '<?xml version="1.0"?>'
+    '<d:propfind xmlns:d="DAV:"><d:prop><d:resourcetype/></d:prop></d:propfind>'
+)
+
+
+class ImageIndex:
+    """Set of file names in the image cloud, backed by one WebDAV listing.
+
+    The listing of ``upload_url`` is fetched once with a ``PROPFIND`` request and
+    cached on disk for ``ttl`` seconds, so checking whether an image exists is a
+    set lookup instead of downloading the image. If the listing is not available,
+    the index falls back to ``HEAD`` requests against ``download_url``.
+
+    Parameters
+    ----------
+    upload_url : str
+        WebDAV URL of the image directory (``IMAGE_CLOUD_UPLOAD_URL``).
+    download_url : str
+        Public URL prefix of the images (``IMAGE_CLOUD_DOWNLOAD_URL``).
+    token : str, optional
+        Credentials for the WebDAV listing (``user:password``).
+    ttl : float, optional
+        Time in seconds the cached listing is trusted, by default 3600.
+    timeout : float, optional
+        Timeout in seconds for the requests, by default 20.
+    """
+
+    def __init__(
+        self,
+        upload_url: str,
+        download_url: str,
+        token: str = None,
+        ttl: float = 3600,
+        timeout: float = 20,
+    ):
+        self.upload_url = upload_url
+        self.download_url = download_url
+        self.auth = split_credentials(token) if token else None
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cache_path = os.path.join(
+            get_cache_dir("image_index"), f"{generate_hash(upload_url or '')}.json"
+        )
+        self._lock = threading.Lock()
+        self._names = None
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        # whether the listing was fetched by this process (a listing loaded from
+        # the disk cache may be older than its ``fetched_at`` suggests)
+        self._fetched_here = False
+
+    def exists(self, name: str):
+        """Check if the file ``name`` exists in the image cloud."""
+        names = self._get_names()
+        if names is not None:
+            if name in names:
+                return True
+            # a fresh listing is authoritative, a cached one might miss images
+            # that were uploaded by someone else in the meantime
+            if self._is_fresh():
+                return False
+        found = self.head(name)
+        if found:
+            self.add(name)
+        return found
+
+    def head(self, name: str):
+        """Check if ``name`` can be downloaded, without downloading it.
+
+        Raises ``CircuitOpenError`` if the image cloud is known to be down (an
+        image that can't be uploaded shouldn't be generated).
+        """
+        try:
+            with span("cloud.head"):
+                r = get_circuit_breaker("image_cloud").call(
+                    lambda: get_session().head(
+                        f"{self.download_url}{name}",
+                        timeout=self.timeout,
+                        allow_redirects=True,
+                    ),
+                    failed=lambda r: r.status_code >= 500,
+                )
+        except requests.RequestException as e:
+            logger.warning(f"HEAD request for {name} failed: {e}")
+            return False
+        return r.status_code == 200
+
+    def add(self, name: str):
+        """Record that ``name`` was uploaded."""
+        with self._lock:
+            if self._names is None:
+                self._names = set()
+            self._names.add(name)
+            self._save()
+
+    def refresh(self):
+        """Fetch the listing from the image cloud, ignoring the cached one."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self._last_attempt = time.time()
+        names = self._propfind()
+        if names is None:
+            return False
+        self._names = names
+        self._fetched_at = time.time()
+        self._fetched_here = True
+        self._save()
+        return True
+
+    def _is_fresh(self):
+        # the listing stops being authoritative once the TTL is over, also if
+        # the refresh failed and the old listing is still used
+        return self._fetched_here and time.time() - self._fetched_at < self.ttl
+
+    def _get_names(self):
+        with self._lock:
+            if self._names is None:
+                self._load()
+            now = time.time()
+            if self._names is not None and now - self._fetched_at < self.ttl:
+                return self._names
+            # don't retry a failed listing for every single lookup
+            if now - self._last_attempt >= self.ttl:
+                self._refresh()
+            # if the listing is not available, use whatever we know (the
+            # lookup falls back to HEAD requests for everything else)
+            return self._names
+
+    def _propfind(self):
+        if self.upload_url is None:
+            return None
+        try:
+            with span("cloud.list"):
+                r = get_circuit_breaker("image_cloud").call(
+                    lambda: get_session().request(
+                        "PROPFIND",
+                        self.upload_url,
+                        data=PROPFIND_BODY,
+                        headers={"Depth": "1", "Content-Type": "application/xml"},
+                        auth=self.auth,
+                        timeout=self.timeout,
+                    ),
+                    failed=lambda r: r.status_code >= 500,
+                )
+        except (requests.RequestException, CircuitOpenError) as e:
+            logger.warning(f"Could not list the image cloud: {e}")
+            return None
+        if r.status_code != 207:
+            logger.warning(
+                f"Could not list the image cloud (status code {r.status_code})"
+            )
+            return None
+        try:
+            names = parse_propfind_response(r.content)
+        except ET.ParseError as e:
+            logger.warning(f"Could not parse the image cloud listing: {e}")
+            return None
+        logger.info(f"Found {len(names)} files in the image cloud")
+        return names
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._names = set(cached["names"])
+        self._fetched_at = cached["fetched_at"]
+
+    def _save(self):
+        # the listing is only a cache, failing to store it must not fail the
+        # upload that was just recorded
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {"fetched_at": self._fetched_at, "names": sorted(self._names)}, f
+                )
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not save the image index: {e}")
+
+
+def parse_propfind_response(content: bytes):
+    """Get the set of file names from a WebDAV ``PROPFIND`` response."""
+    root = ET.fromstring(content)  # nosec
+    names = set()
+    for href in root.iter("{DAV:}href"):
+        path = unquote(urlparse(href.text or "").path)
+        if path.endswith("/"):
+            # the directory itself or a subdirectory
+            continue
+        names.add(path.rsplit("/", 1)[-1])
+    return names
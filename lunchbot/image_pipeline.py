@@ -0,0 +1,527 @@
+"""Concurrent per-dish image pipeline: check -> generate -> upload -> verify."""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from lunchbot.circuit_breaker import get_circuit_breaker
+from lunchbot.fingerprint import AliasTable, dish_fingerprint
+from lunchbot.generation_scheduler import (
+    PRIORITY_TODAY,
+    get_generation_scheduler,
+    is_rate_limit_error,
+)
+from lunchbot.hedging import get_latency_tracker, hedged
+from lunchbot.http_session import get_session
+from lunchbot.image_generation import (
+    TECHNICAL_DIFFICULTIES_IMAGE_URL,
+    generate_image_huggingface,
+    generate_image_openai,
+)
+from lunchbot.image_index import ImageIndex
+from lunchbot.image_processing import THUMBNAIL_WIDTH, make_thumbnail, thumbnail_name
+from lunchbot.image_upload import upload_image
+from lunchbot.metrics import incr
+from lunchbot.similarity_index import SimilarityIndex
+from lunchbot.utils import color_text
+
+logger = logging.getLogger(__name__)
+
+# maximum number of concurrent requests per image generation provider
+DEFAULT_PROVIDER_CONCURRENCY = {
+    "openai": 4,
+    "huggingface": 2,
+}
+
+# model of the OpenAI image generation
+OPENAI_IMAGE_MODEL = "dall-e-2"
+
+# circuit breakers of the image generation providers
+CIRCUIT_BREAKERS = {
+    "openai": "openai_images",
+    "huggingface": "huggingface",
+}
+
+# keys the pipeline sets on the dish dictionaries
+RESULT_KEYS = ("image_key", "image_url", "thumbnail_url", "generation_info_tag")
+
+
+@dataclass
+class ImagePipelineConfig:
+    """Settings of the image pipeline.
+
+    Attributes
+    ----------
+    api_to_use : str
+        Image generation API, either "openai" or "huggingface".
+    image_cloud_upload_url : str
+        URL prefix the images are uploaded to.
+    image_cloud_upload_token : str
+        Credentials for the upload (``user:password``).
+    image_cloud_download_url : str
+        URL prefix the uploaded images can be downloaded from.
+    huggingface_api_url : str, optional
+        URL of the Hugging Face inference API.
+    huggingface_api_token : str, optional
+        Token for the Hugging Face inference API.
+    max_workers : int, optional
+        Number of dishes processed at the same time, by default 8.
+    provider_concurrency : dict, optional
+        Maximum number of concurrent requests per provider, overrides
+        ``DEFAULT_PROVIDER_CONCURRENCY``.
+    image_index_ttl : float, optional
+        Time in seconds the cached listing of the image cloud is trusted,
+        by default 3600.
+    thumbnails : bool, optional
+        Whether to create and upload a thumbnail for the posted table next to
+        each image, by default True.
+    thumbnail_width : int, optional
+        Width of the thumbnails in pixels, by default ``THUMBNAIL_WIDTH``.
+    thumbnail_format : str, optional
+        Format of the thumbnails ("webp" or "jpeg"), by default "webp".
+    similarity_threshold : float, optional
+        Minimum cosine similarity of the names for reusing the image of another
+        dish (with the same diet label) instead of generating a new one, by
+        default 0.85. None disables the reuse.
+    hedging : bool, optional
+        Whether to start OpenAI in parallel if Hugging Face takes longer than
+        usual (only with ``api_to_use="huggingface"``), by default False.
+    hedge_delay : float, optional
+        Fixed time in seconds after which OpenAI is started, by default the
+        ``hedge_quantile`` of the recent Hugging Face latencies.
+    hedge_quantile : float, optional
+        Quantile of the Hugging Face latencies used as hedge delay, by default
+        0.95.
+    """
+
+    api_to_use: str
+    image_cloud_upload_url: str
+    image_cloud_upload_token: str
+    image_cloud_download_url: str
+    huggingface_api_url: str = None
+    huggingface_api_token: str = None
+    max_workers: int = 8
+    provider_concurrency: dict = field(default_factory=dict)
+    image_index_ttl: float = 3600
+    thumbnails: bool = True
+    thumbnail_width: int = THUMBNAIL_WIDTH
+    thumbnail_format: str = "webp"
+    similarity_threshold: float = 0.85
+    hedging: bool = False
+    hedge_delay: float = None
+    hedge_quantile: float = 0.95
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Create the config from the environment variables.
+
+        Keyword arguments take precedence over the environment.
+        """
+        provider_concurrency = {}
+        for provider in DEFAULT_PROVIDER_CONCURRENCY:
+            value = os.getenv(f"{provider.upper()}_MAX_CONCURRENCY")
+            if value is not None:
+                provider_concurrency[provider] = int(value)
+        settings = {
+            "api_to_use": os.getenv("API_TO_USE", "openai").lower(),
+            "image_cloud_upload_url": os.getenv("IMAGE_CLOUD_UPLOAD_URL"),
+            "image_cloud_upload_token": os.getenv("IMAGE_CLOUD_UPLOAD_TOKEN"),
+            "image_cloud_download_url": os.getenv("IMAGE_CLOUD_DOWNLOAD_URL"),
+            "huggingface_api_url": os.getenv("HUGGINGFACE_API_URL"),
+            "huggingface_api_token": os.getenv("HUGGINGFACE_API_TOKEN"),
+            "max_workers": int(os.getenv("IMAGE_PIPELINE_WORKERS", "8")),
+            "provider_concurrency": provider_concurrency,
+            "image_index_ttl": float(os.getenv("IMAGE_INDEX_TTL", "3600")),
+            "thumbnails": os.getenv("IMAGE_THUMBNAILS", "true").lower() != "false",
+            "thumbnail_width": int(os.getenv("THUMBNAIL_WIDTH", THUMBNAIL_WIDTH)),
+            "thumbnail_format": os.getenv("THUMBNAIL_FORMAT", "webp").lower(),
+            "hedging": os.getenv("IMAGE_HEDGING", "false").lower() == "true",
+            "hedge_quantile": float(os.getenv("IMAGE_HEDGE_QUANTILE", "0.95")),
+        }
+        hedge_delay = os.getenv("IMAGE_HEDGE_DELAY")
+        if hedge_delay:
+            settings["hedge_delay"] = float(hedge_delay)
+        similarity_threshold = os.getenv("IMAGE_SIMILARITY_THRESHOLD", "0.85")
+        settings["similarity_threshold"] = (
+            None
+            if similarity_threshold.lower() in ("", "off", "none", "false")
+            else float(similarity_threshold)
+        )
+        settings.update(kwargs)
+        return cls(**settings)
+
+
+class ImagePipeline:
+    """Attach an image to every dish, processing several dishes at once.
+
+    Every dish runs through check -> generate -> upload -> verify on its own
+    worker thread. The calls to each image generation provider are limited by a
+    per-provider semaphore, so the pipeline never exceeds the configured
+    concurrency of a provider even if more dishes are in flight.
+    """
+
+    def __init__(
+        self,
+        config: ImagePipelineConfig,
+        image_index: ImageIndex = None,
+        aliases: AliasTable = None,
+        similarity_index: SimilarityIndex = None,
+    ):
+        self.config = config
+        self.aliases = aliases if aliases is not None else AliasTable()
+        if similarity_index is None and config.similarity_threshold is not None:
+            similarity_index = SimilarityIndex()
+        self.similarity_index = similarity_index
+        if image_index is None:
+            image_index = ImageIndex(
+                upload_url=config.image_cloud_upload_url,
+                download_url=config.image_cloud_download_url,
+                token=config.image_cloud_upload_token,
+                ttl=config.image_index_ttl,
+            )
+        self.image_index = image_index
+        concurrency = {**DEFAULT_PROVIDER_CONCURRENCY, **config.provider_concurrency}
+        self._provider_limits = {
+            provider: threading.BoundedSemaphore(max(1, n))
+            for provider, n in concurrency.items()
+        }
+
+    def run(
+        self, list_of_dishes: list, priority: int = PRIORITY_TODAY, on_processed=None
+    ):
+        """Process all dishes and attach the results to the dish dictionaries.
+
+        The keys ``image_url``, ``thumbnail_url`` and ``generation_info_tag`` are
+        set on each dish in place, so the order of ``list_of_dishes`` is kept.
+        Dishes with the same fingerprint are processed only once. If processing a
+        dish fails, the first error (in menu order) is raised once all dishes are
+        done. ``priority`` is the priority of the image generation requests (see
+        ``lunchbot.generation_scheduler``). ``on_processed`` is called (from the
+        worker threads) with the list of dishes of a fingerprint as soon as they
+        were processed successfully.
+        """
+        if not list_of_dishes:
+            return list_of_dishes
+
+        # group the dishes by fingerprint, only the first one of each group is
+        # processed and the others share its image
+        groups = {}
+        for dish in list_of_dishes:
+            if not dish.get("fingerprint"):
+                dish["fingerprint"] = dish_fingerprint(dish["name"])
+            groups.setdefault(dish["fingerprint"], []).append(dish)
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.config.max_workers, len(groups))),
+            thread_name_prefix="image",
+        ) as executor:
+            futures = [
+                executor.submit(self._process_group, dishes, priority, on_processed)
+                for dishes in groups.values()
+            ]
+        if self.similarity_index is not None:
+            # the new dishes are written once per run
+            self.similarity_index.save()
+        get_latency_tracker().save()
+        for future in futures:
+            future.result()
+        return list_of_dishes
+
+    def _process_group(self, dishes: list, priority: int, on_processed=None):
+        """Process the first of the dishes and share its results with the others."""
+        self.process_dish(dishes[0], [d.get("hash") for d in dishes], priority)
+        for dish in dishes[1:]:
+            for key in RESULT_KEYS:
+                if key in dishes[0]:
+                    dish[key] = dishes[0][key]
+        if on_processed is not None:
+            on_processed(dishes)
+
+    def process_dish(
+        self, dish: dict, legacy_keys: list = None, priority: int = PRIORITY_TODAY
+    ):
+        """Run a single dish through the pipeline.
+
+        ``legacy_keys`` are the raw-name hashes of all dishes sharing the
+        fingerprint, by default only the hash of ``dish``.
+        """
+        dish_name = dish["name"]
+        meal_hash, image_exists = self._resolve_image_key(dish, legacy_keys)
+        dish["image_key"] = meal_hash
+        # a dish processed again (e.g. a failed one of the prefetch) must not
+        # keep the thumbnail of its last image
+        dish.pop("thumbnail_url", None)
+
+        logger.debug(f"Meal: {dish_name}")
+        logger.debug(f"Hash: {meal_hash}")
+
+        image_name = f"{meal_hash}.png"
+        dish["image_url"] = f"{self.config.image_cloud_download_url}{image_name}"
+
+        # check if image already exists - if it does, skip image generation
+        # and just use the existing image
+        if image_exists:
+            logger.info(
+                f"Image with hash {color_text(meal_hash, 'yellow')} for "
+                f"'{color_text(dish_name, 'yellow')}' already exists. "
+                "Skipping image generation."
+            )
+            dish["generation_info_tag"] = "Already generated"
+            incr("images", result="existing")
+            self._add_to_similarity_index(dish, meal_hash)
+            self._attach_thumbnail(dish, meal_hash)
+            return dish
+
+        # reuse the image of a dish with a similar name if there is one
+        if self._reuse_similar_image(dish):
+            incr("images", result="reused")
+            return dish
+
+        logger.info(f"Generating image with hash {meal_hash} for '{dish_name}'")
+        image = self._generate(dish_name, priority)
+        if image is None:
+            # show a placeholder instead of failing the whole run
+            dish["image_url"] = TECHNICAL_DIFFICULTIES_IMAGE_URL
+            dish["thumbnail_url"] = TECHNICAL_DIFFICULTIES_IMAGE_URL
+            dish["generation_info_tag"] = "Image generation failed"
+            incr("images", result="failed")
+            return dish
+        dish["generation_info_tag"] = f"Generated with {image.provider} API"
+
+        # --- upload the image to the cloud ---
+        # the image will be available for unlimited time / until we delete it in the
+        # cloud, so we don't have to worry about the image link expiring after some time)
+        # (the name keeps the .png extension of the existing images, the actual
+        # format is sent as content type)
+        result = upload_image(
+            image.data,
+            url=f"{self.config.image_cloud_upload_url}{image_name}",
+            token=self.config.image_cloud_upload_token,
+            content_type=image.content_type,
+        )
+        # the PUT response tells us whether the upload worked
+        if not result.ok:
+            raise ValueError(
+                f"Image upload failed for {dish['image_url']} "
+                f"(status code {result.status_code})"
+            )
+        self.image_index.add(image_name)
+        incr("images", result="generated")
+        self.aliases.add(dish["fingerprint"], meal_hash)
+        self._add_to_similarity_index(dish, meal_hash)
+        logger.info(f"Image uploaded successfully to {dish['image_url']}")
+        self._attach_thumbnail(dish, meal_hash, image.data)
+        return dish
+
+    def _resolve_image_key(self, dish: dict, legacy_keys: list = None):
+        """Get the key of the image of a dish.
+
+        Dishes are identified by the fingerprint of their canonical name, so
+        trivial variations of a name share one image. Images stored under another
+        key (like the hash of the raw name, used before fingerprints) are found
+        through the alias table. New images are stored under the fingerprint.
+
+        Returns
+        -------
+        tuple
+            The image key and whether the image already exists.
+        """
+        if not dish.get("fingerprint"):
+            dish["fingerprint"] = dish_fingerprint(dish["name"])
+        fingerprint = dish["fingerprint"]
+
+        # candidates in order of preference: known alias, the fingerprint itself
+        # and the legacy hashes of the raw names
+        if legacy_keys is None:
+            legacy_keys = [dish.get("hash")]
+        candidates = [self.aliases.get(fingerprint), fingerprint, *legacy_keys]
+        for key in dict.fromkeys(k for k in candidates if k):
+            if self.image_index.exists(f"{key}.png"):
+                self.aliases.add(fingerprint, key)
+                return key, True
+        return fingerprint, False
+
+    def _reuse_similar_image(self, dish: dict):
+        """Point the dish to the image of the most similar known dish.
+
+        Returns whether an image above the similarity threshold was found.
+        """
+        if self.similarity_index is None:
+            return False
+        match = self.similarity_index.best_match(
+            dish["name"], self.config.similarity_threshold, info=dish.get("info")
+        )
+        if match is None:
+            return False
+        similarity, similar_name, key = match
+        if not self.image_index.exists(f"{key}.png"):
+            logger.warning(f"Image of similar dish '{similar_name}' doesn't exist")
+            return False
+
+        logger.info(
+            f"Reusing image {color_text(key, 'yellow')} of '{similar_name}' for "
+            f"'{color_text(dish['name'], 'yellow')}' (similarity {similarity:.2f})"
+        )
+        dish["image_key"] = key
+        dish["image_url"] = f"{self.config.image_cloud_download_url}{key}.png"
+        dish["generation_info_tag"] = (
+            f"Reused image of '{similar_name}' (similarity {similarity:.2f})"
+        )
+        self._attach_thumbnail(dish, key)
+        return True
+
+    def _add_to_similarity_index(self, dish: dict, meal_hash: str):
+        if self.similarity_index is not None:
+            self.similarity_index.add(dish["name"], meal_hash, dish.get("info"))
+
+    def _attach_thumbnail(self, dish: dict, meal_hash: str, image_data=None):
+        """Make sure the thumbnail of the image exists and set ``thumbnail_url``.
+
+        The thumbnail is created from ``image_data`` or, for images that were
+        generated before, from the downloaded original. If anything goes wrong,
+        the original image is used in the table.
+        """
+        dish["thumbnail_url"] = dish["image_url"]
+        if not self.config.thumbnails:
+            return
+        name = thumbnail_name(
+            meal_hash, self.config.thumbnail_width, self.config.thumbnail_format
+        )
+        thumbnail_url = f"{self.config.image_cloud_download_url}{name}"
+        try:
+            if not self.image_index.exists(name):
+                if image_data is None:
+                    r = get_circuit_breaker("image_cloud").call(
+                        lambda: get_session().get(dish["image_url"], timeout=60),
+                        failed=lambda r: r.status_code >= 500,
+                    )
+                    r.raise_for_status()
+                    image_data = r.content
+                result = upload_image(
+                    make_thumbnail(
+                        image_data,
+                        width=self.config.thumbnail_width,
+                        image_format=self.config.thumbnail_format,
+                    ),
+                    url=f"{self.config.image_cloud_upload_url}{name}",
+                    token=self.config.image_cloud_upload_token,
+                    content_type=f"image/{self.config.thumbnail_format}",
+                )
+                if not result.ok:
+                    raise ValueError(f"status code {result.status_code}")
+                self.image_index.add(name)
+                incr("thumbnails", result="created")
+        except Exception as e:
+            logger.warning(f"Could not create thumbnail {name}: {e}")
+            incr("thumbnails", result="failed")
+            return
+        dish["thumbnail_url"] = thumbnail_url
+
+    def _generate(self, dish_name: str, priority: int = PRIORITY_TODAY):
+        """Generate the image, returns None if all providers failed.
+
+        The requests are queued by the generation scheduler (rate limits, daily
+        budget) before they take a slot of the provider. With Hugging Face as
+        provider, OpenAI is the fallback: either once Hugging Face failed (right
+        away while its circuit breaker is open) or, with hedging, also when it
+        takes longer than usual.
+        """
+        if self.config.api_to_use == "huggingface":
+            if self.config.hedging:
+                return self._generate_hedged(dish_name, priority)
+            try:
+                # try generating image using huggingface
+                return self._generate_huggingface(dish_name, priority)
+            except Exception as e:
+                # if an error occurs, use the OpenAI API to generate the image
+                # (for some reason Huggingface API sometimes fails to generate images)
+                logger.error(f"An error occurred while generating image: {e}")
+                logger.info("Trying to generate image with OpenAI API")
+        elif self.config.api_to_use != "openai":
+            raise ValueError("API_TO_USE must be either 'huggingface' or 'openai'")
+
+        # generate the image using the OpenAI API
+        try:
+            return self._generate_openai(dish_name, priority)
+        except Exception as e:
+            logger.error(f"Exception raised during image generation: {e}")
+            return None
+
+    def _generate_hedged(self, dish_name: str, priority: int):
+        """Race Hugging Face against OpenAI, started after the hedge delay."""
+        delay = self.config.hedge_delay
+        if delay is None:
+            delay = get_latency_tracker().hedge_delay(
+                "huggingface", self.config.hedge_quantile
+            )
+        try:
+            return hedged(
+                lambda: self._generate_huggingface(dish_name, priority),
+                lambda: self._generate_openai(dish_name, priority),
+                delay=delay,
+                name=f"the image of '{dish_name}'",
+            )
+        except Exception as e:
+            logger.error(f"Exception raised during image generation: {e}")
+            return None
+
+    def _generate_huggingface(self, dish_name: str, priority: int):
+        return self._schedule(
+            "huggingface",
+            "default",
+            lambda: generate_image_huggingface(
+                prompt=dish_name,
+                api_url=self.config.huggingface_api_url,
+                api_token=self.config.huggingface_api_token,
+            ),
+            priority,
+        )
+
+    def _generate_openai(self, dish_name: str, priority: int):
+        return self._schedule(
+            "openai",
+            OPENAI_IMAGE_MODEL,
+            lambda: generate_image_openai(prompt=dish_name, model=OPENAI_IMAGE_MODEL),
+            priority,
+        )
+
+    def _schedule(self, provider: str, model: str, generate, priority: int):
+        """Queue ``generate()`` with the generation scheduler behind its breaker.
+
+        If the circuit breaker of the provider is open, ``CircuitOpenError`` is
+        raised right away, so the fallback doesn't wait for a slot or a timeout.
+        """
+        breaker = get_circuit_breaker(CIRCUIT_BREAKERS[provider])
+        breaker.check()
+        return get_generation_scheduler().call(
+            provider,
+            model,
+            # a 429 pauses the provider in the scheduler, it doesn't count as a
+            # failure of the breaker
+            lambda: breaker.call(
+                lambda: self._call_provider(provider, generate),
+                ignore=is_rate_limit_error,
+            ),
+            priority=priority,
+        )
+
+    def _call_provider(self, provider: str, generate):
+        """Call the provider within its concurrency limit and track its latency."""
+        outcome = "error"
+        with self._provider_limits[provider]:
+            start = time.monotonic()
+            try:
+                image = generate()
+                outcome = "ok"
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    outcome = "rate_limited"
+                raise
+            finally:
+                get_latency_tracker().observe(
+                    provider, time.monotonic() - start, outcome
+                )
+        return image
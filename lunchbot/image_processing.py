@@ -0,0 +1,69 @@
+"""Post-processing of generated images (thumbnails for the posted table)."""
+
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# width of the images in the posted table
+THUMBNAIL_WIDTH = 200
+
+# file extension and PIL format name of the supported thumbnail formats
+THUMBNAIL_FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+}
+
+
+def thumbnail_name(meal_hash: str, width: int = THUMBNAIL_WIDTH, image_format="webp"):
+    """Get the file name of the thumbnail of an image."""
+    return f"{meal_hash}_w{width}.{image_format}"
+
+
+def make_thumbnail(
+    data: bytes,
+    width: int = THUMBNAIL_WIDTH,
+    image_format: str = "webp",
+    quality: int = 80,
+):
+    """Create a small, compressed version of an image.
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded original image.
+    width : int, optional
+        Width of the thumbnail in pixels, by default ``THUMBNAIL_WIDTH``. The
+        aspect ratio is kept, images are never scaled up.
+    image_format : str, optional
+        Format of the thumbnail, "webp" or "jpeg", by default "webp".
+    quality : int, optional
+        Compression quality (0-100), by default 80.
+
+    Returns
+    -------
+    bytes
+        The encoded thumbnail.
+    """
+    from PIL import Image
+
+    if image_format not in THUMBNAIL_FORMATS:
+        raise ValueError(f"Unsupported thumbnail format: {image_format}")
+
+    image = Image.open(io.BytesIO(data))
+    # let the JPEG decoder downscale while decoding (no-op for other formats)
+    image.draft("RGB", (width, width))
+    image = image.convert("RGB")
+    image.thumbnail((width, image.height * width // image.width or 1), Image.LANCZOS)
+
+    out = io.BytesIO()
+    save_kwargs = {"quality": quality}
+    if image_format == "jpeg":
+        save_kwargs.update(optimize=True, progressive=True)
+    else:
+        save_kwargs.update(method=6)
+    image.save(out, THUMBNAIL_FORMATS[image_format], **save_kwargs)
+    logger.info(
+        f"Created {image_format} thumbnail ({len(data)} -> {out.tell()} bytes)"
+    )
+    return out.getvalue()
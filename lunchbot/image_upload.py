@@ -0,0 +1,105 @@
+"""Upload images to the image cloud with HTTP PUT."""
+
+import io
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from lunchbot.circuit_breaker import get_circuit_breaker
+from lunchbot.http_session import get_session, split_credentials
+from lunchbot.metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UploadResult:
+    """Result of an upload.
+
+    Attributes
+    ----------
+    url : str
+        URL the file was uploaded to.
+    status_code : int
+        HTTP status code of the PUT request.
+    size : int
+        Number of uploaded bytes.
+    duration : float
+        Duration of the upload in seconds.
+    """
+
+    url: str
+    status_code: int
+    size: int
+    duration: float
+
+    @property
+    def ok(self):
+        """Whether the server accepted the upload (WebDAV answers 201 or 204)."""
+        return self.status_code in (200, 201, 204)
+
+
+def upload_image(
+    image,
+    url: str,
+    token: str,
+    content_type: str = "image/png",
+    timeout: float = 60,
+):
+    """Upload an image with a streamed HTTP PUT over the shared session.
+
+    Parameters
+    ----------
+    image : str, bytes or file object
+        Path of the image file, the image data or a binary file object.
+    url : str
+        URL to upload the image to.
+    token : str
+        Credentials for the upload (``user:password``).
+    content_type : str, optional
+        Content type of the image, by default "image/png".
+    timeout : float, optional
+        Timeout in seconds for the request, by default 60.
+
+    Returns
+    -------
+    UploadResult
+        Status code, size and duration of the upload. ``CircuitOpenError`` is
+        raised if the image cloud kept failing recently.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            return upload_image(f, url, token, content_type, timeout)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+
+    # file objects are streamed by requests (and rewound by urllib3 on retries)
+    position = image.tell()
+    size = image.seek(0, io.SEEK_END) - position
+    image.seek(position)
+
+    start = time.monotonic()
+    with span("cloud.upload"):
+        r = get_circuit_breaker("image_cloud").call(
+            lambda: get_session().put(
+                url,
+                data=image,
+                auth=split_credentials(token),
+                headers={"Content-Type": content_type, "Content-Length": str(size)},
+                timeout=timeout,
+            ),
+            failed=lambda r: r.status_code >= 500,
+        )
+    result = UploadResult(
+        url=url,
+        status_code=r.status_code,
+        size=size,
+        duration=time.monotonic() - start,
+    )
+    logger.info(
+        f"Uploaded {result.size} bytes to {url} in {result.duration:.2f}s "
+        f"(status code {result.status_code})"
+    )
+    return result
+
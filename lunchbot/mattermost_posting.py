@@ -1,7 +1,9 @@
 """Send a message to a Mattermost channel via a webhook."""
-import requests
+from lunchbot.http_session import get_session
+from lunchbot.metrics import span
 
 
+@span("webhook.post")
 def send_message_via_webhook(
     webhook_url: str,
     message: str,
@@ -21,7 +23,7 @@ def send_message_via_webhook(
     timeout : int, optional
         The timeout in seconds for the request, by default 20.
     """
-    r = requests.post(
+    r = get_session().post(
         webhook_url,
         json={
             "username": username,
@@ -29,5 +31,5 @@ def send_message_via_webhook(
         },
         timeout=timeout,
     )
-    assert r.status_code == 200
+    assert r.status_code == 200, f"Webhook answered with status code {r.status_code}"
     return r
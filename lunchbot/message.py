@@ -0,0 +1,289 @@
+"""Render the Mattermost message with the menu table.
+
+The table has one column per dish. Every cell is formatted exactly once from a typed
+``Dish`` record and the size of each column is known up front, so tables that are
+too long for a single post can be split without rendering them again.
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date as date_type
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+# maximum number of characters of a post (Mattermost's default MaxPostSize)
+MAX_MESSAGE_LENGTH = 16383
+
+# emoji shown next to the link to the menu of a canteen
+CANTEEN_EMOJIS = {
+    "DESY Canteen": ":alsterfood:",
+    "Cafe CFEL": ":cfel:",
+}
+
+# rows of the table: name, separator, price, info, canteen, image
+TABLE_ROWS = 6
+# the leading newline plus "|" and "\n" of every row
+TABLE_OVERHEAD = 1 + 2 * TABLE_ROWS
+
+
+def get_message_suffix(date: date_type = None):
+    """Get the message suffix for a date from the environment.
+
+    The suffix is set per weekday with ``MESSAGE_SUFFIX_<DAY>`` (e.g.
+    ``MESSAGE_SUFFIX_MON``) and can be overridden for even and odd calendar weeks
+    with ``MESSAGE_SUFFIX_<DAY>_EVEN`` and ``MESSAGE_SUFFIX_<DAY>_ODD``.
+
+    Parameters
+    ----------
+    date : datetime.date, optional
+        The date of the message, by default today.
+
+    Returns
+    -------
+    str
+        The suffix ("" if none is set).
+    """
+    if date is None:
+        date = date_type.today()
+    day = WEEKDAYS[date.weekday()]
+    parity = "EVEN" if date.isocalendar()[1] % 2 == 0 else "ODD"
+
+    suffix = os.getenv(f"MESSAGE_SUFFIX_{day}_{parity}")
+    if suffix is None:
+        suffix = os.getenv(f"MESSAGE_SUFFIX_{day}")
+    return suffix or ""
+
+
+@dataclass
+class Dish:
+    """A dish with the results of the image pipeline.
+
+    Attributes
+    ----------
+    name : str
+        Name of the dish.
+    price : str, optional
+        Price of the dish.
+    info : str, optional
+        Additional info, e.g. "vegan".
+    canteen : str, optional
+        Name of the canteen.
+    image_url : str, optional
+        URL of the full-size image.
+    thumbnail_url : str, optional
+        URL of the thumbnail shown in the table, by default the full image.
+    generation_info_tag : str, optional
+        How the image was created.
+    hash : str, optional
+        Hash of the dish name.
+    """
+
+    name: str
+    price: str = "N/A"
+    info: str = "N/A"
+    canteen: str = "N/A"
+    image_url: str = None
+    thumbnail_url: str = None
+    generation_info_tag: str = ""
+    hash: str = None
+
+    @classmethod
+    def from_dict(cls, dish: dict):
+        """Create the record from a dish dictionary (unknown keys are ignored).
+
+        Like ``fill_missing_fields``, only missing (None) values become "N/A",
+        e.g. the empty info of a CFEL dish that is not vegetarian is kept.
+        """
+
+        def get(key):
+            value = dish.get(key)
+            return "N/A" if value is None else value
+
+        return cls(
+            name=dish["name"],
+            price=get("price"),
+            info=get("info"),
+            canteen=get("canteen"),
+            image_url=dish.get("image_url"),
+            thumbnail_url=dish.get("thumbnail_url"),
+            generation_info_tag=dish.get("generation_info_tag") or "",
+            hash=dish.get("hash"),
+        )
+
+
+def fill_missing_fields(list_of_dishes: list):
+    """Set the price/info/canteen of the dishes to "N/A" where they are None."""
+    for dish in list_of_dishes:
+        for key in ("price", "info", "canteen"):
+            if dish.get(key) is None:
+                dish[key] = "N/A"
+    return list_of_dishes
+
+
+def _escape(text: str):
+    text = str(text)
+    # a "|" would end the cell, a newline the row
+    if "|" in text or "\n" in text:
+        text = text.replace("|", "-").replace("\n", " ")
+    return text
+
+
+def _canteen_cell(canteen: str, canteen_urls: dict):
+    url = canteen_urls.get(canteen)
+    if url is None:
+        return _escape(canteen)
+    # link to the official menu (where the information was scraped from)
+    return f"**[{canteen}]({url})** {CANTEEN_EMOJIS.get(canteen, '')}".rstrip()
+
+
+def _image_cell(dish: Dish):
+    if dish.image_url is None:
+        return "N/A"
+    # the small thumbnail is shown, clicking it opens the full image
+    thumbnail_url = dish.thumbnail_url or dish.image_url
+    return (
+        f"[![preview {_escape(dish.generation_info_tag)}]"
+        f"({thumbnail_url} =200)]({dish.image_url})"
+    )
+
+
+def _columns(dishes: list, canteen_urls: dict):
+    # the cells of a canteen are the same for all of its dishes
+    canteen_cells = {}
+    columns = []
+    for dish in dishes:
+        canteen_cell = canteen_cells.get(dish.canteen)
+        if canteen_cell is None:
+            canteen_cell = canteen_cells[dish.canteen] = _canteen_cell(
+                dish.canteen, canteen_urls
+            )
+        columns.append(
+            (
+                _escape(dish.name),
+                "---",
+                _escape(dish.price),
+                _escape(dish.info),
+                canteen_cell,
+                _image_cell(dish),
+            )
+        )
+    return columns
+
+
+def _column_length(column: tuple):
+    # every cell is written as " <cell> |"
+    return sum(len(cell) + 3 for cell in column)
+
+
+def _join_columns(columns: list):
+    return "\n" + "".join(
+        "| " + " | ".join(row) + " |\n" for row in zip(*columns)
+    )
+
+
+def _to_dishes(list_of_dishes: list):
+    return [d if isinstance(d, Dish) else Dish.from_dict(d) for d in list_of_dishes]
+
+
+def render_table(list_of_dishes: list, canteen_urls: dict = None):
+    """Render the table with all dishes.
+
+    Parameters
+    ----------
+    list_of_dishes : list
+        The dishes (``Dish`` records or dictionaries).
+    canteen_urls : dict, optional
+        URLs of the menus per canteen name, the canteen cells link to them.
+
+    Returns
+    -------
+    str
+        The table (markdown).
+    """
+    return _join_columns(_columns(_to_dishes(list_of_dishes), canteen_urls or {}))
+
+
+def split_table(
+    list_of_dishes: list,
+    max_length: int = MAX_MESSAGE_LENGTH,
+    canteen_urls: dict = None,
+):
+    """Render the table, split into several tables if it is too long.
+
+    If the table of all dishes is longer than ``max_length`` characters, there is
+    one table per canteen (in the order the canteens first appear). Canteens whose
+    table is still too long are split into tables with as many dishes as fit.
+
+    Parameters
+    ----------
+    list_of_dishes : list
+        The dishes (``Dish`` records or dictionaries).
+    max_length : int, optional
+        Maximum number of characters of a table, by default
+        ``MAX_MESSAGE_LENGTH``.
+    canteen_urls : dict, optional
+        URLs of the menus per canteen name, the canteen cells link to them.
+
+    Returns
+    -------
+    list
+        The tables (markdown).
+    """
+    dishes = _to_dishes(list_of_dishes)
+    columns = _columns(dishes, canteen_urls or {})
+    lengths = [_column_length(c) for c in columns]
+    if TABLE_OVERHEAD + sum(lengths) <= max_length:
+        return [_join_columns(columns)]
+
+    by_canteen = {}
+    for dish, column, length in zip(dishes, columns, lengths):
+        by_canteen.setdefault(dish.canteen, []).append((column, length))
+
+    tables = []
+    for canteen, group in by_canteen.items():
+        part, part_length = [], TABLE_OVERHEAD
+        for column, length in group:
+            if part and part_length + length > max_length:
+                tables.append(_join_columns(part))
+                part, part_length = [], TABLE_OVERHEAD
+            if TABLE_OVERHEAD + length > max_length:
+                logger.warning(
+                    f"The column of '{column[0]}' alone exceeds {max_length} "
+                    "characters"
+                )
+            part.append(column)
+            part_length += length
+        tables.append(_join_columns(part))
+    logger.info(
+        f"Split the table of {len(dishes)} dishes into {len(tables)} tables "
+        f"(limit: {max_length} characters)"
+    )
+    return tables
+
+
+def compose_message(table: str, prefix: str = "", suffix: str = ""):
+    """Add the prefix and suffix to a rendered table."""
+    return prefix + "\n" + table + "\n\n" + "\n" + suffix
+
+
+def compose_messages(tables: list, prefix: str = "", suffix: str = ""):
+    """Put the messages of (split) tables together.
+
+    The prefix is added to the first and the suffix to the last message, the
+    messages in between only contain their table.
+    """
+    if len(tables) == 1:
+        return [compose_message(tables[0], prefix, suffix)]
+    return (
+        [prefix + "\n" + tables[0]]
+        + tables[1:-1]
+        + [tables[-1] + "\n\n" + "\n" + suffix]
+    )
+
+
+def message_overhead(prefix: str = "", suffix: str = ""):
+    """Number of characters ``compose_message`` adds to a table."""
+    return len(compose_message("", prefix, suffix))
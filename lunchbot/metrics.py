@@ -0,0 +1,313 @@
+"""Timing spans and counters of a lunchbot run.
+
+Every stage of a run (scraping, image generation, posting, ...) and every call
+to an external service is measured as a span; cache hits, generated images etc.
+are counted. The measurements of a run can be written as a JSON summary and as a
+Prometheus textfile (for the textfile collector of the node exporter).
+
+Usage::
+
+    from lunchbot.metrics import incr, span
+
+    with span("scrape"):
+        ...
+    incr("images", result="generated")
+
+Spans and counters go to the metrics of the current run (see ``start_run``);
+recording them is thread-safe and cheap (a clock reading and a list append).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# prefix of the exported Prometheus metrics
+METRIC_PREFIX = "lunchbot"
+
+# stages of a run, in order (used for the short timing summary)
+STAGES = ("scrape", "images", "render", "post")
+
+
+class RunMetrics:
+    """Spans and counters of one run.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the run (e.g. "run" or "prefetch"), by default "run".
+    """
+
+    def __init__(self, name: str = "run"):
+        self.name = name
+        self.started_at = time.time()
+        self.finished_at = None
+        self.error = None
+        self.spans = []
+        self.counters = Counter()
+        self._start = time.perf_counter()
+        self._duration = None
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self):
+        """Time in seconds since the start (until ``finish`` was called)."""
+        if self._duration is not None:
+            return self._duration
+        return time.perf_counter() - self._start
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @contextmanager
+    def span(self, name: str):
+        """Measure the time of the block, exceptions mark the span as failed."""
+        start = time.perf_counter()
+        offset = start - self._start
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.spans.append((name, offset, duration, ok))
+
+    def observe(self, name: str, duration: float, ok: bool = True):
+        """Record a span that was measured elsewhere (ending now)."""
+        offset = time.perf_counter() - self._start - duration
+        with self._lock:
+            self.spans.append((name, offset, duration, ok))
+
+    def incr(self, name: str, value: float = 1, **labels):
+        """Increase the counter ``name`` (with the given labels) by ``value``."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def finish(self, error: BaseException = None):
+        """Mark the end of the run (failed if ``error`` is given)."""
+        self._duration = time.perf_counter() - self._start
+        self.finished_at = time.time()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def span_stats(self):
+        """Aggregate the spans by name.
+
+        Returns
+        -------
+        dict
+            Dictionary mapping the span names (in order of their first start) to
+            ``{"count", "errors", "total", "max"}`` (times in seconds).
+        """
+        stats = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s[1])
+        for name, _, duration, ok in spans:
+            entry = stats.setdefault(
+                name, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            )
+            entry["count"] += 1
+            entry["errors"] += not ok
+            entry["total"] += duration
+            entry["max"] = max(entry["max"], duration)
+        return stats
+
+    def to_dict(self):
+        """Summary of the run (JSON-serialisable)."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            spans = sorted(self.spans, key=lambda s: s[1])
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": self.duration,
+            "ok": self.ok,
+            "error": self.error,
+            "stages": self.span_stats(),
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "spans": [
+                {"name": name, "start": start, "duration": duration, "ok": ok}
+                for name, start, duration, ok in spans
+            ],
+        }
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        run = _escape_label(self.name)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(
+                    [f'run="{run}"']
+                    + [f'{k}="{_escape_label(str(v))}"' for k, v in labels]
+                )
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_str}}} {value!r}")
+
+        metric(
+            "run_timestamp_seconds",
+            "gauge",
+            "Start of the last run (unix time).",
+            [((), self.started_at)],
+        )
+        metric(
+            "run_duration_seconds",
+            "gauge",
+            "Duration of the last run.",
+            [((), self.duration)],
+        )
+        metric(
+            "run_success",
+            "gauge",
+            "Whether the last run succeeded.",
+            [((), int(self.ok))],
+        )
+
+        stats = self.span_stats()
+        for field, help_text in [
+            ("total", "Total time spent in the spans of the last run."),
+            ("max", "Longest span of the last run."),
+        ]:
+            metric(
+                f"span_seconds_{field}",
+                "gauge",
+                help_text,
+                [((("span", name),), s[field]) for name, s in stats.items()],
+            )
+        for field, help_text in [
+            ("count", "Number of spans in the last run."),
+            ("errors", "Number of failed spans in the last run."),
+        ]:
+            metric(
+                f"span_{field}",
+                "gauge",
+                help_text,
+                [((("span", name),), s[field]) for name, s in stats.items()],
+            )
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+        names = list(dict.fromkeys(name for (name, _), _ in counters))
+        for counter_name in names:
+            metric(
+                f"{counter_name}_count",
+                "gauge",
+                f"Number of {counter_name.replace('_', ' ')} in the last run.",
+                [
+                    (labels, value)
+                    for (name, labels), value in counters
+                    if name == counter_name
+                ],
+            )
+        return "\n".join(lines) + "\n"
+
+    def timing_summary(self):
+        """A short summary of the stage timings, e.g. for alerts.
+
+        Example: "Timings: scrape 0.98s, images 1.02s (failed), render -,
+        post -; total 2.05s; slowest call openai.images 0.91s"
+        """
+        stats = self.span_stats()
+        parts = []
+        for stage in STAGES:
+            s = stats.get(stage)
+            if s is None:
+                parts.append(f"{stage} -")
+                continue
+            parts.append(
+                f"{stage} {s['total']:.2f}s" + (" (failed)" if s["errors"] else "")
+            )
+        summary = f"Timings: {', '.join(parts)}; total {self.duration:.2f}s"
+
+        # the slowest external call is often the interesting part
+        calls = {n: s for n, s in stats.items() if n not in STAGES}
+        if calls:
+            name, s = max(calls.items(), key=lambda item: item[1]["max"])
+            summary += f"; slowest call {name} {s['max']:.2f}s"
+        failed = [f"{n} {s['errors']}x" for n, s in calls.items() if s["errors"]]
+        if failed:
+            summary += f"; failed calls: {', '.join(failed)}"
+        return summary
+
+
+def _escape_label(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _atomic_write(path: str, content: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+_current = RunMetrics()
+
+
+def start_run(name: str = "run"):
+    """Start collecting the metrics of a new run and return them."""
+    global _current
+    _current = RunMetrics(name)
+    return _current
+
+
+def get_metrics():
+    """Get the metrics of the current run."""
+    return _current
+
+
+@contextmanager
+def span(name: str):
+    """Measure a block (or, as a decorator, a function) in the current run."""
+    # the run is looked up on entering, so decorated functions always record
+    # into the current run
+    with _current.span(name):
+        yield
+
+
+def observe(name: str, duration: float, ok: bool = True):
+    """Record a span of the current run that was measured elsewhere."""
+    _current.observe(name, duration, ok)
+
+
+def incr(name: str, value: float = 1, **labels):
+    """Increase a counter of the current run."""
+    _current.incr(name, value, **labels)
+
+
+def export_metrics(metrics: RunMetrics, json_file: str = None, textfile: str = None):
+    """Write the metrics of a run as JSON summary and/or Prometheus textfile.
+
+    Errors are only logged, the metrics must never break a run.
+    """
+    for path, render in [
+        (json_file, lambda: json.dumps(metrics.to_dict(), indent=2)),
+        (textfile, metrics.to_prometheus),
+    ]:
+        if not path:
+            continue
+        try:
+            _atomic_write(path, render())
+        except Exception as e:
+            logger.error(f"Could not write the metrics to {path}: {e}")
+        else:
+            logger.info(f"Metrics written to {path}")
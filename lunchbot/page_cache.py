@@ -0,0 +1,243 @@
+"""On-disk cache for menu pages using conditional GET requests."""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+
+from lunchbot.http_session import get_session
+from lunchbot.metrics import incr, span
+from lunchbot.utils import generate_hash, get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+@dataclass
+class CachedPage:
+    """A fetched page.
+
+    Attributes
+    ----------
+    url : str
+        URL of the page.
+    text : str
+        The page source.
+    status : str
+        Where the page came from: "fetched" (downloaded), "not_modified"
+        (server answered 304), "cached" (within the TTL, no request) or
+        "stale" (request failed, old copy).
+    body_hash : str
+        Hash of the page source.
+    """
+
+    url: str
+    text: str
+    status: str
+    body_hash: str
+
+
+class PageCache:
+    """Store menu pages on disk together with their ``ETag``/``Last-Modified``.
+
+    Pages are re-validated with conditional requests, so an unchanged page costs a
+    ``304`` answer instead of the full download. Parsed results can be stored
+    alongside a page and are reused as long as the page doesn't change. If the
+    site can't be reached, the last stored copy is used.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory of the cache, by default ``pages`` in the lunchbot cache
+        directory.
+    ttl : float, optional
+        If set, pages younger than ``ttl`` seconds are used without any request.
+    """
+
+    def __init__(self, cache_dir: str = None, ttl: float = None):
+        self.cache_dir = cache_dir or get_cache_dir("pages")
+        self.ttl = ttl
+
+    def fetch(self, url: str, timeout: float = 20, same_day_only: bool = False):
+        """Get a page, from the cache if possible.
+
+        Raises the request error if the page can't be fetched and there is no
+        (usable) cached copy. With ``same_day_only=True``, only copies fetched
+        today are used: for pages that only show the menu of the current day, an
+        old copy would be the menu of another day.
+        """
+        meta = self._load_meta(url)
+        text = self._load_body(url) if meta else None
+        if text is not None and same_day_only and not _is_today(meta["fetched_at"]):
+            logger.info(f"Ignoring the cached page of {url} from another day")
+            text = None
+        if text is None:
+            meta = {}
+
+        if text is not None and self.ttl is not None:
+            if time.time() - meta["fetched_at"] < self.ttl:
+                logger.info(f"Using cached page of {url} (within TTL)")
+                return CachedPage(url, text, "cached", meta["body_hash"])
+
+        headers = {}
+        if text is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            with span("http.menu_page"):
+                r = get_session().get(url, headers=headers, timeout=timeout)
+                if r.status_code != 304:
+                    r.raise_for_status()
+        except requests.RequestException as e:
+            if text is None:
+                raise
+            logger.warning(f"Could not fetch {url} ({e}), using the cached page")
+            return CachedPage(url, text, "stale", meta["body_hash"])
+
+        if r.status_code == 304:
+            logger.info(f"Page {url} not modified, using the cached page")
+            meta["fetched_at"] = time.time()
+            self._save_meta(url, meta)
+            return CachedPage(url, text, "not_modified", meta["body_hash"])
+
+        text = r.text
+        body_hash = generate_hash(text)
+        if body_hash != meta.get("body_hash"):
+            meta["parsed"] = {}
+        meta.update(
+            {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "body_hash": body_hash,
+            }
+        )
+        self._save_body(url, text)
+        self._save_meta(url, meta)
+        return CachedPage(url, text, "fetched", body_hash)
+
+    def get_parsed(self, page: CachedPage, key: str):
+        """Get the parsed result stored for ``page`` under ``key`` (or None)."""
+        parsed = self._load_meta(page.url).get("parsed", {}).get(key)
+        if parsed is None or parsed["body_hash"] != page.body_hash:
+            return None
+        return parsed["value"]
+
+    def set_parsed(self, page: CachedPage, key: str, value):
+        """Store a (JSON-serialisable) parsed result of ``page`` under ``key``."""
+        meta = self._load_meta(page.url)
+        if meta.get("body_hash") != page.body_hash:
+            return
+        meta.setdefault("parsed", {})[key] = {
+            "body_hash": page.body_hash,
+            "value": value,
+        }
+        self._save_meta(url=page.url, meta=meta)
+
+    def _path(self, url: str, extension: str):
+        return os.path.join(self.cache_dir, f"{generate_hash(url)}.{extension}")
+
+    def _load_meta(self, url: str):
+        try:
+            with open(self._path(url, "json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_body(self, url: str):
+        try:
+            with open(self._path(url, "html"), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _save_meta(self, url: str, meta: dict):
+        _atomic_write(self._path(url, "json"), json.dumps(meta, ensure_ascii=False))
+
+    def _save_body(self, url: str, text: str):
+        _atomic_write(self._path(url, "html"), text)
+
+
+def _is_today(timestamp: float):
+    return time.localtime(timestamp)[:3] == time.localtime()[:3]
+
+
+def _atomic_write(path: str, content: str):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def get_page_cache():
+    """Get the shared page cache (None if disabled).
+
+    The cache can be disabled by setting ``PAGE_CACHE=false``. With
+    ``PAGE_CACHE_TTL`` (in seconds), pages are reused without any request.
+    """
+    global _default_cache
+    if os.getenv("PAGE_CACHE", "true").lower() == "false":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            ttl = os.getenv("PAGE_CACHE_TTL")
+            _default_cache = PageCache(ttl=float(ttl) if ttl else None)
+        return _default_cache
+
+
+def fetch_menu_page(
+    url: str,
+    parse,
+    key: str = "menu",
+    timeout: float = 20,
+    same_day_only: bool = False,
+):
+    """Fetch a menu page and parse it, reusing cached results if possible.
+
+    Parameters
+    ----------
+    url : str
+        URL of the page.
+    parse : callable
+        Function that turns the page source into the (JSON-serialisable) result.
+    key : str, optional
+        Name of the parsed result, results of a page are reused if the page and
+        the key are unchanged. By default "menu".
+    timeout : float, optional
+        Timeout in seconds for the request, by default 20.
+    same_day_only : bool, optional
+        Whether only copies of the page fetched today may be used (for pages
+        that show the menu of the current day only), by default False.
+
+    Returns
+    -------
+    object
+        The parsed result.
+    """
+    cache = get_page_cache()
+    if cache is None:
+        with span("http.menu_page"):
+            text = get_session().get(url, timeout=timeout).text
+        return parse(text)
+
+    page = cache.fetch(url, timeout=timeout, same_day_only=same_day_only)
+    incr("menu_pages", status=page.status)
+    result = cache.get_parsed(page, key)
+    if result is not None:
+        logger.info(f"Using cached parse result of {url} ({key})")
+        incr("parse_cache", result="hit")
+        return result
+    incr("parse_cache", result="miss")
+    result = parse(page.text)
+    cache.set_parsed(page, key, result)
+    return result
@@ -0,0 +1,153 @@
+"""Week-ahead prefetch: generate the images and render the tables off-peak.
+
+The Alsterfood page lists the menus of several days. ``prefetch_week`` parses all of
+them with a single request, generates and uploads the missing images and stores the
+processed dishes and the rendered tables of every day. The run at lunchtime then
+only has to load the dishes of the day and post them (after adding the CFEL menu,
+which is only published on the same day). If no dishes were added, it posts the
+stored tables without rendering them again.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import date as date_type
+from datetime import datetime, timedelta
+
+from lunchbot.metrics import span, start_run
+from lunchbot.profiling import profiled
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchStore:
+    """Store the prefetched dishes and tables, one JSON file per day.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory of the store, by default ``prefetch`` in the lunchbot cache
+        directory.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or get_cache_dir("prefetch")
+
+    def _path(self, date: date_type):
+        return os.path.join(self.cache_dir, f"{date.isoformat()}.json")
+
+    def save(self, date: date_type, dishes: list, tables: list, render: dict):
+        """Store the processed dishes and the rendered tables of a day.
+
+        ``render`` are the settings the tables were rendered with (see
+        ``lunchbot.runner.render_settings``), the tables are only posted as they
+        are if the settings didn't change.
+        """
+        entry = {
+            "date": date.isoformat(),
+            "created_at": time.time(),
+            "dishes": dishes,
+            "tables": tables,
+            "render": render,
+        }
+        path = self._path(date)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, date: date_type):
+        """Get the prefetched entry of a day (None if there is none).
+
+        Returns
+        -------
+        dict or None
+            Dictionary with the keys "date", "created_at", "dishes", "tables"
+            and "render".
+        """
+        try:
+            with open(self._path(date), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def prune(self, before: date_type):
+        """Remove the entries of the days before ``before``."""
+        for file_name in os.listdir(self.cache_dir):
+            name, extension = os.path.splitext(file_name)
+            try:
+                if extension == ".json" and date_type.fromisoformat(name) < before:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+            except (ValueError, OSError):
+                continue
+
+
+def prefetch_week(
+    config, days: int = 7, today: date_type = None, store=None, pipeline=None
+):
+    """Prepare the menus of the upcoming days.
+
+    Parameters
+    ----------
+    config : LunchbotConfig
+        Settings of the lunchbot.
+    days : int, optional
+        Number of days (starting today) to prepare, by default 7.
+    today : datetime.date, optional
+        The first day to prepare, by default today.
+    store : PrefetchStore, optional
+        Where the results are stored, by default a ``PrefetchStore`` in the
+        lunchbot cache directory.
+    pipeline : ImagePipeline, optional
+        Image pipeline to use (e.g. one with warm indexes), by default a new one.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping the prepared dates to the rendered tables.
+    """
+    from lunchbot.alsterfood_scraping import fetch_week_lunch_menus
+    from lunchbot.generation_scheduler import PRIORITY_PREFETCH
+    from lunchbot.image_pipeline import ImagePipeline
+    from lunchbot.message import fill_missing_fields, split_table
+    from lunchbot.runner import render_settings
+
+    today = today or date_type.today()
+    store = store or PrefetchStore()
+    # timings for the alerts of a failed prefetch (they are not exported, so the
+    # metrics of the last post are kept)
+    start_run("prefetch")
+
+    menus = {}
+    with span("scrape"), profiled("scrape", label="prefetch-scrape"):
+        week = fetch_week_lunch_menus(config.alsterfood_website_url)
+    for date_str, dishes in week.items():
+        date = datetime.strptime(date_str, "%d.%m.%Y").date()
+        if today <= date < today + timedelta(days=days) and dishes:
+            menus[date] = dishes
+    if not menus:
+        logger.warning(f"No menus found for the {days} days starting {today}")
+        return {}
+    logger.info(f"Prefetching the menus of {', '.join(map(str, sorted(menus)))}")
+
+    # a single pipeline run, so dishes that are on the menu several times are
+    # only processed once
+    pipeline = pipeline or ImagePipeline(config.image_pipeline_config())
+    with span("images"), profiled("images", label="prefetch-images"):
+        # prefetch requests may only use their share of the daily budget
+        pipeline.run(
+            [dish for dishes in menus.values() for dish in dishes],
+            priority=PRIORITY_PREFETCH,
+        )
+
+    tables = {}
+    for date, dishes in sorted(menus.items()):
+        fill_missing_fields(dishes)
+        render = render_settings(config, date)
+        tables[date] = split_table(dishes, **render)
+        store.save(date, dishes, tables[date], render)
+        logger.info(f"Stored the prefetched menu of {date}")
+    store.prune(today)
+    return tables
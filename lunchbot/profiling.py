@@ -0,0 +1,285 @@
+"""Opt-in profiling of a run with ``cProfile`` and ``tracemalloc``.
+
+Profiling is enabled for the whole run or for single stages with the environment
+variable ``LUNCHBOT_PROFILE`` (or the ``--profile`` option of the scripts)::
+
+    LUNCHBOT_PROFILE=run            # the whole run
+    LUNCHBOT_PROFILE=scrape,images  # only these stages
+
+For every profiled block, the ``cProfile`` statistics (``.prof``, e.g. for
+``python -m pstats`` or snakeviz) and a text report with the top functions and the
+top allocations are written to ``LUNCHBOT_PROFILE_DIR``.
+
+If profiling is disabled, ``profiled`` returns a no-op context manager, so the
+instrumented code runs without any profiler or tracer.
+"""
+
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# blocks that can be profiled: the whole run and its stages
+PROFILE_STAGES = ("run", "scrape", "images", "render", "post")
+
+# the worker threads of the lunchbot (see the ``thread_name_prefix`` of the
+# pools), they are profiled together with the thread that started them
+PROFILED_THREAD_PREFIXES = ("scraper", "image", "post")
+
+_DISABLED = nullcontext()
+
+
+@dataclass
+class ProfilingSettings:
+    """Settings of the profiling.
+
+    Attributes
+    ----------
+    stages : frozenset
+        The blocks to profile (see ``PROFILE_STAGES``), empty if profiling is
+        disabled.
+    directory : str, optional
+        Directory of the profiles, by default ``profiles`` in the lunchbot cache
+        directory.
+    top : int, optional
+        Number of functions and allocations in the reports, by default 30.
+    memory : bool, optional
+        Whether to trace the allocations with ``tracemalloc``, by default True.
+    """
+
+    stages: frozenset = field(default_factory=frozenset)
+    directory: str = None
+    top: int = 30
+    memory: bool = True
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Create the settings from the environment variables.
+
+        Keyword arguments take precedence over the environment.
+        """
+        settings = {
+            "stages": os.getenv("LUNCHBOT_PROFILE", ""),
+            "directory": os.getenv("LUNCHBOT_PROFILE_DIR"),
+            "top": int(os.getenv("LUNCHBOT_PROFILE_TOP", "30")),
+            "memory": os.getenv("LUNCHBOT_PROFILE_MEMORY", "true").lower() != "false",
+        }
+        settings.update({k: v for k, v in kwargs.items() if v is not None})
+        settings["stages"] = parse_stages(settings["stages"])
+        return cls(**settings)
+
+
+def parse_stages(stages):
+    """Get the set of stages from a comma-separated string or a list.
+
+    "all", "true" and "1" select the whole run, "", "false" and "0" nothing.
+    """
+    if isinstance(stages, str):
+        stages = stages.split(",")
+    stages = {s.strip().lower() for s in stages} - {"", "false", "0", "off"}
+    if stages & {"all", "true", "1", "on"}:
+        return frozenset({"run"})
+    unknown = stages - set(PROFILE_STAGES)
+    if unknown:
+        logger.warning(
+            f"Unknown profiling stage(s) {', '.join(sorted(unknown))}, "
+            f"choose from {', '.join(PROFILE_STAGES)}"
+        )
+    return frozenset(stages & set(PROFILE_STAGES))
+
+
+_settings = None
+_lock = threading.Lock()
+_active = None
+
+
+def configure(stages=None, directory: str = None, top: int = None, memory=None):
+    """Set the profiling settings (unset arguments are read from the env)."""
+    global _settings
+    _settings = ProfilingSettings.from_env(
+        stages=stages, directory=directory, top=top, memory=memory
+    )
+    if _settings.stages:
+        logger.info(f"Profiling enabled for: {', '.join(sorted(_settings.stages))}")
+    return _settings
+
+
+def get_settings():
+    """Get the profiling settings (read from the env on first use)."""
+    if _settings is None:
+        configure()
+    return _settings
+
+
+def profiled(stage: str, label: str = None):
+    """Profile the block if profiling is enabled for ``stage``.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the block (see ``PROFILE_STAGES``).
+    label : str, optional
+        Name of the block in the file names, by default ``stage``.
+
+    Returns
+    -------
+    context manager
+        A ``Capture`` or, if ``stage`` is not profiled, a no-op context manager.
+    """
+    settings = get_settings()
+    if stage not in settings.stages:
+        return _DISABLED
+    return Capture(label or stage, settings)
+
+
+class Capture:
+    """Profile a block with ``cProfile`` (and ``tracemalloc``) and write reports.
+
+    Nested captures are not supported (the profiler of a thread can't be
+    stacked), a capture inside another one is skipped.
+    """
+
+    def __init__(self, label: str, settings: ProfilingSettings):
+        self.label = label
+        self.settings = settings
+        self.paths = []
+        self._profilers = []
+        self._profilers_lock = threading.Lock()
+        self._started_tracemalloc = False
+        self._snapshot = None
+        self._skipped = False
+
+    def __enter__(self):
+        global _active
+        with _lock:
+            if _active is not None:
+                logger.warning(
+                    f"Not profiling '{self.label}', '{_active.label}' is already "
+                    "being profiled"
+                )
+                self._skipped = True
+                return self
+            _active = self
+
+        import cProfile
+
+        if self.settings.memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            # Python 3.8 has no reset_peak, the peak then includes the
+            # allocations before the capture if tracemalloc was already running
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+
+        self._start = time.perf_counter()
+        profiler = cProfile.Profile()
+        self._profilers.append(profiler)
+        # since Python 3.12, cProfile sees all threads
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        if self._skipped:
+            return False
+        self._profilers[0].disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        duration = time.perf_counter() - self._start
+        try:
+            self._write_reports(duration)
+        except Exception as e:
+            logger.error(f"Could not write the profile of '{self.label}': {e}")
+        finally:
+            if self._started_tracemalloc:
+                import tracemalloc
+
+                tracemalloc.stop()
+            with _lock:
+                _active = None
+        return False
+
+    def _profile_thread(self, frame, event, arg):
+        # called on the first event of every thread started during the capture,
+        # the lunchbot workers get their own profiler (merged at the end)
+        sys.setprofile(None)
+        if not threading.current_thread().name.startswith(PROFILED_THREAD_PREFIXES):
+            return
+        import cProfile
+
+        profiler = cProfile.Profile()
+        with self._profilers_lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+
+    def _write_reports(self, duration: float):
+        import pstats
+
+        # before the statistics are built, so their allocations don't count
+        memory_report = self._memory_report() if self._snapshot is not None else ""
+
+        directory = self.settings.directory or get_cache_dir("profiles")
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(
+            directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.label}"
+        )
+
+        with self._profilers_lock:
+            profilers = list(self._profilers)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(f"{base}.prof")
+
+        report = io.StringIO()
+        report.write(
+            f"Profile of '{self.label}': {duration:.3f}s, "
+            f"{len(profilers)} thread(s)\n\n"
+        )
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(self.settings.top)
+        report.write(memory_report)
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+        self.paths = [f"{base}.prof", f"{base}.txt"]
+        logger.info(
+            f"Profile of '{self.label}' ({duration:.2f}s) written to {base}.prof/.txt"
+        )
+
+    def _memory_report(self):
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        ignored = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "*/cProfile.py"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+        differences = snapshot.compare_to(
+            self._snapshot.filter_traces(ignored), "lineno"
+        )
+        lines = [
+            "",
+            f"Memory: peak {peak / 2**20:.1f} MiB, "
+            f"{current / 2**20:.1f} MiB traced at the end",
+            f"Top {self.settings.top} allocations (size at the end, change):",
+        ]
+        lines += [f"  {d}" for d in differences[: self.settings.top]]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,255 @@
+"""Crash-safe journal of the run of a day, so a failed run can be resumed.
+
+The journal of a day records the steps of the run as they are completed:
+
+- the scraped menu (only if all scrapers succeeded),
+- the image of every dish (by fingerprint),
+- the dishes of the message,
+- per channel, the rendered messages and how many of them were posted.
+
+A rerun (e.g. the retry of cron or the daemon after "Image upload failed")
+picks up the completed steps instead of starting from scratch: it doesn't
+scrape again, only processes the dishes without an image, posts the messages
+that were rendered before and skips the messages (and channels) that were
+already posted. So a menu is never posted twice.
+
+Every checkpoint is written to a temporary file, synced and moved into place,
+so a crash can't leave a half-written journal behind. Runs of the same day hold
+a lock on the journal (see ``RunJournal.lock``), a concurrent run waits for the
+first one and then resumes from its journal.
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as date_type
+
+from lunchbot.fingerprint import dish_fingerprint
+from lunchbot.image_generation import TECHNICAL_DIFFICULTIES_IMAGE_URL
+from lunchbot.image_pipeline import RESULT_KEYS
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# number of days the journals are kept (for debugging failed runs)
+JOURNAL_RETENTION_DAYS = 7
+
+
+class RunJournal:
+    """Journal of the run of one day, stored as a JSON file.
+
+    The methods are thread-safe (the image workers and the posting threads
+    write their checkpoints concurrently).
+
+    Parameters
+    ----------
+    date : datetime.date
+        The day of the run.
+    cache_dir : str, optional
+        Directory of the journals, by default ``journal`` in the lunchbot cache
+        directory.
+    """
+
+    def __init__(self, date: date_type, cache_dir: str = None):
+        self.date = date
+        self.cache_dir = cache_dir or get_cache_dir("journal")
+        self.path = os.path.join(self.cache_dir, f"{date.isoformat()}.json")
+        self._lock = threading.Lock()
+        self._entry = self._load()
+
+    @contextmanager
+    def lock(self):
+        """Hold the lock of the day for a run.
+
+        If another process runs the same day, this waits until it is done and
+        then reloads the journal it left behind. The lock is released by the
+        operating system if the process dies.
+        """
+        try:
+            import fcntl
+        except ImportError:
+            # no file locks (Windows), concurrent runs are not serialised
+            yield self
+            return
+
+        with open(f"{os.path.splitext(self.path)[0]}.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info(f"Another run of {self.date} is in progress, waiting")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    self._entry = self._load()
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------------
+    # scrape
+
+    def scraped_dishes(self):
+        """Get the scraped dishes (None if the menu wasn't scraped completely)."""
+        with self._lock:
+            scrape = self._entry.get("scrape")
+            return copy.deepcopy(scrape["dishes"]) if scrape else None
+
+    def save_scraped_dishes(self, dishes: list):
+        """Record the scraped dishes (before they are processed)."""
+        with self._lock:
+            self._entry["scrape"] = {
+                "dishes": copy.deepcopy(dishes),
+                "completed_at": time.time(),
+            }
+            self._save()
+
+    # ------------------------------------------------------------------------
+    # images
+
+    def restore_images(self, dishes: list):
+        """Set the recorded image results on the dishes.
+
+        Returns
+        -------
+        list
+            The dishes without a recorded image, they still have to be
+            processed.
+        """
+        with self._lock:
+            images = self._entry.get("images", {})
+        pending = []
+        for dish in dishes:
+            if not dish.get("fingerprint"):
+                dish["fingerprint"] = dish_fingerprint(dish["name"])
+            result = images.get(dish["fingerprint"])
+            if result is None:
+                pending.append(dish)
+            else:
+                dish.update(result)
+        if len(pending) < len(dishes):
+            logger.info(
+                f"Images of {len(dishes) - len(pending)} of {len(dishes)} dishes "
+                "were processed by an earlier attempt"
+            )
+        return pending
+
+    def save_images(self, dishes: list):
+        """Record the image results of processed dishes.
+
+        Placeholders of failed generations are not recorded, so a rerun tries
+        again.
+        """
+        results = {
+            dish["fingerprint"]: {k: dish[k] for k in RESULT_KEYS if k in dish}
+            for dish in dishes
+            if dish.get("fingerprint")
+            and dish.get("image_url") != TECHNICAL_DIFFICULTIES_IMAGE_URL
+        }
+        if not results:
+            return
+        with self._lock:
+            self._entry.setdefault("images", {}).update(results)
+            self._save()
+
+    # ------------------------------------------------------------------------
+    # render and post
+
+    def dishes(self):
+        """Get the dishes of the message (None if they weren't recorded yet)."""
+        with self._lock:
+            return copy.deepcopy(self._entry.get("dishes"))
+
+    def save_dishes(self, dishes: list):
+        """Record the dishes of the message (before it is rendered and posted)."""
+        with self._lock:
+            self._entry["dishes"] = copy.deepcopy(dishes)
+            self._save()
+
+    def checkpoint_messages(self, messages: dict):
+        """Record the rendered messages of the channels.
+
+        Channels with messages from an earlier attempt keep them, so a channel
+        never gets parts of two different renderings.
+
+        Parameters
+        ----------
+        messages : dict
+            Dictionary mapping the channel names to their messages.
+
+        Returns
+        -------
+        dict
+            The messages to post per channel.
+        """
+        with self._lock:
+            channels = self._entry.setdefault("channels", {})
+            for name, channel_messages in messages.items():
+                if name not in channels:
+                    channels[name] = {"messages": list(channel_messages), "posted": 0}
+            self._save()
+            return {name: list(channels[name]["messages"]) for name in messages}
+
+    def posted(self, name: str):
+        """Number of messages that were posted to the channel ``name``."""
+        with self._lock:
+            return self._entry.get("channels", {}).get(name, {}).get("posted", 0)
+
+    def mark_posted(self, name: str, count: int):
+        """Record that the first ``count`` messages of ``name`` were posted."""
+        with self._lock:
+            channel = self._entry["channels"][name]
+            channel["posted"] = count
+            if count == len(channel["messages"]):
+                channel["completed_at"] = time.time()
+            self._save()
+
+    def is_posted(self, names: list):
+        """Whether the menu was posted completely to all the channels ``names``."""
+        with self._lock:
+            channels = self._entry.get("channels", {})
+            return bool(names) and all(
+                name in channels
+                and channels[name]["posted"] == len(channels[name]["messages"])
+                for name in names
+            )
+
+    # ------------------------------------------------------------------------
+    # storage
+
+    def prune(self, before: date_type):
+        """Remove the journals of the days before ``before``."""
+        for file_name in os.listdir(self.cache_dir):
+            name, extension = os.path.splitext(file_name)
+            try:
+                if (
+                    extension in (".json", ".lock")
+                    and date_type.fromisoformat(name) < before
+                ):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+            except (ValueError, OSError):
+                continue
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return {"date": self.date.isoformat()}
+        if entry.get("date") != self.date.isoformat():
+            return {"date": self.date.isoformat()}
+        return entry
+
+    def _save(self):
+        self._entry["updated_at"] = time.time()
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entry, f, ensure_ascii=False)
+            # the checkpoint must be on disk before the next step (e.g. the
+            # next post) is taken
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
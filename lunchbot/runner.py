@@ -0,0 +1,329 @@
+"""A single lunchbot run: scrape -> generate images -> render -> post."""
+
+import logging
+import os
+from contextlib import nullcontext
+from datetime import date as date_type
+from datetime import datetime, timedelta
+
+from lunchbot.metrics import export_metrics, span, start_run
+from lunchbot.profiling import profiled
+from lunchbot.utils import color_text
+
+logger = logging.getLogger("lunchbot")
+
+
+def collect_dishes(config, include_alsterfood: bool = True):
+    """Scrape the menus of today from all canteens.
+
+    Returns
+    -------
+    tuple
+        The list of dishes and a dictionary ``{canteen: error message}`` of the
+        scrapers that failed.
+    """
+    import lunchbot.alsterfood_scraping as alsterfood_scraping
+    import lunchbot.cfel_scraping as cfel_scraping
+    from lunchbot.scraping import fetch_all_lunch_menus
+
+    return fetch_all_lunch_menus(
+        [
+            (
+                "Alsterfood",
+                alsterfood_scraping.fetch_todays_lunch_menu,
+                config.alsterfood_website_url if include_alsterfood else None,
+            ),
+            ("CFEL", cfel_scraping.fetch_todays_lunch_menu, config.cfel_website_url),
+        ],
+        deadline=config.scraping_deadline,
+    )
+
+
+def render_settings(config, today: date_type = None):
+    """Get the settings the tables of the menu are rendered with.
+
+    The tables must fit into ``config.max_message_length`` together with the
+    longest prefix and suffix of the channels.
+    """
+    targets = config.webhook_targets()
+    overhead = max(t.overhead(config.message_prefix, today) for t in targets)
+    return {
+        "max_length": config.max_message_length - overhead,
+        "canteen_urls": config.canteen_urls,
+    }
+
+
+def post_menu(
+    config,
+    list_of_dishes: list,
+    today: date_type = None,
+    journal=None,
+    tables: list = None,
+):
+    """Post the menu to all channels of the config.
+
+    The table is split into several messages if it (together with the longest
+    prefix and suffix of the channels) exceeds ``config.max_message_length``.
+    ``tables`` are the tables rendered before (e.g. by the prefetch), by default
+    they are rendered from ``list_of_dishes``. With a ``journal`` (see
+    ``lunchbot.run_journal``), the posts are recorded and the messages that were
+    already posted on the day are skipped.
+
+    Returns
+    -------
+    list
+        List of ``PostResult``, one per channel. Raises an error if no channel
+        could be posted to, failures of some channels are only alerted.
+    """
+    from lunchbot.fanout import post_to_targets
+    from lunchbot.message import split_table
+
+    targets = config.webhook_targets()
+    if tables is None:
+        with span("render"), profiled("render"):
+            tables = split_table(list_of_dishes, **render_settings(config, today))
+    logger.info(
+        f"Posting the menu ({len(tables)} table(s)) to {len(targets)} channel(s):"
+    )
+    for table in tables:
+        logger.info(color_text(table, "green"))
+
+    results = post_to_targets(
+        targets,
+        tables,
+        default_prefix=config.message_prefix,
+        date=today,
+        max_workers=config.fanout_max_workers,
+        journal=journal,
+    )
+    failed = [r for r in results if not r.ok]
+    if failed and len(failed) == len(results):
+        raise ValueError(f"Posting failed for all channels: {failed[-1].error}")
+    if failed:
+        send_alert(
+            "Posting failed for the channels "
+            + ", ".join(f"'{r.target}' ({r.error})" for r in failed)
+        )
+    else:
+        logger.info("Message posted successfully!")
+    return results
+
+
+def send_alert(message: str, timing_summary: bool = False):
+    """Send an alert to ``MATTERMOST_WEBHOOK_URL_ALERT`` (if it is set).
+
+    With ``timing_summary=True``, a short summary of the timings of the current
+    run is added (see ``lunchbot.metrics``).
+    """
+    from lunchbot.mattermost_posting import send_message_via_webhook
+    from lunchbot.metrics import get_metrics
+
+    if timing_summary:
+        message = f"{message}\n{get_metrics().timing_summary()}"
+
+    webhook_url = os.getenv("MATTERMOST_WEBHOOK_URL_ALERT")
+    if webhook_url is None:
+        logger.warning("MATTERMOST_WEBHOOK_URL_ALERT is not set, no alert sent")
+        return
+    try:
+        send_message_via_webhook(
+            webhook_url=webhook_url,
+            message=f"{os.getenv('ALERT_PREFIX') or ''}{message}",
+            username="Lunchbot",
+        )
+    except Exception as e:
+        logger.error(f"Could not send the alert: {e}")
+
+
+def run_lunchbot(
+    config,
+    today: date_type = None,
+    store=None,
+    post: bool = True,
+    pipeline=None,
+    journal=None,
+):
+    """Put the message of the day together and post it.
+
+    If the menu of the day was prefetched (see ``lunchbot.prefetch``), the stored
+    dishes are used and only the CFEL menu is scraped and processed (if
+    configured). Without new dishes, the tables rendered by the prefetch are
+    posted.
+
+    Parameters
+    ----------
+    config : LunchbotConfig
+        Settings of the lunchbot.
+    today : datetime.date, optional
+        The day of the message, by default today.
+    store : PrefetchStore, optional
+        Store of the prefetched menus, by default the one in the lunchbot
+        cache directory.
+    post : bool, optional
+        Whether to post the message (to all channels), by default True.
+    pipeline : ImagePipeline, optional
+        Image pipeline to use (e.g. one with warm indexes), by default a new one.
+    journal : RunJournal, optional
+        Journal of the run, by default the one of the day in the lunchbot cache
+        directory (if ``config.run_journal`` is set and the message is posted).
+
+    Returns
+    -------
+    list
+        The dishes of the message, with the results of the image pipeline.
+
+    Notes
+    -----
+    The completed steps are recorded in the journal of the day: a rerun after a
+    failed run resumes it (without scraping again, processing the images that
+    are done or posting a message twice), and a rerun after a successful run
+    doesn't do anything.
+
+    The time of every stage and external call is recorded and, if configured,
+    written to ``config.metrics_json_file`` and ``config.metrics_textfile`` at
+    the end of the run (also if it fails). The run or single stages can be
+    profiled, see ``lunchbot.profiling``.
+    """
+    from lunchbot.run_journal import JOURNAL_RETENTION_DAYS, RunJournal
+
+    today = today or date_type.today()
+    if journal is None and post and config.run_journal:
+        journal = RunJournal(today)
+        journal.prune(today - timedelta(days=JOURNAL_RETENTION_DAYS))
+
+    metrics = start_run("run")
+    try:
+        with profiled("run"), journal.lock() if journal is not None else nullcontext():
+            list_of_dishes = _run_lunchbot(
+                config, today, store, post, pipeline, journal
+            )
+    except Exception as e:
+        metrics.finish(e)
+        raise
+    else:
+        metrics.finish()
+    finally:
+        logger.info(metrics.timing_summary())
+        export_metrics(metrics, config.metrics_json_file, config.metrics_textfile)
+    return list_of_dishes
+
+
+def _run_lunchbot(config, today, store, post, pipeline, journal):
+    from lunchbot.image_generation import TECHNICAL_DIFFICULTIES_IMAGE_URL
+    from lunchbot.image_pipeline import ImagePipeline
+    from lunchbot.message import fill_missing_fields
+    from lunchbot.prefetch import PrefetchStore
+
+    store = store or PrefetchStore()
+
+    logger.info(f"Running on host: {config.hostname}")
+
+    if journal is not None and journal.is_posted(
+        [target.name for target in config.webhook_targets()]
+    ):
+        logger.info(f"The menu of {today} was already posted to all channels")
+        return journal.dishes()
+
+    # some initial logging
+    logger.info(50 * "-")
+    logger.info("LUNCHBOT hungry!")
+    logger.info("LUNCHBOT will be looking for food now...")
+    logger.info(50 * "-")
+
+    prefetched = store.load(today)
+    if prefetched is not None:
+        created_at = datetime.fromtimestamp(prefetched["created_at"])
+        logger.info(f"Using the menu prefetched at {created_at:%Y-%m-%d %H:%M}")
+        list_of_dishes = prefetched["dishes"]
+    else:
+        list_of_dishes = []
+    # the images that failed in the prefetch are generated again
+    failed_dishes = [
+        dish
+        for dish in list_of_dishes
+        if dish.get("image_url") == TECHNICAL_DIFFICULTIES_IMAGE_URL
+    ]
+    if failed_dishes:
+        logger.info(
+            f"Retrying the images of {len(failed_dishes)} prefetched dish(es) "
+            "that failed"
+        )
+
+    # -------------------------------------------------------------------------
+    # Get the list of meals and prices
+    # ---
+    new_dishes, scraping_errors = [], {}
+    scraped = journal.scraped_dishes() if journal is not None else None
+    if scraped is not None:
+        logger.info("Using the menu scraped by an earlier attempt")
+        new_dishes = scraped
+    elif prefetched is None or config.cfel_website_url is not None:
+        with span("scrape"), profiled("scrape"):
+            new_dishes, scraping_errors = collect_dishes(
+                config, include_alsterfood=prefetched is None
+            )
+        # an incomplete menu is scraped again by a rerun
+        if journal is not None and new_dishes and not scraping_errors:
+            journal.save_scraped_dishes(new_dishes)
+    if not list_of_dishes and not new_dishes:
+        if scraping_errors:
+            raise ValueError(
+                "No dishes found, the menus are empty or their scrapers failed: "
+                f"{scraping_errors}"
+            )
+        raise ValueError("No dishes found, the menus of all canteens are empty")
+
+    logger.info("The following dishes were found:")
+    for i, dish_name in enumerate(new_dishes):
+        logger.info(f"  {i + 1})  {dish_name}")
+
+    # -------------------------------------------------------------------------
+    # Generate an image for each meal
+    # ---
+    logger.info(50 * "-")
+    logger.info("Generating images for the meals...")
+
+    pending = new_dishes + failed_dishes
+    if journal is not None:
+        pending = journal.restore_images(pending)
+    pipeline = pipeline or ImagePipeline(config.image_pipeline_config())
+    with span("images"), profiled("images"):
+        pipeline.run(
+            pending, on_processed=journal.save_images if journal is not None else None
+        )
+    list_of_dishes = list_of_dishes + new_dishes
+
+    # if there are price/info/canteen elements that are None, set them to "N/A"
+    fill_missing_fields(list_of_dishes)
+
+    # printout the information which helps with debugging in case something goes wrong
+    for dish in list_of_dishes:
+        logger.info(f"Dish: {dish['name']}")
+        logger.info(f"\tImage URL: {dish['image_url']}")
+        logger.info(f"\tGeneration info tag: {dish['generation_info_tag']}")
+        logger.info(f"\tHash: {dish['hash']}")
+        logger.info(f"\tPrice: {dish['price']}")
+        logger.info(f"\tInfo: {dish['info']}")
+        logger.info(f"\tCanteen: {dish['canteen']}")
+
+    # -------------------------------------------------------------------------
+    # Put the message together and send to Mattermost
+    # ---
+    if post:
+        if journal is not None:
+            journal.save_dishes(list_of_dishes)
+        # the tables of the prefetch are posted as they are, unless dishes were
+        # added or changed or the channels need shorter tables
+        tables = None
+        if (
+            prefetched is not None
+            and prefetched.get("tables")
+            and not new_dishes
+            and not failed_dishes
+            and prefetched.get("render") == render_settings(config, today)
+        ):
+            logger.info("Posting the tables rendered by the prefetch")
+            tables = prefetched["tables"]
+        with span("post"), profiled("post"):
+            post_menu(config, list_of_dishes, today, journal, tables)
+    return list_of_dishes
@@ -0,0 +1,71 @@
+"""Run all configured menu scrapers concurrently."""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_all_lunch_menus(scrapers: list, deadline: float = 30):
+    """Fetch the lunch menus of all canteens at the same time.
+
+    Every scraper runs in its own thread, so the total time of this stage is the
+    latency of the slowest site (capped by ``deadline``) instead of the sum of all of
+    them. A failing or slow scraper only loses its own dishes.
+
+    Parameters
+    ----------
+    scrapers : list
+        List of ``(name, fetch_function, url)`` tuples. ``fetch_function`` is called
+        as ``fetch_function(url)`` and has to return a list of dishes.
+        Scrapers with ``url=None`` are skipped.
+    deadline : float, optional
+        Time in seconds after which the results of unfinished scrapers are
+        discarded, by default 30.
+
+    Returns
+    -------
+    tuple
+        The list of dishes (in the order of ``scrapers``) and a dictionary
+        ``{name: error message}`` of the scrapers that failed or timed out.
+    """
+    scrapers = [(name, fn, url) for name, fn, url in scrapers if url is not None]
+    errors = {}
+    if not scrapers:
+        return [], errors
+
+    start = time.monotonic()
+    # don't use the context manager here: its shutdown would block until the slow
+    # scrapers are done, which is exactly what the deadline should prevent
+    executor = ThreadPoolExecutor(
+        max_workers=len(scrapers), thread_name_prefix="scraper"
+    )
+    futures = []
+    for name, fn, url in scrapers:
+        logger.info(f"Fetching the lunch menu of {name}... ({url})")
+        futures.append(executor.submit(fn, url))
+    wait(futures, timeout=deadline)
+    # scrapers that haven't started are cancelled, the running ones are left
+    # behind (``shutdown(cancel_futures=True)`` would need Python 3.9)
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=False)
+
+    list_of_dishes = []
+    for (name, _, _), future in zip(scrapers, futures):
+        if not future.done():
+            errors[name] = f"no response within {deadline}s"
+            logger.error(f"Fetching the lunch menu of {name} timed out")
+            continue
+        try:
+            dishes = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+            logger.error(f"An error occurred while fetching {name} lunch menu: {e}")
+            continue
+        logger.info(f"Found {len(dishes)} dishes for {name}")
+        list_of_dishes += dishes
+
+    logger.info(f"Fetched all lunch menus in {time.monotonic() - start:.2f}s")
+    return list_of_dishes, errors
@@ -0,0 +1,204 @@
+"""Similarity index over the names of dishes that already have an image."""
+
+import json
+import logging
+import math
+import os
+import threading
+from collections import Counter
+
+from lunchbot.fingerprint import canonicalize_dish_name
+from lunchbot.utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+def char_ngrams(text: str, n_min: int = 2, n_max: int = 4):
+    """Count the character n-grams of a (padded) text."""
+    text = f" {text} "
+    return Counter(
+        text[i : i + n]
+        for n in range(n_min, n_max + 1)
+        for i in range(len(text) - n + 1)
+    )
+
+
+# diet labels that don't tell anything about the dish
+UNKNOWN_LABELS = ("", "n/a", "none")
+
+# number of added dishes after which the index is written to disk (the rest is
+# written by ``save``)
+SAVE_EVERY = 50
+
+
+def normalize_label(info: str):
+    """Normalise the diet label of a dish ("" if unknown)."""
+    label = (info or "").strip().lower()
+    return "" if label in UNKNOWN_LABELS else label
+
+
+class SimilarityIndex:
+    """Find the images of dishes with similar names.
+
+    Dish names are represented as TF-IDF vectors of their character n-grams and
+    compared with the cosine similarity. The n-gram counts of each name are kept
+    as a sparse row (column indices and weights), so adding a dish only appends
+    its row and the document frequencies of its n-grams; the IDF weights and the
+    norms are applied when querying, in time proportional to the number of
+    stored n-grams. The names, diet labels and image keys are persisted as JSON
+    (see ``save``), so the index grows with every generated image.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the JSON file, by default ``similarity_index.json`` in the
+        lunchbot cache directory.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(get_cache_dir(), "similarity_index.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        self._entries = []
+        self._known = {}
+        self._vocabulary = {}
+        self._document_frequency = []
+        self._columns = []
+        self._weights = []
+        self._row_starts = []
+        self._arrays = None
+        for entry in entries:
+            self._append(entry["name"], entry["key"], entry.get("info", ""))
+        self._unsaved = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name: str, key: str, info: str = ""):
+        """Add the image ``key`` of the dish ``name`` (with diet label ``info``)."""
+        name = canonicalize_dish_name(name)
+        label = normalize_label(info)
+        with self._lock:
+            if not name:
+                return
+            index = self._known.get((name, key))
+            if index is not None:
+                # entries of older versions have no label
+                if label and not self._entries[index]["info"]:
+                    self._entries[index]["info"] = label
+                    self._unsaved += 1
+                return
+            self._append(name, key, label)
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY:
+                self._save()
+
+    def save(self):
+        """Write the dishes added since the last save to disk."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def query(self, name: str, k: int = 5):
+        """Get the ``k`` most similar dishes.
+
+        Returns
+        -------
+        list
+            List of ``(similarity, name, key, info)`` tuples, most similar first.
+        """
+        import numpy as np
+
+        with self._lock:
+            if not self._entries:
+                return []
+            if self._arrays is None:
+                self._arrays = (
+                    np.array(self._columns, dtype=np.int64),
+                    np.array(self._weights, dtype=np.float32),
+                    np.array(self._row_starts, dtype=np.int64),
+                    np.array(self._document_frequency, dtype=np.float32),
+                )
+            columns, weights, row_starts, document_frequency = self._arrays
+            vocabulary = self._vocabulary
+            entries = list(self._entries)
+
+        n = len(entries)
+        idf = np.log((1 + n) / (1 + document_frequency)) + 1
+        query = np.zeros(len(idf), dtype=np.float32)
+        for ngram, count in char_ngrams(canonicalize_dish_name(name)).items():
+            column = vocabulary.get(ngram)
+            if column is not None:
+                query[column] = (1 + math.log(count)) * idf[column]
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+
+        # per stored n-gram: its TF-IDF weight, summed up per row
+        values = weights * idf[columns]
+        norms = np.sqrt(np.add.reduceat(values * values, row_starts))
+        similarities = np.add.reduceat(values * query[columns], row_starts)
+        similarities /= norms * query_norm
+
+        k = min(k, n)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            (
+                float(similarities[i]),
+                entries[i]["name"],
+                entries[i]["key"],
+                entries[i]["info"],
+            )
+            for i in top
+        ]
+
+    def best_match(self, name: str, threshold: float, info: str = "", k: int = 5):
+        """Get the most similar dish with the same diet label.
+
+        The labels have to match (also if they are unknown), so e.g. the image
+        of a meat dish is never reused for its vegetarian variant.
+
+        Returns
+        -------
+        tuple or None
+            ``(similarity, name, key)`` of the best match with a similarity of
+            at least ``threshold``, or None.
+        """
+        label = normalize_label(info)
+        for similarity, match_name, key, match_label in self.query(name, k=k):
+            if similarity < threshold:
+                break
+            if match_label == label:
+                return similarity, match_name, key
+        return None
+
+    def _append(self, name: str, key: str, label: str):
+        self._known[(name, key)] = len(self._entries)
+        self._entries.append({"name": name, "key": key, "info": label})
+        self._row_starts.append(len(self._columns))
+        for ngram, count in char_ngrams(name).items():
+            column = self._vocabulary.setdefault(ngram, len(self._vocabulary))
+            if column == len(self._document_frequency):
+                self._document_frequency.append(0)
+            self._document_frequency[column] += 1
+            self._columns.append(column)
+            self._weights.append(1 + math.log(count))
+        # the arrays are rebuilt from the lists on the next query
+        self._arrays = None
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=0)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # the index is rebuilt from the images that are found again
+            logger.warning(f"Could not save the similarity index: {e}")
+            return
+        self._unsaved = 0
@@ -0,0 +1,154 @@
+"""Persistent on-disk cache for translations of dish descriptions."""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from lunchbot.metrics import incr
+from lunchbot.utils import generate_hash, get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+class TranslationCache:
+    """SQLite-backed cache for translations.
+
+    Entries are keyed by the hash of the text together with the system prompt and
+    the model, so changing either of them doesn't return stale translations. If
+    the cache grows beyond ``max_entries``, the least recently used entries are
+    evicted.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the SQLite database, by default ``translations.sqlite`` in the
+        lunchbot cache directory.
+    max_entries : int, optional
+        Maximum number of cached translations, by default 5000.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = 5000):
+        if path is None:
+            path = os.path.join(get_cache_dir(), "translations.sqlite")
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, "
+                "text TEXT NOT NULL, "
+                "translation TEXT NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(text: str, system_content: str, model: str):
+        """Get the cache key of a translation request."""
+        return generate_hash(f"{model}\n{system_content}\n{text}")
+
+    def get(self, key: str):
+        """Get a cached translation, or None if there is none."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT translation FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                incr("translation_cache", result="miss")
+                return None
+            self.hits += 1
+            incr("translation_cache", result="hit")
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE translations SET last_used = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+            return row[0]
+
+    def set(self, key: str, text: str, translation: str):
+        """Store a translation and evict the oldest entries if necessary."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                (key, text, translation, time.time()),
+            )
+            self._connection.execute(
+                "DELETE FROM translations WHERE key NOT IN ("
+                "SELECT key FROM translations ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, text: str = None, key: str = None):
+        """Remove the entries of a text (for all prompts and models) or a key.
+
+        Returns the number of removed entries.
+        """
+        if text is None and key is None:
+            raise ValueError("Either text or key has to be given")
+        with self._lock, self._connection:
+            if key is not None:
+                cursor = self._connection.execute(
+                    "DELETE FROM translations WHERE key = ?", (key,)
+                )
+            else:
+                cursor = self._connection.execute(
+                    "DELETE FROM translations WHERE text = ?", (text,)
+                )
+            return cursor.rowcount
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM translations")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM translations"
+            ).fetchone()[0]
+
+    def stats(self):
+        """Get the hit/miss counters and the number of entries."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+
+def get_translation_cache():
+    """Get the shared translation cache (None if disabled).
+
+    The cache can be disabled by setting ``TRANSLATION_CACHE=false``, its size is
+    set with ``TRANSLATION_CACHE_SIZE``.
+    """
+    global _default_cache
+    if os.getenv("TRANSLATION_CACHE", "true").lower() == "false":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TranslationCache(
+                max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", "5000"))
+            )
+        return _default_cache
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the translation cache")
+    parser.add_argument("--invalidate", type=str, help="German text to remove")
+    parser.add_argument("--clear", action="store_true", help="Remove all entries")
+    args = parser.parse_args()
+
+    cache = TranslationCache()
+    if args.invalidate is not None:
+        print(f"Removed {cache.invalidate(text=args.invalidate)} entries")
+    if args.clear:
+        cache.clear()
+    print(f"{len(cache)} cached translations in {cache.path}")
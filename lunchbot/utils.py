@@ -1,13 +1,17 @@
-"""Utils for lunchbot."""
+"""Utils for lunchbot.
 
+Importing this module is cheap: heavy dependencies (like ``openai``) are only
+imported inside the functions that need them, and the environment is not touched
+at import time (scripts load the ``.env`` file themselves).
+"""
+
+import functools
 import hashlib
+import json
 import logging
 import os
 
-from dotenv import load_dotenv
-from openai import OpenAI
-
-load_dotenv()  # Loads variables from .env file
+from lunchbot.metrics import span
 
 logger = logging.getLogger(__name__)
 
@@ -18,19 +22,65 @@ COLORS = {
     "end": "\033[0m",
 }
 
+DEFAULT_TRANSLATION_SYSTEM_CONTENT = (
+    "You are a translator. Be sure to keep the meaning of the text. "
+)
+
 
 def color_text(text: str, color: str):
     """Color text for terminal output."""
     return COLORS[color] + text + COLORS["end"]
 
 
+@functools.lru_cache(maxsize=1)
+def get_openai_client():
+    """Get a shared OpenAI client (created on first use)."""
+    from openai import OpenAI
+
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+@span("openai.chat")
+def _create_chat_completion(**kwargs):
+    return get_openai_client().chat.completions.create(**kwargs)
+
+
+def _chat_completion(model: str, **kwargs):
+    """Request a chat completion through the generation scheduler.
+
+    Raises ``CircuitOpenError`` right away (without queueing) if the chat API
+    kept failing recently.
+    """
+    from lunchbot.circuit_breaker import get_circuit_breaker
+    from lunchbot.generation_scheduler import (
+        get_generation_scheduler,
+        is_rate_limit_error,
+    )
+
+    breaker = get_circuit_breaker("openai_chat")
+    breaker.check()
+    return get_generation_scheduler().call(
+        "openai",
+        model,
+        lambda: breaker.call(
+            lambda: _create_chat_completion(model=model, **kwargs),
+            ignore=is_rate_limit_error,
+        ),
+    )
+
+
 def translate_german_food_description_to_english(
     meal_name: str,
     return_prompt_answer: bool = False,
     system_content: str = None,
+    model: str = "gpt-3.5-turbo",
+    use_cache: bool = True,
 ):
     """Translate a German food description to English.
 
+    Translations are stored in the persistent translation cache, so repeated
+    dishes don't need another API request.
+
     Parameters
     ----------
     meal_name : str
@@ -39,34 +89,45 @@ def translate_german_food_description_to_english(
         Whether to return the prompt and the answer, by default False
     system_content : str, optional
         The system content to use for the prompt, by default None
+    model : str, optional
+        The model to use for the translation, by default "gpt-3.5-turbo"
+    use_cache : bool, optional
+        Whether to use the translation cache, by default True
 
     Returns
     -------
     str or tuple
         The answer or a tuple of the prompt and the answer (if return_prompt_answer=True).
     """
-
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    from lunchbot.translation_cache import TranslationCache, get_translation_cache
 
     if system_content is None:
-        system_content = (
-            "You are a translator. Be sure to keep the meaning of the text. "
-        )
+        system_content = DEFAULT_TRANSLATION_SYSTEM_CONTENT
 
     prompt = meal_name + " - please translate this from german to english."
 
-    logger.info(f"Prompt: {prompt}")
-    logger.info(f"System Content: {system_content}")
+    cache = get_translation_cache() if use_cache else None
+    cache_key = TranslationCache.make_key(meal_name, system_content, model)
+    response = cache.get(cache_key) if cache is not None else None
 
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": prompt},
-        ],
-    )
+    if response is not None:
+        logger.info(f"Using cached translation for '{meal_name}'")
+    else:
+        logger.info(f"Prompt: {prompt}")
+        logger.info(f"System Content: {system_content}")
+
+        completion = _chat_completion(
+            model,
+            messages=[
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": prompt},
+            ],
+        )
 
-    response = completion.choices[0].message.content
+        response = completion.choices[0].message.content
+
+        if cache is not None:
+            cache.set(cache_key, meal_name, response)
 
     if return_prompt_answer:
         return prompt, response
@@ -74,6 +135,135 @@ def translate_german_food_description_to_english(
     return response
 
 
+def translate_german_food_descriptions_to_english(
+    meal_names: list,
+    system_content: str = None,
+    model: str = "gpt-3.5-turbo",
+    use_cache: bool = True,
+):
+    """Translate a list of German food descriptions to English with one request.
+
+    Cached translations are reused, all remaining descriptions are translated in a
+    single JSON-formatted completion request. If the answer can't be matched to
+    the descriptions, each of them is translated on its own instead. While the
+    circuit breaker of the chat API is open, the descriptions are kept in German.
+
+    Parameters
+    ----------
+    meal_names : list
+        The names of the meals in German.
+    system_content : str, optional
+        The system content to use for the prompt, by default None
+    model : str, optional
+        The model to use for the translation, by default "gpt-3.5-turbo"
+    use_cache : bool, optional
+        Whether to use the translation cache, by default True
+
+    Returns
+    -------
+    list
+        The translations, in the same order as ``meal_names``.
+    """
+    from lunchbot.translation_cache import TranslationCache, get_translation_cache
+
+    if system_content is None:
+        system_content = DEFAULT_TRANSLATION_SYSTEM_CONTENT
+
+    cache = get_translation_cache() if use_cache else None
+    translations = {}
+    for meal_name in meal_names:
+        if meal_name in translations or cache is None:
+            continue
+        cached = cache.get(TranslationCache.make_key(meal_name, system_content, model))
+        if cached is not None:
+            translations[meal_name] = cached
+
+    missing = list(dict.fromkeys(m for m in meal_names if m not in translations))
+    logger.info(
+        f"Translating {len(missing)} of {len(meal_names)} descriptions "
+        f"({len(meal_names) - len(missing)} cached)"
+    )
+
+    if len(missing) > 1:
+        batch = _translate_batch(missing, system_content, model)
+        if batch is not None:
+            for meal_name, translation in zip(missing, batch):
+                translations[meal_name] = translation
+                if cache is not None:
+                    cache.set(
+                        TranslationCache.make_key(meal_name, system_content, model),
+                        meal_name,
+                        translation,
+                    )
+            missing = []
+        else:
+            logger.warning("Batch translation failed, translating one by one")
+
+    from lunchbot.circuit_breaker import CircuitOpenError
+
+    for meal_name in missing:
+        try:
+            translations[meal_name] = translate_german_food_description_to_english(
+                meal_name,
+                system_content=system_content,
+                model=model,
+                use_cache=use_cache,
+            )
+        except CircuitOpenError as e:
+            # better a German menu than none (not written to the translation
+            # cache, so it is translated again once the API is back)
+            logger.warning(f"Keeping '{meal_name}' untranslated: {e}")
+            translations[meal_name] = meal_name
+
+    return [translations[meal_name] for meal_name in meal_names]
+
+
+def _translate_batch(meal_names: list, system_content: str, model: str):
+    """Translate all descriptions in one request, None if the answer is unusable."""
+    prompt = (
+        "Please translate each of the following German food descriptions to "
+        'English. Answer with a JSON object {"translations": [...]} that contains '
+        f"exactly {len(meal_names)} strings, in the same order as the input:\n"
+        + json.dumps(meal_names, ensure_ascii=False)
+    )
+    try:
+        completion = _chat_completion(
+            model,
+            messages=[
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": prompt},
+            ],
+            response_format={"type": "json_object"},
+        )
+        translations = json.loads(completion.choices[0].message.content)[
+            "translations"
+        ]
+    except Exception as e:
+        logger.error(f"An error occurred during batch translation: {e}")
+        return None
+
+    if (
+        not isinstance(translations, list)
+        or len(translations) != len(meal_names)
+        or not all(isinstance(t, str) and t.strip() for t in translations)
+    ):
+        logger.error(f"Batch translation does not match the input: {translations}")
+        return None
+    return translations
+
+
+def get_cache_dir(*subdirs: str):
+    """Get (and create) the directory for persistent caches.
+
+    The base directory can be set with the environment variable
+    ``LUNCHBOT_CACHE_DIR`` and defaults to ``.lunchbot_cache``.
+    """
+    base_dir = os.getenv("LUNCHBOT_CACHE_DIR", ".lunchbot_cache")
+    cache_dir = os.path.join(base_dir, *subdirs)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
 def generate_hash(input_string: str):
     """Get the first 20 characters of the SHA256 hash of a string."""
     return hashlib.sha256(input_string.encode()).hexdigest()[:20]
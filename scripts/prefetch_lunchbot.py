@@ -0,0 +1,70 @@
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+
+parser = argparse.ArgumentParser(
+    description="Generate the images and tables of the upcoming days in advance"
+)
+parser.add_argument(
+    "--days",
+    type=int,
+    help="Number of days (starting today) to prepare",
+    default=7,
+)
+parser.add_argument(
+    "--profile",
+    nargs="*",
+    metavar="STAGE",
+    help="Profile the prefetch (or only the given stages: scrape, images) with "
+    "cProfile and tracemalloc, overrides LUNCHBOT_PROFILE",
+)
+parser.add_argument(
+    "--profile-dir",
+    type=str,
+    help="Directory of the profiles, overrides LUNCHBOT_PROFILE_DIR",
+)
+
+
+def main(days, profile=None, profile_dir=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logger = logging.getLogger("lunchbot")
+
+    load_dotenv()  # take environment variables from .env
+
+    from lunchbot.config import LunchbotConfig
+    from lunchbot.prefetch import prefetch_week
+    from lunchbot.profiling import configure, profiled
+
+    if profile is not None or profile_dir is not None:
+        configure(
+            stages=(profile or ["run"]) if profile is not None else None,
+            directory=profile_dir,
+        )
+
+    config = LunchbotConfig.from_env()
+    with profiled("run", label="prefetch"):
+        tables = prefetch_week(config, days=days)
+    logger.info(f"Prefetched the menus of {len(tables)} days")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    try:
+        main(days=args.days, profile=args.profile, profile_dir=args.profile_dir)
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        MATTERMOST_WEBHOOK_URL_ALERT = os.getenv("MATTERMOST_WEBHOOK_URL_ALERT")
+        ALERT_PREFIX = os.getenv("ALERT_PREFIX")
+        from lunchbot.mattermost_posting import send_message_via_webhook
+
+        send_message_via_webhook(
+            webhook_url=MATTERMOST_WEBHOOK_URL_ALERT,
+            message=f"{ALERT_PREFIX}An error occurred during the prefetch: {e}",
+            username="Lunchbot",
+        )
@@ -0,0 +1,22 @@
+import logging
+
+from dotenv import load_dotenv
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    load_dotenv()  # take environment variables from .env
+
+    from lunchbot.config import LunchbotConfig
+    from lunchbot.daemon import LunchbotDaemon
+
+    LunchbotDaemon.from_env(LunchbotConfig.from_env()).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import pytest
+
+import lunchbot.circuit_breaker as circuit_breaker
+import lunchbot.generation_scheduler as generation_scheduler
+import lunchbot.page_cache as page_cache
+import lunchbot.translation_cache as translation_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Use an empty cache directory and fresh shared caches in every test."""
+    monkeypatch.setenv("LUNCHBOT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+    monkeypatch.setattr(circuit_breaker, "_store", None)
+    monkeypatch.setattr(page_cache, "_default_cache", None)
+    monkeypatch.setattr(translation_cache, "_default_cache", None)
+    monkeypatch.setattr(generation_scheduler, "_default_scheduler", None)
+    return tmp_path / "cache"
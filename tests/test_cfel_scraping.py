@@ -0,0 +1,98 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import lunchbot.circuit_breaker as circuit_breaker
+import lunchbot.page_cache as page_cache
+import lunchbot.utils as utils
+from lunchbot.cfel_scraping import fetch_todays_lunch_menu
+from lunchbot.circuit_breaker import get_circuit_breaker
+
+MEAL = """
+<div class="aw-meal row no-margin-xs">
+  <p class="aw-meal-description">{name}</p>
+  <p class="small aw-meal-attributes">{attributes}</p>
+  <div class="col-sm-2 no-padding-xs aw-meal-price">{price}</div>
+</div>
+"""
+
+PAGE = "<html><body>{}</body></html>".format(
+    MEAL.format(name="Linsensuppe", attributes="vegan", price="3,50 €")
+    + MEAL.format(name="Schnitzel mit Pommes", attributes="", price="6,90 €")
+)
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    text = PAGE
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeChat:
+    """The chat API, it answers with "<name> (en)" while it is ``up``."""
+
+    def __init__(self):
+        self.up = True
+
+    def create(self, model, messages, **kwargs):
+        if not self.up:
+            raise RuntimeError("service unavailable")
+        prompt = messages[-1]["content"]
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            meal_names = json.loads(prompt[prompt.index("\n[") + 1 :])
+            content = json.dumps({"translations": [f"{m} (en)" for m in meal_names]})
+        else:
+            content = f"{prompt.splitlines()[-1]} (en)"
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    chat = FakeChat()
+    monkeypatch.setattr(utils, "_create_chat_completion", chat.create)
+    session = SimpleNamespace(get=lambda url, **kwargs: FakeResponse())
+    monkeypatch.setattr(page_cache, "get_session", lambda: session)
+    return chat
+
+
+def names(dishes):
+    return [dish["name"] for dish in dishes]
+
+
+def test_names_are_translated(chat):
+    dishes = fetch_todays_lunch_menu("https://cfel.example.com/menu")
+    assert names(dishes) == ["Linsensuppe (en)", "Schnitzel mit Pommes (en)"]
+    assert [dish["info"] for dish in dishes] == ["vegan", ""]
+
+
+def test_untranslated_names_are_translated_once_the_api_is_back(chat, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    breaker = get_circuit_breaker("openai_chat")
+    chat.up = False
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(RuntimeError):
+            breaker.call(lambda: utils._create_chat_completion("model", []))
+
+    # the breaker is open: better a German menu than none
+    dishes = fetch_todays_lunch_menu("https://cfel.example.com/menu")
+    assert names(dishes) == ["Linsensuppe", "Schnitzel mit Pommes"]
+
+    # the API is back, the same page (from the parse cache) is translated
+    chat.up = True
+    clock.now += breaker.reset_timeout
+    dishes = fetch_todays_lunch_menu("https://cfel.example.com/menu")
+    assert names(dishes) == ["Linsensuppe (en)", "Schnitzel mit Pommes (en)"]
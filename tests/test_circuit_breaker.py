@@ -0,0 +1,143 @@
+import pytest
+
+import lunchbot.circuit_breaker as circuit_breaker
+from lunchbot.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakerStore,
+    CircuitOpenError,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+def fail():
+    raise RuntimeError("service unavailable")
+
+
+def call_failing(breaker, times=1):
+    for _ in range(times):
+        with pytest.raises(RuntimeError, match="service unavailable"):
+            breaker.call(fail)
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker("service", failure_threshold=3, reset_timeout=60)
+    call_failing(breaker, 2)
+    assert breaker.state == CLOSED
+
+    call_failing(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError, match="service unavailable"):
+        breaker.call(lambda: "ok")
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_success_resets_the_failures(clock):
+    breaker = CircuitBreaker("service", failure_threshold=2)
+    call_failing(breaker)
+    assert breaker.call(lambda: "ok") == "ok"
+    call_failing(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_closes_the_breaker(clock):
+    breaker = CircuitBreaker("service", failure_threshold=1, reset_timeout=60)
+    call_failing(breaker)
+    clock.now += 59
+    assert breaker.state == OPEN
+
+    clock.now += 1
+    assert breaker.state == HALF_OPEN
+    breaker.check()
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker("service", failure_threshold=3, reset_timeout=60)
+    call_failing(breaker, 3)
+    clock.now += 60
+
+    # a single failed probe is enough
+    call_failing(breaker)
+    assert breaker.state == OPEN
+    clock.now += 59
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+    clock.now += 1
+    assert breaker.state == HALF_OPEN
+
+
+def test_only_one_probe_at_a_time(clock):
+    breaker = CircuitBreaker("service", failure_threshold=1, reset_timeout=60)
+    call_failing(breaker)
+    clock.now += 60
+
+    def probe():
+        # a second call while the probe is running is rejected
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: "ok")
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+        return "probed"
+
+    assert breaker.call(probe) == "probed"
+    assert breaker.state == CLOSED
+
+
+def test_failed_results_and_ignored_errors(clock):
+    breaker = CircuitBreaker("service", failure_threshold=2)
+    for _ in range(2):
+        assert breaker.call(lambda: 503, failed=lambda status: status >= 500) == 503
+    assert breaker.state == OPEN
+
+    breaker = CircuitBreaker("service", failure_threshold=1)
+    with pytest.raises(RuntimeError):
+        breaker.call(fail, ignore=lambda e: isinstance(e, RuntimeError))
+    assert breaker.state == CLOSED
+
+
+def test_ignored_error_releases_the_probe(clock):
+    breaker = CircuitBreaker("service", failure_threshold=1, reset_timeout=60)
+    call_failing(breaker)
+    clock.now += 60
+    with pytest.raises(RuntimeError):
+        breaker.call(fail, ignore=lambda e: True)
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_disabled_breaker_lets_everything_through(clock):
+    breaker = CircuitBreaker("service", failure_threshold=1, enabled=False)
+    call_failing(breaker, 3)
+    assert breaker.call(lambda: "ok") == "ok"
+
+
+def test_state_is_persisted(clock, tmp_path):
+    store = CircuitBreakerStore(str(tmp_path / "breakers.json"))
+    breaker = CircuitBreaker("service", failure_threshold=1, store=store)
+    call_failing(breaker)
+
+    # e.g. the next run
+    breaker = CircuitBreaker("service", failure_threshold=1, store=store)
+    assert breaker.state == OPEN
+    assert store.load("service")["last_error"] == "service unavailable"
+    assert CircuitBreaker("other", store=store).state == CLOSED
@@ -0,0 +1,35 @@
+import pytest
+
+from lunchbot.fingerprint import canonicalize_dish_name, dish_fingerprint
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "Chicken-Curry with Rice",
+        " Chicken-Curry (A, G)  with Rice 4,50 € ",
+        "chicken curry (1,3,a,g) with rice",
+        "Chicken Curry (a1, c, 12) with Rice € 4.50",
+        "Chicken Curry with Rice A, C, G",
+    ],
+)
+def test_variations_share_the_fingerprint(name):
+    assert canonicalize_dish_name(name) == "chicken curry with rice"
+    assert dish_fingerprint(name) == dish_fingerprint("Chicken-Curry with Rice")
+
+
+def test_size_labels_are_kept():
+    assert canonicalize_dish_name("Pizza Margherita (XL) (1, 3, A)") == (
+        "pizza margherita xl"
+    )
+    fingerprints = {
+        dish_fingerprint(name)
+        for name in [
+            "Pizza Margherita",
+            "Pizza Margherita (XL)",
+            "Chicken Nuggets (2 Stk)",
+            "Chicken Nuggets (6 Stk)",
+            "Chicken Nuggets",
+        ]
+    }
+    assert len(fingerprints) == 5
@@ -0,0 +1,42 @@
+from urllib3.util.retry import Retry
+
+import lunchbot.http_session as http_session
+from lunchbot.http_session import create_session
+
+
+class RetryWithoutJitter(Retry):
+    """``Retry`` of urllib3 1.26, which has no ``backoff_jitter``."""
+
+    def __init__(
+        self,
+        total=10,
+        status_forcelist=None,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        backoff_factor=0,
+        raise_on_status=True,
+    ):
+        super().__init__(
+            total=total,
+            status_forcelist=status_forcelist,
+            allowed_methods=allowed_methods,
+            backoff_factor=backoff_factor,
+            raise_on_status=raise_on_status,
+        )
+
+
+def retry_of(session):
+    return session.get_adapter("https://example.com").max_retries
+
+
+def test_retries_with_jitter():
+    retry = retry_of(create_session(retries=4, backoff_jitter=0.25))
+    assert retry.total == 4
+    assert retry.backoff_jitter == 0.25
+
+
+def test_session_without_jitter_support(monkeypatch):
+    monkeypatch.setattr(http_session, "Retry", RetryWithoutJitter)
+    retry = retry_of(create_session(retries=4, backoff_factor=0.1))
+    assert isinstance(retry, RetryWithoutJitter)
+    assert retry.total == 4
+    assert retry.backoff_factor == 0.1
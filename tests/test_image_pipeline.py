@@ -0,0 +1,46 @@
+from lunchbot.fingerprint import AliasTable
+from lunchbot.image_generation import TECHNICAL_DIFFICULTIES_IMAGE_URL
+from lunchbot.image_pipeline import ImagePipeline, ImagePipelineConfig
+from lunchbot.message import render_table
+
+
+class EmptyImageIndex:
+    """An image cloud without any images."""
+
+    def exists(self, name):
+        return False
+
+    def add(self, name):
+        pass
+
+
+def make_pipeline(tmp_path):
+    config = ImagePipelineConfig(
+        api_to_use="openai",
+        image_cloud_upload_url="https://cloud.example.com/upload/",
+        image_cloud_upload_token="user:password",
+        image_cloud_download_url="https://cloud.example.com/images/",
+        similarity_threshold=None,
+    )
+    return ImagePipeline(
+        config,
+        image_index=EmptyImageIndex(),
+        aliases=AliasTable(str(tmp_path / "aliases.json")),
+    )
+
+
+def test_failed_generation_shows_the_placeholder(tmp_path, monkeypatch):
+    pipeline = make_pipeline(tmp_path)
+    monkeypatch.setattr(pipeline, "_generate", lambda dish_name, priority: None)
+    # e.g. a prefetched dish whose image is generated again
+    dish = {
+        "name": "Linsensuppe",
+        "image_url": "https://cloud.example.com/images/old.png",
+        "thumbnail_url": "https://cloud.example.com/images/old.webp",
+    }
+
+    pipeline.run([dish])
+    assert dish["image_url"] == TECHNICAL_DIFFICULTIES_IMAGE_URL
+    assert dish["thumbnail_url"] == TECHNICAL_DIFFICULTIES_IMAGE_URL
+    assert dish["generation_info_tag"] == "Image generation failed"
+    assert "old.webp" not in render_table([dish])
@@ -0,0 +1,77 @@
+from dataclasses import asdict
+
+import pytest
+
+from lunchbot.message import (
+    MAX_MESSAGE_LENGTH,
+    Dish,
+    compose_messages,
+    message_overhead,
+    render_table,
+    split_table,
+)
+
+
+def make_dishes(count, canteens=("DESY Canteen", "Cafe CFEL")):
+    return [
+        {
+            "name": f"Dish {i} with a rather long description " + 20 * "x",
+            "price": "5.50 €",
+            "info": "vegan",
+            "canteen": canteens[i % len(canteens)],
+            "image_url": f"https://cloud.example.com/images/{i:040d}.png",
+            "thumbnail_url": f"https://cloud.example.com/thumbnails/{i:040d}.webp",
+            "generation_info_tag": "existing image",
+        }
+        for i in range(count)
+    ]
+
+
+CANTEEN_URLS = {
+    "DESY Canteen": "https://desy.myalsterfood.de/",
+    "Cafe CFEL": "https://www.cfel.de/cafe",
+}
+
+
+def test_small_menu_is_a_single_table():
+    tables = split_table(make_dishes(5), canteen_urls=CANTEEN_URLS)
+    assert len(tables) == 1
+    assert tables[0].count("Dish ") == 5
+
+
+@pytest.mark.parametrize("count", [50, 200, 1000])
+def test_messages_stay_under_the_limit(count):
+    prefix, suffix = "#### Lunch menu", "Enjoy your meal! " * 20
+    tables = split_table(
+        make_dishes(count),
+        max_length=MAX_MESSAGE_LENGTH - message_overhead(prefix, suffix),
+        canteen_urls=CANTEEN_URLS,
+    )
+    messages = compose_messages(tables, prefix, suffix)
+
+    assert len(messages) > 1
+    assert all(len(message) <= MAX_MESSAGE_LENGTH for message in messages)
+    assert messages[0].startswith(prefix)
+    assert messages[-1].endswith(suffix)
+    # every dish is posted exactly once
+    assert sum(table.count("| Dish ") for table in tables) == count
+
+
+def test_tables_are_split_by_canteen():
+    dishes = make_dishes(20)
+    tables = split_table(dishes, max_length=len(split_table(dishes)[0]) - 1)
+    assert len(tables) == 2
+    assert "Cafe CFEL" not in tables[0]
+    assert "DESY Canteen" not in tables[1]
+
+
+def test_empty_info_is_kept():
+    dish = {"name": "Schnitzel", "price": "6.90 €", "info": "", "canteen": None}
+    record = Dish.from_dict(dish)
+    assert record.info == ""
+    # only missing values become "N/A"
+    assert record.canteen == "N/A"
+    assert Dish.from_dict(asdict(record)) == record
+
+    rows = render_table([dish]).splitlines()
+    assert rows[4] == "|  |"
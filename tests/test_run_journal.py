@@ -0,0 +1,129 @@
+import os
+from datetime import date
+
+import pytest
+
+import lunchbot.fanout as fanout
+from lunchbot.fanout import WebhookTarget, post_to_targets
+from lunchbot.image_generation import TECHNICAL_DIFFICULTIES_IMAGE_URL
+from lunchbot.run_journal import RunJournal
+
+DAY = date(2026, 10, 12)
+
+
+class FakeWebhooks:
+    """Records the posted messages, the webhooks (or ``(webhook, message)``) in
+    ``down`` fail."""
+
+    def __init__(self, monkeypatch):
+        self.posts = []
+        self.down = set()
+        monkeypatch.setattr(fanout, "send_message_via_webhook", self.send)
+        # no backoff between the attempts
+        monkeypatch.setattr("lunchbot.http_session.time.sleep", lambda seconds: None)
+
+    def send(self, webhook_url, message, username):
+        if webhook_url in self.down or (webhook_url, message) in self.down:
+            raise RuntimeError(f"{webhook_url} is down")
+        self.posts.append((webhook_url, message))
+
+
+@pytest.fixture
+def webhooks(monkeypatch):
+    return FakeWebhooks(monkeypatch)
+
+
+def make_targets():
+    return [
+        WebhookTarget("lunch", "http://lunch", prefix="Lunch", suffix="", attempts=2),
+        WebhookTarget("team", "http://team", prefix="Team", suffix="", attempts=2),
+    ]
+
+
+def test_resume_after_partial_post(webhooks, tmp_path):
+    journal = RunJournal(DAY, cache_dir=str(tmp_path))
+    tables = ["table 1", "table 2", "table 3"]
+    lunch_messages = make_targets()[0].render(tables, date=DAY)
+    # the second message of a channel fails
+    webhooks.down.add(("http://lunch", lunch_messages[1]))
+
+    results = post_to_targets(make_targets(), tables, date=DAY, journal=journal)
+    assert [(r.ok, r.posts) for r in results] == [(False, 1), (True, 3)]
+    assert journal.posted("lunch") == 1
+    assert not journal.is_posted(["lunch", "team"])
+
+    # the rerun (a new process) only posts the missing messages to "lunch"
+    webhooks.down.clear()
+    webhooks.posts.clear()
+    journal = RunJournal(DAY, cache_dir=str(tmp_path))
+    results = post_to_targets(make_targets(), tables, date=DAY, journal=journal)
+    assert [(r.ok, r.posts, r.skipped) for r in results] == [(True, 2, 1), (True, 0, 3)]
+    assert webhooks.posts == [("http://lunch", m) for m in lunch_messages[1:]]
+    assert journal.is_posted(["lunch", "team"])
+
+
+def test_resume_posts_the_messages_of_the_first_run(webhooks, tmp_path):
+    journal = RunJournal(DAY, cache_dir=str(tmp_path))
+    webhooks.down.add("http://lunch")
+    post_to_targets(make_targets(), ["old table"], date=DAY, journal=journal)
+
+    # the menu changed in between, but the channel gets the rendering it was
+    # promised in the first run
+    webhooks.down.clear()
+    webhooks.posts.clear()
+    post_to_targets(make_targets(), ["new table"], date=DAY, journal=journal)
+    assert len(webhooks.posts) == 1
+    assert "old table" in webhooks.posts[0][1]
+
+
+def test_completed_post_is_not_repeated(webhooks, tmp_path):
+    journal = RunJournal(DAY, cache_dir=str(tmp_path))
+    post_to_targets(make_targets(), ["table"], date=DAY, journal=journal)
+    assert len(webhooks.posts) == 2
+
+    webhooks.posts.clear()
+    results = post_to_targets(make_targets(), ["table"], date=DAY, journal=journal)
+    assert webhooks.posts == []
+    assert all(r.ok and r.posts == 0 for r in results)
+
+
+def test_images_are_restored_without_placeholders(tmp_path):
+    journal = RunJournal(DAY, cache_dir=str(tmp_path))
+    dishes = [
+        {"name": "Suppe", "image_url": "https://cloud/suppe.png"},
+        {"name": "Brot", "image_url": TECHNICAL_DIFFICULTIES_IMAGE_URL},
+    ]
+    for dish in dishes:
+        dish["fingerprint"] = dish["name"].lower()
+    journal.save_images(dishes)
+
+    rerun = [
+        {"name": "Suppe", "fingerprint": "suppe"},
+        {"name": "Brot", "fingerprint": "brot"},
+    ]
+    pending = RunJournal(DAY, cache_dir=str(tmp_path)).restore_images(rerun)
+    assert rerun[0]["image_url"] == "https://cloud/suppe.png"
+    # the placeholder was not recorded, the failed image is generated again
+    assert rerun[1].get("image_url") != TECHNICAL_DIFFICULTIES_IMAGE_URL
+    assert pending == [rerun[1]]
+
+
+def test_journal_of_another_day_is_ignored(tmp_path):
+    other_day = RunJournal(date(2026, 10, 5), cache_dir=str(tmp_path))
+    other_day.save_dishes([{"name": "Suppe"}])
+    # e.g. a journal that was copied or restored under the wrong name
+    os.replace(other_day.path, RunJournal(DAY, cache_dir=str(tmp_path)).path)
+
+    journal = RunJournal(DAY, cache_dir=str(tmp_path))
+    assert journal.dishes() is None
+    assert journal.scraped_dishes() is None
+
+
+def test_prune_removes_old_journals(tmp_path):
+    RunJournal(DAY, cache_dir=str(tmp_path)).save_dishes([{"name": "Suppe"}])
+    assert RunJournal(DAY, cache_dir=str(tmp_path)).dishes() == [{"name": "Suppe"}]
+
+    RunJournal(date(2026, 10, 13), cache_dir=str(tmp_path)).prune(
+        before=date(2026, 10, 13)
+    )
+    assert RunJournal(DAY, cache_dir=str(tmp_path)).dishes() is None